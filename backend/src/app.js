@@ -9,7 +9,11 @@ const app = express();
 // --- Middleware ---
 // Enable CORS for all routes - essential for frontend to communicate
 app.use(cors());
-// Parse JSON bodies for incoming requests
+// Parse JSON bodies for incoming requests. Batch reports (e.g. a device replaying readings
+// spooled during an outage) get a larger limit than express.json()'s default 100kb.
+app.use('/api/sensor_data/:device_id/report_batch', express.json({ limit: '5mb' }));
+// Channel results carry whole command outputs (apt runs, execute_command), like the direct HTTP path
+app.use('/api/devices/:device_id/channel/results', express.json({ limit: '10mb' }));
 app.use(express.json());
 
 // --- API Routes ---
@@ -0,0 +1,128 @@
+// src/controllers/commandChannelController.js
+// Outbound command channel: agents long-poll the master for commands, so the master
+// never has to open a connection to the device (works behind NAT/CGNAT).
+const crypto = require('crypto');
+
+const CHANNEL_MAX_WAIT_SECONDS = 30; // Longest the master holds a poll open
+const CHANNEL_STALE_MS = 15000; // A device counts as connected until this long after its last poll ended
+const CHANNEL_COMMAND_TIMEOUT_MS = 300000; // How long sendCommand waits for the device's result
+const CHANNEL_JOB_TIMEOUT_MS = 30000; // How long starting a job or fetching its status may take
+
+// device_id -> { queue: [commands], waiter: { res, timer } | null, lastSeen: ms, pending: Map(request_id -> { resolve, reject, timer }) }
+const channels = new Map();
+
+function getChannel(device_id) {
+    let channel = channels.get(device_id);
+    if (!channel) {
+        channel = { queue: [], waiter: null, lastSeen: 0, pending: new Map() };
+        channels.set(device_id, channel);
+    }
+    return channel;
+}
+
+// Answers the device's open poll (if any) with every queued command
+function flushQueue(channel) {
+    if (!channel.waiter || channel.queue.length === 0) {
+        return;
+    }
+    const { res, timer } = channel.waiter;
+    clearTimeout(timer);
+    channel.waiter = null;
+    channel.lastSeen = Date.now();
+    res.status(200).json({ commands: channel.queue.splice(0) });
+}
+
+// True while the device has a poll open or polled recently
+exports.isConnected = (device_id) => {
+    const channel = channels.get(device_id);
+    return !!channel && (channel.waiter !== null || Date.now() - channel.lastSeen < CHANNEL_STALE_MS);
+};
+
+// Queues a message for the device and resolves with { statusCode, body } once it reports the result
+function enqueue(device_id, message, timeoutMs) {
+    const channel = getChannel(device_id);
+    const request_id = crypto.randomUUID();
+    return new Promise((resolve, reject) => {
+        const timer = setTimeout(() => {
+            channel.pending.delete(request_id);
+            const index = channel.queue.findIndex((queued) => queued.request_id === request_id);
+            if (index !== -1) {
+                channel.queue.splice(index, 1);
+            }
+            reject(new Error(`Device '${device_id}' did not return a result within ${timeoutMs / 1000} seconds.`));
+        }, timeoutMs);
+        channel.pending.set(request_id, { resolve, reject, timer });
+        channel.queue.push({ request_id, ...message });
+        flushQueue(channel);
+    });
+}
+
+// Runs one command on the device; resolves with { statusCode, body } once it reports the result.
+// With runAsync the device starts it as a background job and answers at once with its job_id.
+exports.sendCommand = (device_id, command, value, runAsync = false, timeoutMs = runAsync ? CHANNEL_JOB_TIMEOUT_MS : CHANNEL_COMMAND_TIMEOUT_MS) =>
+    enqueue(device_id, runAsync ? { command, value, async: true } : { command, value }, timeoutMs);
+
+// Fetches a background job's state and the output written after `offset`, like GET /jobs/<job_id> on the device
+exports.getJob = (device_id, job_id, offset = 0, timeoutMs = CHANNEL_JOB_TIMEOUT_MS) =>
+    enqueue(device_id, { job_id, offset }, timeoutMs);
+
+// Runs a command batch on the device, like POST /execute_batch; body is the agent's batch response
+exports.sendBatch = (device_id, commands, timeoutMs = CHANNEL_COMMAND_TIMEOUT_MS) =>
+    enqueue(device_id, { commands }, timeoutMs);
+
+// POST /api/devices/:device_id/channel/poll - Held open until commands are queued or the wait expires
+// Body: { wait_seconds }. Response: { commands: [{ request_id, command, value[, async] }, { request_id, commands: [...] }
+// or { request_id, job_id, offset }, ...] }
+// (empty on heartbeat)
+exports.pollCommands = (req, res) => {
+    const { device_id } = req.params;
+    const requestedWait = parseFloat(req.body && req.body.wait_seconds);
+    const waitSeconds = Math.min(requestedWait > 0 ? requestedWait : CHANNEL_MAX_WAIT_SECONDS, CHANNEL_MAX_WAIT_SECONDS);
+    const channel = getChannel(device_id);
+    channel.lastSeen = Date.now();
+
+    if (channel.waiter) {
+        // A newer poll replaces a stale one (e.g. the agent reconnected)
+        clearTimeout(channel.waiter.timer);
+        channel.waiter.res.status(200).json({ commands: [] });
+    }
+    const timer = setTimeout(() => {
+        if (channel.waiter && channel.waiter.res === res) {
+            channel.waiter = null;
+            channel.lastSeen = Date.now();
+            res.status(200).json({ commands: [] });
+        }
+    }, waitSeconds * 1000);
+    channel.waiter = { res, timer };
+    res.on('close', () => {
+        if (channel.waiter && channel.waiter.res === res) {
+            clearTimeout(timer);
+            channel.waiter = null;
+        }
+    });
+    flushQueue(channel);
+};
+
+// POST /api/devices/:device_id/channel/results - Results for commands received over the channel
+// Body: { results: [{ request_id, status_code, body }, ...] }
+exports.postResults = (req, res) => {
+    const { device_id } = req.params;
+    const results = req.body && req.body.results;
+    if (!Array.isArray(results)) {
+        return res.status(400).json({ error: "A 'results' array is required in the request body." });
+    }
+    const channel = getChannel(device_id);
+    channel.lastSeen = Date.now();
+    let accepted = 0;
+    for (const result of results) {
+        const pending = result && channel.pending.get(result.request_id);
+        if (!pending) {
+            continue; // Unknown or already timed out
+        }
+        clearTimeout(pending.timer);
+        channel.pending.delete(result.request_id);
+        pending.resolve({ statusCode: result.status_code, body: result.body });
+        accepted += 1;
+    }
+    res.status(200).json({ accepted });
+};
@@ -3,10 +3,12 @@ const { getDevicesCollection } = require('../config/mongo');
 const { ObjectId } = require('mongodb');
 const http = require('http'); // ADDED: Node.js built-in HTTP module
 const https = require('https'); // ADDED: Node.js built-in HTTPS module
+const commandChannel = require('./commandChannelController');
 
 // Configuration for slave device's API (adjust as needed for your slave app)
 const SLAVE_API_PORT = 5001; // Assuming slave devices run their own API on this port
 const SLAVE_API_PATH = '/execute_command'; // Path on the slave device's API for commands
+const SLAVE_BATCH_API_PATH = '/execute_batch'; // Path on the slave device's API for command batches
 
 // Helper to generate a dummy device ID
 function generateDeviceId() {
@@ -217,10 +219,14 @@ exports.sendPiCommand = async (req, res) => {
         const devicesCollection = getDevicesCollection();
         const { device_id } = req.params;
         const { command, value } = req.body; // Expect command and optional value in body
+        const runAsync = req.body.async; // true: run as a background job on the device, poll GET /:device_id/jobs/:job_id
 
         if (!device_id || !command) {
             return res.status(400).json({ error: "Device ID and command are required." });
         }
+        if (runAsync !== undefined && typeof runAsync !== 'boolean') {
+            return res.status(400).json({ error: "'async' must be true or false." });
+        }
 
         // Look up device details (IP, public_key) from the database
         const device = await devicesCollection.findOne({ device_id: device_id });
@@ -228,6 +234,10 @@ exports.sendPiCommand = async (req, res) => {
         if (!device) {
             return res.status(404).json({ error: `Device with ID '${device_id}' not found.` });
         }
+        if (commandChannel.isConnected(device_id)) {
+            // The device holds an open command channel: no inbound connection or IP address needed
+            return sendPiCommandOverChannel(res, device, command, value, runAsync === true);
+        }
         if (!device.ip_address) {
             // Updated error message to be more explicit about required IP for command
             return res.status(400).json({ error: `Device '${device_id}' does not have an IP address configured. Cannot send command.` });
@@ -242,6 +252,7 @@ exports.sendPiCommand = async (req, res) => {
         const payload = {
             command: command,
             value: value,
+            ...(runAsync && { async: true }),
         };
 
         // Determine which module to use (http or https) based on the URL protocol
@@ -270,7 +281,7 @@ exports.sendPiCommand = async (req, res) => {
                     if (slaveResponse.statusCode >= 200 && slaveResponse.statusCode < 300) {
                         res.status(200).json({
                             message: `Command '${command}' sent successfully to ${device.name}.`,
-                            slave_response: slaveJson
+                            slave_response: withMasterJobUrl(device, slaveJson)
                         });
                     } else {
                         console.error(`Error from Slave Device (${device.ip_address}): ${slaveResponse.statusCode} - ${responseData}`);
@@ -302,3 +313,150 @@ exports.sendPiCommand = async (req, res) => {
         res.status(500).json({ error: `Failed to send command due to setup error: ${error.message}` });
     }
 };
+
+// Sends a command over the device's command channel and answers like the HTTP path does
+async function sendPiCommandOverChannel(res, device, command, value, runAsync) {
+    console.log(`Sending command to ${device.name} over its command channel:`, { command, value, async: runAsync });
+    try {
+        const { statusCode, body } = await commandChannel.sendCommand(device.device_id, command, value, runAsync);
+        if (statusCode >= 200 && statusCode < 300) {
+            res.status(200).json({
+                message: `Command '${command}' sent successfully to ${device.name}.`,
+                slave_response: withMasterJobUrl(device, body)
+            });
+        } else {
+            res.status(statusCode || 500).json({
+                error: `Failed to send command to slave device. Device responded with status ${statusCode}.`,
+                details: body
+            });
+        }
+    } catch (error) {
+        console.error(`Error sending command to ${device.device_id} over its command channel:`, error);
+        res.status(504).json({ error: `Failed to send command: ${error.message}` });
+    }
+}
+
+// The device's job_url is relative to the device; point callers at the master's job route instead
+function withMasterJobUrl(device, body) {
+    if (!body || !body.job_id) {
+        return body;
+    }
+    return { ...body, job_url: `/api/devices/${device.device_id}/jobs/${body.job_id}` };
+}
+
+// Helper to send a request (with an optional JSON payload) to a slave device and resolve with { statusCode, body }
+function requestSlave(device, method, path, payload) {
+    return new Promise((resolve, reject) => {
+        const url = new URL(`http://${device.ip_address}:${SLAVE_API_PORT}${path}`);
+        const request = http.request(url, { method, headers: { 'Content-Type': 'application/json' } }, (slaveResponse) => {
+            let responseData = '';
+            slaveResponse.on('data', (chunk) => {
+                responseData += chunk;
+            });
+            slaveResponse.on('end', () => {
+                try {
+                    resolve({ statusCode: slaveResponse.statusCode, body: JSON.parse(responseData) });
+                } catch (parseError) {
+                    reject(new Error(`Failed to parse response from slave device: ${parseError.message}, Raw: ${responseData}`));
+                }
+            });
+        });
+        request.on('error', reject);
+        if (payload !== undefined) {
+            request.write(JSON.stringify(payload));
+        }
+        request.end();
+    });
+}
+
+// POST /api/devices/:device_id/command_batch - Send several commands to a device in one request
+// Body: { commands: [{ command, value }, ...] }
+exports.sendPiCommandBatch = async (req, res) => {
+    try {
+        const devicesCollection = getDevicesCollection();
+        const { device_id } = req.params;
+        const { commands } = req.body;
+
+        if (!device_id || !Array.isArray(commands) || commands.length === 0) {
+            return res.status(400).json({ error: "Device ID and a non-empty commands array are required." });
+        }
+
+        const device = await devicesCollection.findOne({ device_id: device_id });
+        if (!device) {
+            return res.status(404).json({ error: `Device with ID '${device_id}' not found.` });
+        }
+
+        let statusCode, body;
+        if (commandChannel.isConnected(device_id)) {
+            // Same as sendPiCommand: devices holding a channel open get the batch over it, so NAT'd devices work
+            console.log(`Sending ${commands.length} commands to ${device.name} over its command channel as a batch`);
+            try {
+                ({ statusCode, body } = await commandChannel.sendBatch(device_id, commands));
+            } catch (error) {
+                console.error(`Error sending command batch to ${device_id} over its command channel:`, error);
+                return res.status(504).json({ error: `Failed to send command batch: ${error.message}` });
+            }
+        } else {
+            if (!device.ip_address) {
+                return res.status(400).json({ error: `Device '${device_id}' does not have an IP address configured. Cannot send command.` });
+            }
+            console.log(`Sending ${commands.length} commands to ${device.name} (${device.ip_address}) as a batch`);
+            ({ statusCode, body } = await requestSlave(device, 'POST', SLAVE_BATCH_API_PATH, { commands }));
+        }
+        if (statusCode >= 200 && statusCode < 300) {
+            res.status(200).json({
+                message: `Batch of ${commands.length} commands sent successfully to ${device.name}.`,
+                slave_response: body
+            });
+        } else {
+            res.status(statusCode || 500).json({
+                error: `Failed to send command batch to slave device. Device responded with status ${statusCode}.`,
+                details: body
+            });
+        }
+    } catch (error) {
+        console.error("Error sending command batch to slave device:", error);
+        res.status(500).json({ error: `Failed to send command batch: ${error.message}` });
+    }
+};
+
+// GET /api/devices/:device_id/jobs/:job_id - State and output of a background job started with { async: true }
+// ?offset=N returns only the output written after the previous poll's output_offset
+exports.getPiJob = async (req, res) => {
+    try {
+        const devicesCollection = getDevicesCollection();
+        const { device_id, job_id } = req.params;
+        const offset = Math.max(parseInt(req.query.offset, 10) || 0, 0);
+
+        const device = await devicesCollection.findOne({ device_id: device_id });
+        if (!device) {
+            return res.status(404).json({ error: `Device with ID '${device_id}' not found.` });
+        }
+
+        let statusCode, body;
+        if (commandChannel.isConnected(device_id)) {
+            try {
+                ({ statusCode, body } = await commandChannel.getJob(device_id, job_id, offset));
+            } catch (error) {
+                console.error(`Error fetching job ${job_id} from ${device_id} over its command channel:`, error);
+                return res.status(504).json({ error: `Failed to fetch job: ${error.message}` });
+            }
+        } else {
+            if (!device.ip_address) {
+                return res.status(400).json({ error: `Device '${device_id}' does not have an IP address configured. Cannot fetch job.` });
+            }
+            ({ statusCode, body } = await requestSlave(device, 'GET', `/jobs/${encodeURIComponent(job_id)}?offset=${offset}`));
+        }
+        if (statusCode >= 200 && statusCode < 300) {
+            res.status(200).json(body);
+        } else {
+            res.status(statusCode || 500).json({
+                error: `Failed to fetch job from slave device. Device responded with status ${statusCode}.`,
+                details: body
+            });
+        }
+    } catch (error) {
+        console.error("Error fetching job from slave device:", error);
+        res.status(500).json({ error: `Failed to fetch job: ${error.message}` });
+    }
+};
@@ -11,6 +11,15 @@ function generateRandomSensorData() {
     return { temperature: temp, humidity: hum, status: status };
 }
 
+// Helper to copy an agent's optional window summary onto a sensor document.
+// window: { started_at, ended_at, temperature: { min, max, mean, p95, count }, humidity: {...} }
+function withWindowSummary(sensorDocument, data) {
+    if (data.window && typeof data.window === 'object' && !Array.isArray(data.window)) {
+        sensorDocument.window = data.window;
+    }
+    return sensorDocument;
+}
+
 // GET /api/dashboard_data - Fetches latest sensor data and averages
 exports.getDashboardData = async (req, res) => {
     try {
@@ -155,7 +164,7 @@ exports.addDeviceSensorData = async (req, res) => {
             return res.status(400).json({ error: "Invalid timestamp format. Use ISO format (YYYY-MM-DDTHH:MM:SS.ffffff)." });
         }
 
-        const sensorDocument = {
+        const sensorDocument = withWindowSummary({
             device_id: device_id, // Link sensor data to the device
             timestamp: timestamp,
             status: data.status || "active",
@@ -164,7 +173,7 @@ exports.addDeviceSensorData = async (req, res) => {
             ip_address: req.ip || device.ip_address || null, // Prioritize current request IP, fallback to stored device IP
             mac_address: device.mac_address || null, // MAC is usually static, take from device doc
             createdAt: new Date()
-        };
+        }, data);
 
         // Insert sensor data
         const insertResult = await sensorCollection.insertOne(sensorDocument);
@@ -185,3 +194,69 @@ exports.addDeviceSensorData = async (req, res) => {
         res.status(500).json({ error: `Failed to add sensor data from device: ${error.message}` });
     }
 };
+
+// POST /api/sensor_data/:device_id/report_batch - Endpoint for managed devices to send a batch of sensor readings
+// Body: { readings: [{ timestamp, temperature, humidity, status, window? }, ...] }, optionally sent with Content-Encoding: gzip
+exports.addDeviceSensorDataBatch = async (req, res) => {
+    try {
+        const sensorCollection = getSensorCollection();
+        const devicesCollection = getDevicesCollection();
+        const { device_id } = req.params;
+        const readings = req.body && req.body.readings;
+
+        if (!device_id) {
+            return res.status(400).json({ error: "Device ID is required in the URL." });
+        }
+        if (!Array.isArray(readings) || readings.length === 0) {
+            return res.status(400).json({ error: "A non-empty 'readings' array is required in the request body." });
+        }
+
+        // Verify if the device exists (once for the whole batch)
+        const device = await devicesCollection.findOne({ device_id: device_id });
+        if (!device) {
+            return res.status(404).json({ error: `Device with ID '${device_id}' not found.` });
+        }
+
+        const now = new Date();
+        const ip_address = req.ip || device.ip_address || null;
+        const sensorDocuments = [];
+        for (const [index, data] of readings.entries()) {
+            if (!data || typeof data.temperature === 'undefined' || typeof data.humidity === 'undefined') {
+                return res.status(400).json({ error: `Reading ${index}: Temperature and Humidity are required.` });
+            }
+            const timestamp = data.timestamp ? new Date(data.timestamp) : now;
+            if (isNaN(timestamp.getTime())) {
+                return res.status(400).json({ error: `Reading ${index}: Invalid timestamp format. Use ISO format (YYYY-MM-DDTHH:MM:SS.ffffff).` });
+            }
+            sensorDocuments.push(withWindowSummary({
+                device_id: device_id,
+                timestamp: timestamp,
+                status: data.status || "active",
+                temperature: parseFloat(data.temperature),
+                humidity: parseFloat(data.humidity),
+                ip_address: ip_address,
+                mac_address: device.mac_address || null,
+                createdAt: now
+            }, data));
+        }
+
+        // One round trip to MongoDB for the whole batch
+        const insertResult = await sensorCollection.insertMany(sensorDocuments, { ordered: false });
+
+        // Device status follows the most recent reading in the batch
+        const latest = readings[readings.length - 1];
+        await devicesCollection.updateOne(
+            { device_id: device_id },
+            { $set: { last_seen: now, status: latest.status || device.status } }
+        );
+
+        res.status(201).json({
+            message: `${insertResult.insertedCount} sensor readings from device '${device_id}' added successfully`,
+            inserted_count: insertResult.insertedCount
+        });
+
+    } catch (error) {
+        console.error(`Error adding sensor data batch from device '${req.params.device_id}':`, error);
+        res.status(500).json({ error: `Failed to add sensor data batch from device: ${error.message}` });
+    }
+};
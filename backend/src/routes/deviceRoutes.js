@@ -2,6 +2,7 @@
 const express = require('express');
 const router = express.Router();
 const deviceController = require('../controllers/deviceController');
+const commandChannelController = require('../controllers/commandChannelController');
 
 // GET /api/devices - List all devices (supports ?is_simulated=true/false)
 router.get('/', deviceController.listDevices);
@@ -16,5 +17,14 @@ router.post('/simulate', deviceController.simulateDevice);
 
 // POST /api/devices/:device_id/command - Send a command to a specific device
 router.post('/:device_id/command', deviceController.sendPiCommand);
+// POST /api/devices/:device_id/command_batch - Send several commands to a device in one round trip
+router.post('/:device_id/command_batch', deviceController.sendPiCommandBatch);
+// GET /api/devices/:device_id/jobs/:job_id - Poll a background job started with { async: true } (supports ?offset=N)
+router.get('/:device_id/jobs/:job_id', deviceController.getPiJob);
+
+// POST /api/devices/:device_id/channel/poll - Agent long-polls for commands (outbound command channel)
+router.post('/:device_id/channel/poll', commandChannelController.pollCommands);
+// POST /api/devices/:device_id/channel/results - Agent returns results of commands received over the channel
+router.post('/:device_id/channel/results', commandChannelController.postResults);
 
 module.exports = router;
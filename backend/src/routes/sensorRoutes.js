@@ -15,4 +15,7 @@ router.post('/simulate_data', sensorController.simulateData);
 // POST /api/:device_id/report - Route for managed devices to send sensor data
 router.post('/sensor_data/:device_id/report', sensorController.addDeviceSensorData);
 
+// POST /api/sensor_data/:device_id/report_batch - Route for managed devices to send batched (optionally gzipped) sensor data
+router.post('/sensor_data/:device_id/report_batch', sensorController.addDeviceSensorDataBatch);
+
 module.exports = router;
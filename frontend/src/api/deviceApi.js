@@ -97,3 +97,15 @@ export const sendCommand = async (deviceId, payload) => {
   });
   return handleResponse(response);
 };
+
+/**
+ * Fetches the state of a background job started with { async: true }.
+ * @param {string} deviceId The device_id of the device running the job.
+ * @param {string} jobId The job_id returned when the command was sent.
+ * @param {number} offset Output offset from the previous poll; only newer output is returned.
+ * @returns {Promise<Object>} A promise that resolves to { status, job }.
+ */
+export const getJob = async (deviceId, jobId, offset = 0) => {
+  const response = await fetch(`${API_BASE_URL}/${deviceId}/jobs/${jobId}?offset=${offset}`);
+  return handleResponse(response);
+};
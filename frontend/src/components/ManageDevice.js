@@ -1,6 +1,6 @@
 import React, { useState, useEffect, useRef } from 'react';
 // Assuming '../api/deviceApi' provides the actual API functions
-import { getDevices, addDevice, deleteDevice, sendCommand } from '../api/deviceApi';
+import { getDevices, addDevice, deleteDevice, sendCommand, getJob } from '../api/deviceApi';
 import toast, { Toaster } from 'react-hot-toast';
 import styles from './ManageDevices.module.css';
 
@@ -31,6 +31,10 @@ import {
 } from '@fortawesome/free-solid-svg-icons';
 // --- End Font Awesome Imports ---
 
+// Commands that can run for minutes: sent as background jobs and polled, so no request waits on them
+const ASYNC_COMMANDS = ['update_system', 'run_speedtest'];
+const JOB_POLL_INTERVAL_MS = 2000;
+
 const ManageDevices = () => {
   // State variables for managing device data and UI state
   const [devices, setDevices] = useState([]); // Stores the list of devices
@@ -208,12 +212,22 @@ const ManageDevices = () => {
     setLoading(true); // Set loading state
     setCommandResponse(null); // Clear previous command response
     setCopyButtonText('Copy'); // Reset copy button text
+    const runAsync = ASYNC_COMMANDS.includes(command);
     // Create payload, only include 'value' if it's not empty
-    const payload = { command, ...(value && value.trim() !== '' && { value }) };
+    const payload = { command, ...(value && value.trim() !== '' && { value }), ...(runAsync && { async: true }) };
     try {
       toast.loading(`Sending '${command}' to ${selectedDevice.name}...`, { id: 'sendCommandToast' }); // Show loading toast
       const response = await sendCommand(selectedDevice.device_id, payload); // Call the sendCommand API
       setCommandResponse(response); // Store the API response
+      const jobId = response.slave_response?.job_id;
+      if (runAsync && jobId) {
+        toast.loading(`'${command}' is running on ${selectedDevice.name}...`, { id: 'sendCommandToast' });
+        const job = await pollJob(selectedDevice.device_id, jobId);
+        if (job.state !== 'succeeded') {
+          toast.error(`'${command}' failed. See response for details.`, { id: 'sendCommandToast', duration: 5000 });
+          return;
+        }
+      }
       toast.success('Command sent successfully!', { id: 'sendCommandToast', duration: 3000 }); // Show success toast
     } catch (err) {
       // Handle errors during command sending
@@ -226,6 +240,22 @@ const ManageDevices = () => {
     }
   };
 
+  // Polls a background job until it finishes, showing its output as it arrives; resolves with the finished job
+  const pollJob = async (deviceId, jobId) => {
+    let offset = 0;
+    let output = '';
+    for (;;) {
+      const { job } = await getJob(deviceId, jobId, offset);
+      output += job.output;
+      offset = job.output_offset;
+      setCommandResponse({ ...job, output });
+      if (job.state === 'succeeded' || job.state === 'failed') {
+        return job;
+      }
+      await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+    }
+  };
+
   // Utility function to format JSON data for display in <pre> tags
   const formatJson = (data) => JSON.stringify(data, null, 2);
 
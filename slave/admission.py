@@ -0,0 +1,176 @@
+# admission.py
+# Admission control in front of the command handlers: single-flight coalescing
+# of identical requests and a per-command concurrency limit with a bounded queue.
+import json
+import math
+import threading
+import time
+
+
+class CommandRejected(Exception):
+    """
+    Raised when a command's concurrency limit and wait queue are both full,
+    or a queued request waited too long. `retry_after` is a hint in seconds.
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Gate:
+    def __init__(self, max_concurrent, max_queued):
+        self.max_concurrent = max_concurrent # None means unlimited
+        self.max_queued = max_queued
+        self.running = 0
+        self.waiting = 0
+        self.available = threading.Condition()
+        self.admitted = 0
+        self.queued = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.peak_running = 0
+        self.total_seconds = 0.0
+        self.completed = 0
+
+    def retry_after(self):
+        # About one average run of the command, and at least a second
+        average = self.total_seconds / self.completed if self.completed else 1
+        return max(1, math.ceil(average))
+
+
+class AdmissionController:
+    """
+    Runs commands through run(command, value, func).
+
+    Requests with the same command and value that arrive while one is
+    already running wait for it and share its result instead of running
+    again, for every command `coalesce(command)` approves.
+
+    Each command gets `limits(command)` -> (max_concurrent, max_queued) or
+    None for no limit. Requests beyond max_concurrent wait in a queue of at
+    most max_queued for up to `max_wait_seconds`; anything else raises
+    CommandRejected straight away.
+    """
+
+    def __init__(self, limits, coalesce, max_wait_seconds=30):
+        self.limits = limits
+        self.coalesce = coalesce
+        self.max_wait_seconds = max_wait_seconds
+        self._gates = {}
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def run(self, command, value, func):
+        gate = self._gate(command)
+        key = self._flight_key(command, value)
+        if key is None:
+            return self._admit_and_run(command, gate, func)
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                gate.coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            if flight.result is not None:
+                return flight.result
+            # The leader died without a result (e.g. interpreter shutdown): run it ourselves
+            return self._admit_and_run(command, gate, func)
+
+        try:
+            flight.result = self._admit_and_run(command, gate, func)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stats(self):
+        """
+        Per-command admission counters for every command seen so far.
+        """
+        with self._lock:
+            gates = dict(self._gates)
+        stats = {}
+        for command, gate in gates.items():
+            with gate.available:
+                stats[command] = {
+                    "max_concurrent": gate.max_concurrent,
+                    "max_queued": gate.max_queued,
+                    "running": gate.running,
+                    "waiting": gate.waiting,
+                    "peak_running": gate.peak_running,
+                    "admitted": gate.admitted,
+                    "queued": gate.queued,
+                    "coalesced": gate.coalesced,
+                    "rejected": gate.rejected,
+                }
+        return stats
+
+    def _gate(self, command):
+        with self._lock:
+            gate = self._gates.get(command)
+            if gate is None:
+                max_concurrent, max_queued = self.limits(command) or (None, 0)
+                gate = self._gates[command] = _Gate(max_concurrent, max_queued)
+            return gate
+
+    def _flight_key(self, command, value):
+        if not self.coalesce(command):
+            return None
+        try:
+            return command, json.dumps(value, sort_keys=True)
+        except (TypeError, ValueError):
+            return None
+
+    def _admit_and_run(self, command, gate, func):
+        with gate.available:
+            if gate.max_concurrent is not None and gate.running >= gate.max_concurrent:
+                if gate.waiting >= gate.max_queued:
+                    gate.rejected += 1
+                    raise CommandRejected(
+                        f"'{command}' is already running {gate.running} time(s) with {gate.waiting} "
+                        f"request(s) waiting; try again later.", gate.retry_after())
+                gate.waiting += 1
+                gate.queued += 1
+                deadline = time.monotonic() + self.max_wait_seconds
+                try:
+                    while gate.running >= gate.max_concurrent:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            gate.rejected += 1
+                            raise CommandRejected(
+                                f"'{command}' waited {self.max_wait_seconds}s for a free slot; try again later.",
+                                gate.retry_after())
+                        gate.available.wait(remaining)
+                finally:
+                    gate.waiting -= 1
+            gate.running += 1
+            gate.admitted += 1
+            gate.peak_running = max(gate.peak_running, gate.running)
+
+        start = time.monotonic()
+        try:
+            return func()
+        finally:
+            with gate.available:
+                gate.running -= 1
+                gate.completed += 1
+                gate.total_seconds += time.monotonic() - start
+                gate.available.notify()
@@ -0,0 +1,360 @@
+# benchmark.py
+# Benchmarks for the agent's command and reporting hot paths. Drives the Flask app
+# in-process, with a local stub server standing in for the master, ifconfig.me and
+# ip-api.com, and prints JSON for comparing runs. Run from this directory, e.g.
+#   python benchmark.py --iterations 200 --output bench.json
+import argparse
+import gzip
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import logs
+import slave
+import serving
+from uploader import TelemetryUploader
+
+# (name, command, value, cold): cold cases clear the lookup cache before every call
+COMMAND_CASES = [
+    ("ping_test", "ping_test", "bench", False),
+    ("system_info", "system_info", None, False),
+    ("system_info_cold", "system_info", None, True),
+    ("network_info", "network_info", None, False),
+    ("disk_usage", "disk_usage", None, False),
+    ("cpu_temp", "cpu_temp", None, False),
+    ("get_cpu_temp", "get_cpu_temp", None, False),
+    ("execute_command", "execute_command", "echo bench", False),
+    ("trace_location", "trace_location", None, False),
+    ("trace_location_cold", "trace_location", None, True),
+    ("history", "history", "60", False),
+    ("send_sensor_data", "send_sensor_data", None, False),
+]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers like the master's report routes, ifconfig.me/ip and ip-api.com/json/<ip>.
+    """
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True # Headers and body go out in separate writes; don't stall on delayed ACKs
+
+    def do_GET(self):
+        self._delay()
+        if self.path == "/ip":
+            self._reply(200, b"203.0.113.7", "text/plain")
+        elif self.path.startswith("/json/"):
+            ip = self.path[len("/json/"):]
+            self._reply_json(200, {
+                "status": "success", "query": ip, "country": "Benchland", "countryCode": "BL",
+                "region": "BL-1", "regionName": "Bench Region", "city": "Benchville", "zip": "00000",
+                "lat": 0.0, "lon": 0.0, "timezone": "UTC", "isp": "Bench ISP", "org": "Bench", "as": "AS64500"
+            })
+        else:
+            self._reply_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        self._delay()
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        payload = json.loads(body or b"{}")
+        if self.path.endswith("/report_batch"):
+            count = len(payload.get("readings", []))
+        elif self.path.endswith("/report"):
+            count = 1
+        else:
+            self._reply_json(404, {"error": "Not found"})
+            return
+        with self.server.lock:
+            self.server.readings += count
+            self.server.requests += 1
+        self._reply_json(201, {"message": "ok", "inserted_count": count})
+
+    def _delay(self):
+        if self.server.latency_seconds:
+            time.sleep(self.server.latency_seconds)
+
+    def _reply_json(self, status, payload):
+        self._reply(status, json.dumps(payload).encode("utf-8"), "application/json")
+
+    def _reply(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub_server(latency_ms):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    server.latency_seconds = latency_ms / 1000.0
+    server.lock = threading.Lock()
+    server.readings = 0
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def point_agent_at_stubs(stub_url):
+    slave.PUBLIC_IP_LOOKUP_URL = f"{stub_url}/ip"
+    slave.GEOLOCATION_LOOKUP_URL = stub_url + "/json/{ip}"
+    slave.telemetry_uploader.base_url = f"{stub_url}/api"
+    slave.telemetry_uploader.spool = None # Keep benchmark readings out of the on-disk spool
+
+
+class ForkCounter:
+    """
+    Counts child processes by wrapping subprocess.Popen, which every
+    command (through the executor) uses.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._original = subprocess.Popen
+        counter = self
+
+        class CountingPopen(self._original):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                counter.count += 1
+
+        self._counting = CountingPopen
+
+    def __enter__(self):
+        subprocess.Popen = self._counting
+        return self
+
+    def __exit__(self, *exc):
+        subprocess.Popen = self._original
+
+
+def current_rss_kb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # kB on Linux
+
+
+def distribution(seconds):
+    ordered = sorted(seconds)
+    count = len(ordered)
+    if not count:
+        return {"count": 0}
+
+    def percentile(percent):
+        return round(ordered[min(count - 1, max(0, round(percent / 100 * count) - 1))] * 1000, 3)
+
+    return {
+        "count": count,
+        "mean_ms": round(sum(ordered) / count * 1000, 3),
+        "min_ms": round(ordered[0] * 1000, 3),
+        "p50_ms": percentile(50),
+        "p90_ms": percentile(90),
+        "p99_ms": percentile(99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def bench_commands(iterations, warmup, only=None):
+    """
+    Per-command latency through the Flask test client, with forks per request.
+    """
+    client = slave.app.test_client()
+    results = {}
+    for name, command, value, cold in COMMAND_CASES:
+        if only and name not in only:
+            continue
+        payload = {"command": command, "value": value}
+        for _ in range(warmup):
+            client.post(slave.SLAVE_API_PATH, json=payload)
+        latencies = []
+        statuses = {}
+        rss_before = current_rss_kb()
+        with ForkCounter() as forks:
+            for _ in range(iterations):
+                if cold:
+                    slave.lookup_cache.clear()
+                start = time.perf_counter()
+                response = client.post(slave.SLAVE_API_PATH, json=payload)
+                latencies.append(time.perf_counter() - start)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        results[name] = dict(
+            distribution(latencies),
+            forks_per_request=round(forks.count / iterations, 3),
+            status_codes={str(code): count for code, count in statuses.items()},
+            rss_growth_kb=(current_rss_kb() - rss_before) if rss_before is not None else None
+        )
+    return results
+
+
+def bench_throughput(command, value, concurrency_levels, duration_seconds, workers):
+    """
+    Requests per second against the pooled server, in-process on a free port,
+    with `concurrency` keep-alive clients hammering it.
+    """
+    server = serving.PooledWSGIServer("127.0.0.1", 0, slave.app, workers=workers, max_pending=max(workers, 64))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}{slave.SLAVE_API_PATH}"
+    payload = {"command": command, "value": value}
+    results = {}
+    try:
+        for concurrency in concurrency_levels:
+            latencies = []
+            errors = [0]
+            lock = threading.Lock()
+            deadline = time.monotonic() + duration_seconds
+
+            def client_loop():
+                session = requests.Session()
+                local = []
+                local_errors = 0
+                while time.monotonic() < deadline:
+                    start = time.perf_counter()
+                    try:
+                        ok = session.post(url, json=payload, timeout=30).status_code == 200
+                    except requests.exceptions.RequestException:
+                        ok = False
+                    local.append(time.perf_counter() - start)
+                    local_errors += 0 if ok else 1
+                session.close()
+                with lock:
+                    latencies.extend(local)
+                    errors[0] += local_errors
+
+            threads = [threading.Thread(target=client_loop) for _ in range(concurrency)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            results[str(concurrency)] = dict(
+                distribution(latencies),
+                requests_per_second=round(len(latencies) / elapsed, 1),
+                errors=errors[0]
+            )
+    finally:
+        server.shutdown()
+        server.server_close()
+    results["server_stats"] = server.stats()
+    return results
+
+
+def bench_uploads(stub_server, stub_url, readings, batch_sizes):
+    """
+    Report-upload throughput through TelemetryUploader for each batch size
+    (1 = unbatched, one POST per reading to /report).
+    """
+    results = {}
+    for batch_size in batch_sizes:
+        uploader = TelemetryUploader(
+            f"{stub_url}/api", "bench_device",
+            batching=batch_size > 1, max_batch_size=max(batch_size, 1), max_buffered_readings=readings + 1
+        )
+        with stub_server.lock:
+            stub_server.readings = stub_server.requests = 0
+        start = time.perf_counter()
+        for index in range(readings):
+            uploader.submit({
+                "timestamp": f"2024-01-01T00:00:{index % 60:02d}",
+                "temperature": round(random.uniform(20.0, 30.0), 2),
+                "humidity": round(random.uniform(50.0, 70.0), 2),
+                "status": "active"
+            })
+        while uploader.pending():
+            uploader.flush()
+        elapsed = time.perf_counter() - start
+        stats = uploader.stats()
+        uploader.session.close()
+        results[str(batch_size)] = {
+            "readings": readings,
+            "readings_received": stub_server.readings,
+            "http_requests": stub_server.requests,
+            "seconds": round(elapsed, 3),
+            "readings_per_second": round(readings / elapsed, 1),
+            "bytes_per_reading": stats["bytes_per_reading"],
+            "avg_request_latency_ms": stats["avg_flush_latency_ms"],
+        }
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the agent's command and report paths against local stubs.")
+    parser.add_argument("--iterations", type=int, default=100, help="Timed calls per command")
+    parser.add_argument("--warmup", type=int, default=5, help="Untimed calls per command first")
+    parser.add_argument("--commands", help="Comma-separated subset of: " + ", ".join(case[0] for case in COMMAND_CASES))
+    parser.add_argument("--concurrency", default="1,4,16", help="Client counts for the throughput run")
+    parser.add_argument("--throughput-command", default="system_info")
+    parser.add_argument("--throughput-seconds", type=float, default=5)
+    parser.add_argument("--workers", type=int, default=slave.SERVER_WORKERS, help="Pooled server workers")
+    parser.add_argument("--upload-readings", type=int, default=1000)
+    parser.add_argument("--upload-batch-sizes", default="1,50,500")
+    parser.add_argument("--stub-latency-ms", type=float, default=0, help="Added to every stub response")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="Log the agent's own output (DEBUG) to stderr")
+    parser.add_argument("--output", metavar="PATH", help="Also write the results as JSON to PATH")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    stub_server, stub_url = start_stub_server(args.stub_latency_ms)
+    point_agent_at_stubs(stub_url)
+
+    results = {
+        "started_at": time.time(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "verbose")},
+        "rss_at_start_kb": current_rss_kb(),
+    }
+    # Stub failures and fallbacks are expected here, so the agent stays silent unless asked
+    logs.setup_logging("DEBUG" if args.verbose else "CRITICAL", stream=sys.stderr)
+    only = set(args.commands.split(",")) if args.commands else None
+    results["commands"] = bench_commands(args.iterations, args.warmup, only)
+    results["throughput"] = bench_throughput(
+        args.throughput_command, None,
+        [int(level) for level in args.concurrency.split(",")], args.throughput_seconds, args.workers
+    )
+    results["uploads"] = bench_uploads(
+        stub_server, stub_url, args.upload_readings, [int(size) for size in args.upload_batch_sizes.split(",")]
+    )
+    results["peak_rss_kb"] = peak_rss_kb()
+    results["children_peak_rss_kb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    results["executor"] = slave.command_executor.stats()
+    stub_server.shutdown()
+    logs.stop_logging()
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# cache.py
+# Small in-process cache for slow or rarely-changing lookups (public IP,
+# geolocation, host facts, tool availability).
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("value", "error", "expires_at", "stale_until", "refreshing")
+
+    def __init__(self, value, error, expires_at, stale_until):
+        self.value = value
+        self.error = error
+        self.expires_at = expires_at
+        self.stale_until = stale_until
+        self.refreshing = False
+
+
+class TTLCache:
+    """
+    Size-bounded LRU cache with a TTL per key.
+
+    - Failures raised by the loader are cached for `negative_ttl` seconds
+      (negative caching) and re-raised to callers during that window.
+    - A value past its TTL but within `stale_ttl` more seconds is still
+      returned immediately while a background thread refreshes it
+      (stale-while-revalidate).
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "stale_hits": 0,
+            "negative_hits": 0,
+            "misses": 0,
+            "refreshes": 0,
+            "refresh_failures": 0,
+            "evictions": 0,
+        }
+
+    def get_or_load(self, key, loader, ttl, negative_ttl=0, stale_ttl=0):
+        """
+        Returns the cached value for `key`, calling `loader()` on a miss.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now < entry.expires_at:
+                    self._entries.move_to_end(key)
+                    if entry.error is not None:
+                        self._stats["negative_hits"] += 1
+                        raise entry.error
+                    self._stats["hits"] += 1
+                    return entry.value
+                if entry.error is None and now < entry.stale_until:
+                    self._entries.move_to_end(key)
+                    self._stats["stale_hits"] += 1
+                    if not entry.refreshing:
+                        entry.refreshing = True
+                        threading.Thread(
+                            target=self._refresh,
+                            args=(key, loader, ttl, negative_ttl, stale_ttl),
+                            daemon=True
+                        ).start()
+                    return entry.value
+            self._stats["misses"] += 1
+
+        try:
+            value = loader()
+        except Exception as e:
+            if negative_ttl > 0:
+                self._store(key, None, e, negative_ttl, 0)
+            raise
+        self._store(key, value, None, ttl, stale_ttl)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        stats["max_entries"] = self.max_entries
+        lookups = stats["hits"] + stats["stale_hits"] + stats["negative_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((lookups - stats["misses"]) / lookups, 3) if lookups else None
+        return stats
+
+    def _refresh(self, key, loader, ttl, negative_ttl, stale_ttl):
+        try:
+            value = loader()
+        except Exception as e:
+            log.warning("Background refresh of cache key %r failed: %s", key, e)
+            with self._lock:
+                self._stats["refresh_failures"] += 1
+                entry = self._entries.get(key)
+                if entry is not None:
+                    # Keep serving the stale value until it ages out completely
+                    entry.refreshing = False
+            return
+        with self._lock:
+            self._stats["refreshes"] += 1
+        self._store(key, value, None, ttl, stale_ttl)
+
+    def _store(self, key, value, error, ttl, stale_ttl):
+        now = time.monotonic()
+        expires_at = now + ttl
+        with self._lock:
+            self._entries[key] = _Entry(value, error, expires_at, expires_at + stale_ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
@@ -0,0 +1,202 @@
+# channel.py
+# Outbound command channel: the agent long-polls the master for commands and posts
+# the results back, so commands reach devices behind NAT without an open port.
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+class CommandChannel:
+    """
+    Keeps one long-poll request open to the master at a time. Each poll is
+    held by the master for up to `poll_wait_seconds` and returns the
+    commands queued for this device, each tagged with a request ID (an empty
+    answer doubles as the heartbeat). Commands run concurrently on
+    `max_workers` threads through `runner(command, value)` (or, for a
+    command batch, `batch_runner(commands)`) and their results go back
+    tagged with the same request ID. A command sent with "async": true is
+    started as a background job through `job_runner(command, value)`, and a
+    {"job_id", "offset"} message is answered by `job_status_runner`, so
+    long-running commands don't have to fit in the master's wait. Connection failures are retried with
+    jittered exponential backoff up to `reconnect_max_seconds`. A result the
+    master won't take is replaced by a short error result, so the caller
+    gets an answer instead of waiting out the master's timeout.
+    """
+
+    def __init__(self, base_url, device_id, runner, max_workers=4, poll_wait_seconds=25,
+                 reconnect_initial_seconds=1, reconnect_max_seconds=60, result_attempts=3,
+                 batch_runner=None, job_runner=None, job_status_runner=None):
+        self.base_url = base_url
+        self.device_id = device_id
+        self.runner = runner # runner(command, value) -> (response_dict, http_status)
+        self.batch_runner = batch_runner # batch_runner(commands) -> (response_dict, http_status)
+        self.job_runner = job_runner # job_runner(command, value) -> (response_dict, http_status)
+        self.job_status_runner = job_status_runner # job_status_runner(job_id, offset) -> (response_dict, http_status)
+        self.poll_wait_seconds = poll_wait_seconds
+        self.reconnect_initial_seconds = reconnect_initial_seconds
+        self.reconnect_max_seconds = reconnect_max_seconds
+        self.result_attempts = result_attempts
+
+        self.max_workers = max_workers
+        self.session = None # Created in start(), so agents without the channel never import requests
+
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="channel")
+        self._stopping = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "connected": False,
+            "polls": 0,
+            "heartbeats": 0,
+            "reconnects": 0,
+            "commands_received": 0,
+            "results_sent": 0,
+            "results_failed": 0,
+            "results_replaced": 0,
+            "last_poll_at": None,
+        }
+
+    @property
+    def poll_url(self):
+        return f"{self.base_url}/devices/{self.device_id}/channel/poll"
+
+    @property
+    def results_url(self):
+        return f"{self.base_url}/devices/{self.device_id}/channel/results"
+
+    def start(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        # One connection for the poll, the rest for results posted while it is open
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers + 1)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._thread = threading.Thread(target=self._poll_loop, name="command-channel", daemon=True)
+        self._thread.start()
+        log.info("Command channel polling %s", self.poll_url)
+
+    def stop(self, timeout=5):
+        """
+        Stops polling, dropping commands not yet started, and waits up to
+        `timeout` seconds for the open poll to return.
+        """
+        self._stopping.set()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self.session is not None:
+            self.session.close()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _poll_loop(self):
+        import requests
+        backoff = 0
+        while not self._stopping.is_set():
+            try:
+                response = self.session.post(
+                    self.poll_url,
+                    json={"wait_seconds": self.poll_wait_seconds},
+                    # The master answers within poll_wait_seconds; allow for the network on top
+                    timeout=(10, self.poll_wait_seconds + 15)
+                )
+                response.raise_for_status()
+                payload = response.json()
+                commands = (payload.get("commands") or []) if isinstance(payload, dict) else None
+                if not isinstance(commands, list) or not all(isinstance(message, dict) for message in commands):
+                    raise ValueError(f"Unexpected poll response from master: {str(payload)[:200]}")
+            except (requests.exceptions.RequestException, ValueError) as e:
+                with self._lock:
+                    if self._stats["connected"]:
+                        log.warning("Command channel lost: %s", e)
+                    self._stats["connected"] = False
+                    self._stats["reconnects"] += 1
+                backoff = min(max(backoff * 2, self.reconnect_initial_seconds), self.reconnect_max_seconds)
+                self._stopping.wait(backoff * random.uniform(0.5, 1.0))
+                continue
+
+            backoff = 0
+            with self._lock:
+                if not self._stats["connected"]:
+                    log.info("Command channel connected.")
+                self._stats["connected"] = True
+                self._stats["polls"] += 1
+                self._stats["last_poll_at"] = time.time()
+                if commands:
+                    self._stats["commands_received"] += len(commands)
+                else:
+                    self._stats["heartbeats"] += 1
+            for message in commands:
+                try:
+                    self._pool.submit(self._execute, message)
+                except RuntimeError: # Pool shut down by stop()
+                    break
+
+    def _execute(self, message):
+        request_id = message.get("request_id")
+        try:
+            if "commands" in message:
+                if self.batch_runner is None:
+                    body, status_code = {"status": "error", "message": "Command batches are not supported over this channel."}, 400
+                else:
+                    body, status_code = self.batch_runner(message["commands"])
+            elif "job_id" in message:
+                if self.job_status_runner is None:
+                    body, status_code = {"status": "error", "message": "Background jobs are not supported over this channel."}, 400
+                else:
+                    body, status_code = self.job_status_runner(message["job_id"], message.get("offset", 0))
+            elif message.get("async", False) is not False:
+                if message["async"] is not True:
+                    body, status_code = {"status": "error", "message": "'async' must be true or false."}, 400
+                elif self.job_runner is None:
+                    body, status_code = {"status": "error", "message": "Background jobs are not supported over this channel."}, 400
+                else:
+                    body, status_code = self.job_runner(message.get("command"), message.get("value"))
+            else:
+                body, status_code = self.runner(message.get("command"), message.get("value"))
+        except Exception as e:
+            log.error("Error running channel command %s: %s", message.get('command'), e)
+            body, status_code = {"status": "error", "message": f"Internal Laptop error: {str(e)}"}, 500
+        self._send_result({"request_id": request_id, "status_code": status_code, "body": body})
+
+    def _send_result(self, result):
+        error = self._post_result(result, self.result_attempts)
+        if error is None:
+            with self._lock:
+                self._stats["results_sent"] += 1
+            return
+        # Answer with a small error result instead, so the master's caller isn't left to time out
+        replacement = {
+            "request_id": result["request_id"],
+            "status_code": 502,
+            "body": {"status": "error", "message": f"The device could not return the result of this command: {error}"}
+        }
+        replaced = self._post_result(replacement, 1) is None
+        with self._lock:
+            self._stats["results_replaced" if replaced else "results_failed"] += 1
+
+    def _post_result(self, result, attempts):
+        # Returns None once the master has the result, otherwise the last error
+        import requests
+        error = None
+        for attempt in range(attempts):
+            try:
+                response = self.session.post(self.results_url, json={"results": [result]}, timeout=10)
+                response.raise_for_status()
+                return None
+            except requests.exceptions.RequestException as e:
+                log.warning("Error returning result %s to master: %s", result["request_id"], e)
+                error = e
+                status_code = e.response.status_code if e.response is not None else None
+                if status_code is not None and 400 <= status_code < 500:
+                    break # e.g. 413: sending the same body again won't help
+                if self._stopping.wait(2 ** attempt):
+                    break
+        return error
@@ -0,0 +1,294 @@
+# collectors.py
+# Reads host facts straight from /proc, /sys and statvfs instead of forking
+# shell pipelines. Every function returns None (or an empty result) when its
+# source file is missing, so callers can fall back to a subprocess.
+import glob
+import math
+import os
+import socket
+
+# Filesystem types `df` would show; pseudo filesystems are skipped
+DISK_FS_TYPES = {"ext2", "ext3", "ext4", "vfat", "exfat", "xfs", "btrfs", "f2fs", "ntfs", "fuseblk", "tmpfs", "overlay"}
+
+
+def _read_text(path):
+    try:
+        with open(path, "r") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def human_size(num_bytes, binary_suffix=False):
+    """
+    Formats a byte count the way `df -h` ("3.5G") or `free -h` ("3.5Gi") does.
+    """
+    suffix = "i" if binary_suffix else ""
+    value = float(num_bytes)
+    for unit in ("B", "K", "M", "G", "T"):
+        if value < 1024 or unit == "T":
+            if unit == "B":
+                return f"{int(value)}B"
+            return f"{value:.1f}{unit}{suffix}" if value < 10 else f"{value:.0f}{unit}{suffix}"
+        value /= 1024
+
+
+def hostname():
+    return socket.gethostname()
+
+
+def kernel_release():
+    return os.uname().release
+
+
+def os_pretty_name():
+    content = _read_text("/etc/os-release")
+    if content is None:
+        return None
+    for line in content.splitlines():
+        if line.startswith("PRETTY_NAME="):
+            return line.split("=", 1)[1].strip().strip('"')
+    return None
+
+
+def cpu_model():
+    """
+    CPU model from /proc/cpuinfo. x86 reports 'model name', Raspberry Pi
+    kernels report 'Model' (board) and older ones only 'Hardware'.
+    """
+    content = _read_text("/proc/cpuinfo")
+    if content is None:
+        return None
+    fields = {}
+    for line in content.splitlines():
+        key, sep, val = line.partition(":")
+        key = key.strip()
+        if sep and key not in fields:
+            fields[key] = val.strip()
+    for key in ("model name", "Model", "Hardware"):
+        if fields.get(key):
+            return fields[key]
+    return None
+
+
+def cpu_count():
+    return os.cpu_count()
+
+
+def read_meminfo():
+    """
+    Parses /proc/meminfo into a dict of kB values.
+    """
+    content = _read_text("/proc/meminfo")
+    if content is None:
+        return None
+    meminfo = {}
+    for line in content.splitlines():
+        key, _, rest = line.partition(":")
+        parts = rest.split()
+        if parts:
+            try:
+                meminfo[key] = int(parts[0])
+            except ValueError:
+                continue
+    return meminfo
+
+
+def memory_usage():
+    """
+    Memory totals in bytes. 'used' is total minus available, matching `free`.
+    """
+    meminfo = read_meminfo()
+    if not meminfo or "MemTotal" not in meminfo:
+        return None
+    total = meminfo["MemTotal"] * 1024
+    available = meminfo.get("MemAvailable", meminfo.get("MemFree", 0)) * 1024
+    used = total - available
+    return {
+        "total_bytes": total,
+        "available_bytes": available,
+        "used_bytes": used,
+        "used_percent": round(used * 100.0 / total, 1) if total else 0.0,
+        "swap_total_bytes": meminfo.get("SwapTotal", 0) * 1024,
+        "swap_free_bytes": meminfo.get("SwapFree", 0) * 1024,
+    }
+
+
+def uptime_seconds():
+    content = _read_text("/proc/uptime")
+    if not content:
+        return None
+    try:
+        return float(content.split()[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def format_uptime(seconds):
+    """
+    Formats seconds like `uptime -p`, e.g. "up 2 days, 3 hours, 4 minutes".
+    """
+    minutes_total = int(seconds // 60)
+    weeks, rem = divmod(minutes_total, 7 * 24 * 60)
+    days, rem = divmod(rem, 24 * 60)
+    hours, minutes = divmod(rem, 60)
+    parts = []
+    for amount, unit in ((weeks, "week"), (days, "day"), (hours, "hour"), (minutes, "minute")):
+        if amount:
+            parts.append(f"{amount} {unit}{'s' if amount != 1 else ''}")
+    return "up " + (", ".join(parts) if parts else "0 minutes")
+
+
+def load_average():
+    content = _read_text("/proc/loadavg")
+    if not content:
+        return None
+    try:
+        one, five, fifteen = (float(x) for x in content.split()[:3])
+    except ValueError:
+        return None
+    return {"1m": one, "5m": five, "15m": fifteen}
+
+
+def default_interface():
+    """
+    Interface of the default IPv4 route, from /proc/net/route.
+    """
+    content = _read_text("/proc/net/route")
+    if content is None:
+        return None
+    for line in content.splitlines()[1:]:
+        fields = line.split()
+        if len(fields) >= 2 and fields[1] == "00000000":
+            return fields[0]
+    return None
+
+
+def mac_address(interface):
+    address = _read_text(f"/sys/class/net/{interface}/address")
+    return address.strip() if address else None
+
+
+def local_ip_addresses():
+    """
+    Non-loopback IPv4 addresses assigned to this host (what `hostname -I`
+    prints), read from /proc/net/fib_trie. Returns None if the file is missing.
+    """
+    content = _read_text("/proc/net/fib_trie")
+    if content is None:
+        return None
+    addresses = []
+    last_address = None
+    for line in content.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("|--"):
+            last_address = stripped[3:].strip()
+        elif stripped.startswith("/32 host LOCAL") and last_address:
+            if not last_address.startswith("127.") and last_address not in addresses:
+                addresses.append(last_address)
+            last_address = None
+    return addresses
+
+
+def network_interfaces():
+    """
+    Per-interface state and byte/packet counters from /sys/class/net.
+    """
+    interfaces = {}
+    for path in sorted(glob.glob("/sys/class/net/*")):
+        name = os.path.basename(path)
+        if name == "lo":
+            continue
+        info = {
+            "mac_address": mac_address(name),
+            "operstate": (_read_text(f"{path}/operstate") or "unknown").strip(),
+        }
+        for counter in ("rx_bytes", "tx_bytes", "rx_packets", "tx_packets", "rx_errors", "tx_errors"):
+            value = _read_text(f"{path}/statistics/{counter}")
+            info[counter] = int(value) if value and value.strip().isdigit() else None
+        interfaces[name] = info
+    return interfaces
+
+
+def disk_usage():
+    """
+    Usage of every real mounted filesystem via os.statvfs, in bytes.
+    """
+    content = _read_text("/proc/mounts")
+    if content is None:
+        return None
+    disks = []
+    seen = set()
+    for line in content.splitlines():
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        device, mount_point, fs_type = fields[0], fields[1].replace("\\040", " "), fields[2]
+        if fs_type not in DISK_FS_TYPES or mount_point in seen:
+            continue
+        try:
+            st = os.statvfs(mount_point)
+        except OSError:
+            continue
+        seen.add(mount_point)
+        total = st.f_blocks * st.f_frsize
+        available = st.f_bavail * st.f_frsize
+        used = (st.f_blocks - st.f_bfree) * st.f_frsize
+        usable = used + available
+        disks.append({
+            "filesystem": device,
+            "type": fs_type,
+            "mounted_on": mount_point,
+            "size_bytes": total,
+            "used_bytes": used,
+            "available_bytes": available,
+            "used_percent": round(used * 100.0 / usable, 1) if usable else 0.0,
+        })
+    return disks
+
+
+def format_disk_usage(disks):
+    """
+    Renders disk_usage() output as a `df -h` style table.
+    """
+    rows = [("Filesystem", "Size", "Used", "Avail", "Use%", "Mounted on")]
+    for disk in disks:
+        rows.append((
+            disk["filesystem"],
+            human_size(disk["size_bytes"]),
+            human_size(disk["used_bytes"]),
+            human_size(disk["available_bytes"]),
+            f"{math.ceil(disk['used_percent'])}%",
+            disk["mounted_on"],
+        ))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]) - 1)]
+    return "\n".join(
+        "  ".join(col.ljust(widths[i]) for i, col in enumerate(row[:-1])) + "  " + row[-1]
+        for row in rows
+    )
+
+
+def cpu_temperature():
+    """
+    CPU temperature in Celsius from /sys/class/thermal. Prefers zones whose
+    type names the CPU/SoC; returns (celsius, zone_type) or None.
+    """
+    zones = []
+    for zone in sorted(glob.glob("/sys/class/thermal/thermal_zone*")):
+        raw = _read_text(f"{zone}/temp")
+        if not raw:
+            continue
+        try:
+            millidegrees = int(raw.strip())
+        except ValueError:
+            continue
+        zone_type = (_read_text(f"{zone}/type") or "").strip()
+        zones.append((millidegrees / 1000.0, zone_type))
+    if not zones:
+        return None
+    for celsius, zone_type in zones:
+        lowered = zone_type.lower()
+        if "cpu" in lowered or "soc" in lowered or "x86_pkg" in lowered:
+            return round(celsius, 1), zone_type
+    celsius, zone_type = zones[0]
+    return round(celsius, 1), zone_type
@@ -0,0 +1,239 @@
+# executor.py
+# Single place where the agent starts child processes: timeouts, process-group
+# kill, resource limits and a global cap on concurrent children.
+import os
+import signal
+import subprocess
+import threading
+import time
+from collections import namedtuple
+
+import streaming
+from metrics import Histogram
+
+# Limits applied to the shell and everything it starts. None means "inherit".
+ResourceLimits = namedtuple("ResourceLimits", ["cpu_seconds", "address_space_mb", "open_files"])
+NO_LIMITS = ResourceLimits(None, None, None)
+
+
+class ExecutorBusy(Exception):
+    """
+    Raised when no child-process slot frees up within the acquire timeout.
+    """
+    pass
+
+
+class CommandExecutor:
+    """
+    Runs shell commands with a timeout, kills the whole process group when
+    it expires and applies rlimits (CPU seconds, address space, open files)
+    through the shell's `ulimit`, which avoids an unsafe preexec_fn in a
+    threaded server. At most `max_concurrent` children run at once; callers
+    wait up to `acquire_timeout_seconds` for a slot and then get ExecutorBusy.
+    """
+
+    def __init__(self, max_concurrent=4, acquire_timeout_seconds=2.0, default_timeout_seconds=60,
+                 default_limits=NO_LIMITS, kill_grace_seconds=2.0):
+        self.max_concurrent = max_concurrent
+        self.acquire_timeout_seconds = acquire_timeout_seconds
+        self.default_timeout_seconds = default_timeout_seconds
+        self.default_limits = default_limits
+        self.kill_grace_seconds = kill_grace_seconds
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._stats = {
+            "started": 0,
+            "completed": 0,
+            "failed": 0,
+            "timed_out": 0,
+            "rejected": 0,
+            "running": 0,
+            "peak_running": 0,
+        }
+        self.duration = Histogram() # Wall time of every child process, including killed ones
+
+    def run(self, cmd, timeout=None, check=False, limits=None, on_output=None, max_output_chars=None):
+        """
+        Like subprocess.run(cmd, shell=True, text=True, capture_output=True).
+        `on_output(text)` is called with output lines as they arrive; the
+        captured stdout and stderr then keep at most `max_output_chars` each
+        (the rest is still passed to `on_output`). Raises
+        subprocess.TimeoutExpired (after killing the process group),
+        subprocess.CalledProcessError when `check` is set, or ExecutorBusy.
+        """
+        timeout = self.default_timeout_seconds if timeout is None else timeout
+        self._acquire()
+        start = None
+        try:
+            process = self._spawn(cmd, limits, text=True)
+            start = time.monotonic()
+            if on_output is None:
+                stdout, stderr = self._communicate(process, cmd, timeout)
+            else:
+                stdout, stderr = self._pump(process, cmd, timeout, on_output, max_output_chars)
+        finally:
+            if start is not None:
+                self.duration.observe(time.monotonic() - start)
+            self._release()
+
+        self._count("completed" if process.returncode == 0 else "failed")
+        if check and process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, cmd, output=stdout, stderr=stderr)
+        return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+    def stream(self, cmd, timeout=None, limits=None, **kwargs):
+        """
+        Reserves a slot now (raising ExecutorBusy if none is free) and returns
+        a streaming.stream_command generator that releases it when done.
+        """
+        timeout = self.default_timeout_seconds if timeout is None else timeout
+        self._acquire()
+
+        def generate():
+            try:
+                for event in streaming.stream_command(
+                        cmd, timeout=timeout, kill=self._kill_group, drain_seconds=self.kill_grace_seconds,
+                        popen=lambda c, **popen_kwargs: self._spawn(c, limits, **popen_kwargs), **kwargs):
+                    if event["type"] == "exit":
+                        self.duration.observe(event["wall_seconds"])
+                        if event.get("timed_out"):
+                            self._count("timed_out")
+                        else:
+                            self._count("completed" if event["return_code"] == 0 else "failed")
+                    yield event
+            finally:
+                self._release()
+
+        return generate()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["max_concurrent"] = self.max_concurrent
+        return stats
+
+    def _acquire(self):
+        if not self._slots.acquire(timeout=self.acquire_timeout_seconds):
+            self._count("rejected")
+            raise ExecutorBusy(f"Too many commands running ({self.max_concurrent}); try again later.")
+        with self._lock:
+            self._stats["running"] += 1
+            self._stats["peak_running"] = max(self._stats["peak_running"], self._stats["running"])
+
+    def _release(self):
+        with self._lock:
+            self._stats["running"] -= 1
+        self._slots.release()
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _spawn(self, cmd, limits, **popen_kwargs):
+        popen_kwargs.setdefault("stdout", subprocess.PIPE)
+        popen_kwargs.setdefault("stderr", subprocess.PIPE)
+        popen_kwargs.pop("shell", None)
+        process = subprocess.Popen(
+            self._with_limits(cmd, limits or self.default_limits),
+            shell=True,
+            start_new_session=True, # Own process group, so a timeout kills the whole pipeline
+            **popen_kwargs
+        )
+        self._count("started")
+        return process
+
+    @staticmethod
+    def _with_limits(cmd, limits):
+        settings = []
+        if limits.cpu_seconds is not None:
+            settings.append(f"ulimit -t {int(limits.cpu_seconds)}")
+        if limits.address_space_mb is not None:
+            settings.append(f"ulimit -v {int(limits.address_space_mb) * 1024}")
+        if limits.open_files is not None:
+            settings.append(f"ulimit -n {int(limits.open_files)}")
+        if not settings:
+            return cmd
+        return " && ".join(settings) + "\n" + cmd
+
+    def _kill_group(self, process):
+        """
+        SIGTERM the process group, then SIGKILL whatever is left after the grace period.
+        """
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except (ProcessLookupError, PermissionError):
+            return
+        deadline = time.monotonic() + self.kill_grace_seconds
+        while time.monotonic() < deadline:
+            if self._exited(process):
+                break
+            time.sleep(0.05)
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    @staticmethod
+    def _exited(process):
+        # Checks for exit without reaping, so streaming can still collect rusage via wait4
+        if process.returncode is not None:
+            return True
+        try:
+            return os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None
+        except ChildProcessError:
+            return True
+
+    def _communicate(self, process, cmd, timeout):
+        try:
+            return process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self._kill_group(process)
+            try:
+                stdout, stderr = process.communicate(timeout=self.kill_grace_seconds)
+            except subprocess.TimeoutExpired:
+                # Something that left the process group (setsid) still holds the pipes open
+                process.stdout.close()
+                process.stderr.close()
+                process.wait()
+                stdout, stderr = "", ""
+            self._count("timed_out")
+            raise subprocess.TimeoutExpired(cmd, timeout, output=stdout, stderr=stderr)
+
+    def _pump(self, process, cmd, timeout, on_output, max_output_chars=None):
+        stdout_lines, stderr_lines = [], []
+
+        def pump(stream, sink):
+            kept = 0
+            for line in stream:
+                on_output(line)
+                if max_output_chars is None or kept + len(line) <= max_output_chars:
+                    sink.append(line)
+                    kept += len(line)
+                elif kept <= max_output_chars:
+                    # Read and discard the rest so the child never blocks on a full pipe
+                    sink.append(f"\n[output truncated after {max_output_chars} characters]\n")
+                    kept = max_output_chars + 1
+
+        readers = [
+            threading.Thread(target=pump, args=(process.stdout, stdout_lines), daemon=True),
+            threading.Thread(target=pump, args=(process.stderr, stderr_lines), daemon=True)
+        ]
+        for reader in readers:
+            reader.start()
+        deadline = time.monotonic() + timeout
+        try:
+            process.wait(timeout=timeout)
+            for reader in readers:
+                reader.join(max(deadline - time.monotonic(), 0))
+            if any(reader.is_alive() for reader in readers):
+                # The shell exited, but something it started in the background still
+                # holds the pipes open; like communicate(), that counts as a timeout
+                raise subprocess.TimeoutExpired(cmd, timeout)
+        except subprocess.TimeoutExpired:
+            self._kill_group(process)
+            process.wait()
+            for reader in readers:
+                reader.join(self.kill_grace_seconds)
+            self._count("timed_out")
+            raise subprocess.TimeoutExpired(cmd, timeout, output="".join(stdout_lines), stderr="".join(stderr_lines))
+        return "".join(stdout_lines), "".join(stderr_lines)
@@ -0,0 +1,366 @@
+# fleet_sim.py
+# Fleet simulator: runs many virtual agents in one asyncio process against a master,
+# exercising the real report and command-channel paths, and reports throughput,
+# latency percentiles and error rates. Run from this directory, e.g.
+#   python fleet_sim.py --master http://localhost:5000/api --devices 500 --register --commands --command-rate 5
+import argparse
+import asyncio
+import gzip
+import json
+import random
+import ssl
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import slave
+from registry import CHEAP
+from sampling import WindowSampler
+
+
+class HttpClient:
+    """
+    One keep-alive HTTP/1.1 connection, used for one request at a time.
+    Just enough of HTTP for the master's JSON API, so thousands of
+    simulated devices don't need a thread each.
+    """
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.ssl = ssl.create_default_context() if parts.scheme == "https" else None
+        self.base_path = parts.path.rstrip("/")
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    async def request(self, method, path, payload=None, timeout=30, compress=False):
+        """
+        Returns (status_code, parsed_json_or_None). Raises OSError,
+        asyncio.TimeoutError or asyncio.IncompleteReadError on failure.
+        """
+        body = b""
+        headers = [f"{method} {self.base_path}{path} HTTP/1.1", f"Host: {self.host}:{self.port}"]
+        if payload is not None:
+            body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+            if compress:
+                body = gzip.compress(body)
+                headers.append("Content-Encoding: gzip")
+            headers.append("Content-Type: application/json")
+        headers.append(f"Content-Length: {len(body)}")
+        message = ("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body
+
+        async with self._lock:
+            for attempt in range(2):
+                reused = self._writer is not None
+                if not reused:
+                    self._reader, self._writer = await asyncio.wait_for(
+                        asyncio.open_connection(self.host, self.port, ssl=self.ssl), timeout)
+                try:
+                    self._writer.write(message)
+                    await self._writer.drain()
+                    return await asyncio.wait_for(self._read_response(), timeout)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    self._close()
+                    if not reused or attempt:
+                        raise
+                    # The server closed an idle keep-alive connection: retry once on a new one
+                except BaseException:
+                    self._close()
+                    raise
+
+    async def _read_response(self):
+        status_line = await self._reader.readuntil(b"\r\n")
+        status_code = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self._reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await self._reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                chunk = await self._reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                chunks.append(chunk[:-2])
+            body = b"".join(chunks)
+        else:
+            body = await self._reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection", "").lower() == "close":
+            self._close()
+        try:
+            return status_code, json.loads(body) if body else None
+        except ValueError:
+            return status_code, None
+
+    def _close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    def close(self):
+        self._close()
+
+
+class Recorder:
+    """
+    Latency samples and error counts per operation ("report", "result", ...).
+    """
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self._ops = {}
+
+    def record(self, op, seconds, error=None):
+        stats = self._ops.setdefault(op, {"latencies": [], "errors": {}})
+        stats["latencies"].append(seconds)
+        if error is not None:
+            stats["errors"][error] = stats["errors"].get(error, 0) + 1
+
+    async def timed(self, op, call, ok_statuses=range(200, 300)):
+        """
+        Awaits `call()` (an HttpClient.request) and records its latency and
+        outcome. Returns the response, or None on a transport error.
+        """
+        start = time.perf_counter()
+        try:
+            status_code, body = await call()
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            self.record(op, time.perf_counter() - start, type(e).__name__)
+            return None
+        self.record(op, time.perf_counter() - start, None if status_code in ok_statuses else f"HTTP {status_code}")
+        return status_code, body
+
+    def counts(self):
+        return {op: len(stats["latencies"]) for op, stats in self._ops.items()}
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started_at
+        operations = {}
+        for op, stats in sorted(self._ops.items()):
+            latencies = sorted(stats["latencies"])
+            count = len(latencies)
+            errors = sum(stats["errors"].values())
+            operations[op] = {
+                "count": count,
+                "errors": errors,
+                "error_rate": round(errors / count, 4) if count else 0.0,
+                "per_second": round(count / elapsed, 2) if elapsed else None,
+                "latency_ms": {
+                    "p50": _percentile_ms(latencies, 50),
+                    "p90": _percentile_ms(latencies, 90),
+                    "p99": _percentile_ms(latencies, 99),
+                    "max": round(latencies[-1] * 1000, 2) if latencies else None,
+                },
+                "error_kinds": stats["errors"],
+            }
+        return {"elapsed_seconds": round(elapsed, 2), "operations": operations}
+
+
+def _percentile_ms(ordered, percent):
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return round(ordered[index] * 1000, 2)
+
+
+async def run_agent_command(command, value):
+    """
+    Cheap commands (and unknown ones) go through the agent's real run_command;
+    anything that would touch the host (reboot, apt, shell) is only acknowledged.
+    """
+    cost = slave.command_registry.cost_of(command)
+    if cost is None or cost == CHEAP:
+        return await asyncio.to_thread(slave.run_command, command, value)
+    return {"status": "success", "simulated": True, "message": f"'{command}' is not executed by simulated devices."}, 200
+
+
+class VirtualDevice:
+    """
+    One simulated agent: samples a random-walk sensor into the agent's
+    WindowSampler, reports window summaries on a jittered schedule and, with
+    `commands`, answers commands over the outbound channel.
+    """
+
+    def __init__(self, device_id, args, recorder):
+        self.device_id = device_id
+        self.args = args
+        self.recorder = recorder
+        self.http = HttpClient(args.master)
+        self.poll_http = HttpClient(args.master)
+        self.sampler = WindowSampler(self._read_sample, capacity=max(args.samples_per_report, 1))
+        self._temperature = random.uniform(20.0, 30.0)
+        self._humidity = random.uniform(50.0, 70.0)
+        self._pending_readings = []
+
+    def _read_sample(self):
+        self._temperature += random.gauss(0, 0.1)
+        self._humidity += random.gauss(0, 0.3)
+        return {"temperature": round(self._temperature, 2), "humidity": round(self._humidity, 2)}
+
+    async def register(self, recorder):
+        payload = {"device_id": self.device_id, "name": f"Fleet simulator {self.device_id}", "type": "sensor_hub", "status": "online"}
+        # 409: already registered by an earlier run
+        await recorder.timed("register", lambda: self.http.request("POST", "/devices", payload),
+                             ok_statuses=(200, 201, 409))
+
+    async def run(self):
+        tasks = [asyncio.create_task(self._report_loop())]
+        if self.args.commands:
+            tasks.append(asyncio.create_task(self._command_loop()))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.http.close()
+            self.poll_http.close()
+
+    async def _report_loop(self):
+        interval = self.args.report_interval
+        await asyncio.sleep(random.uniform(0, interval)) # Spread the fleet over the first interval
+        while True:
+            for _ in range(self.args.samples_per_report):
+                self.sampler.sample()
+            window = self.sampler.take_window()
+            self._pending_readings.append({
+                "timestamp": datetime.now().isoformat(),
+                "temperature": window["temperature"]["mean"],
+                "humidity": window["humidity"]["mean"],
+                "status": "active",
+                "window": window
+            })
+            if len(self._pending_readings) >= self.args.batch_size:
+                await self._upload()
+            await asyncio.sleep(interval * random.uniform(1 - self.args.jitter, 1 + self.args.jitter))
+
+    async def _upload(self):
+        readings, self._pending_readings = self._pending_readings, []
+        if len(readings) == 1:
+            # Same as the agent with UPLOAD_BATCHING_ENABLED = False
+            path, payload, compress = f"/sensor_data/{self.device_id}/report", readings[0], False
+        else:
+            path, payload, compress = f"/sensor_data/{self.device_id}/report_batch", {"readings": readings}, True
+        await self.recorder.timed("report", lambda: self.http.request("POST", path, payload, compress=compress))
+
+    async def _command_loop(self):
+        path = f"/devices/{self.device_id}/channel/poll"
+        wait = self.args.poll_wait
+        while True:
+            response = await self.recorder.timed(
+                "poll", lambda: self.poll_http.request("POST", path, {"wait_seconds": wait}, timeout=wait + 15))
+            if response is None or response[0] != 200:
+                await asyncio.sleep(random.uniform(0.5, 1.0) * self.args.reconnect_seconds)
+                continue
+            for message in (response[1] or {}).get("commands") or []:
+                asyncio.create_task(self._execute(message))
+
+    async def _execute(self, message):
+        body, status_code = await run_agent_command(message.get("command"), message.get("value"))
+        result = {"request_id": message.get("request_id"), "status_code": status_code, "body": body}
+        await self.recorder.timed(
+            "result", lambda: self.http.request("POST", f"/devices/{self.device_id}/channel/results", {"results": [result]}))
+
+
+async def drive_commands(devices, args, recorder):
+    """
+    Sends `command_rate` commands per second through the master's
+    /devices/<id>/command route (what the dashboard does), to random devices.
+    """
+    clients = asyncio.Queue()
+    for _ in range(args.operator_connections):
+        clients.put_nowait(HttpClient(args.master))
+
+    async def send(device):
+        client = await clients.get()
+        try:
+            payload = {"command": args.command, "value": args.command_value}
+            await recorder.timed("command", lambda: client.request("POST", f"/devices/{device.device_id}/command", payload))
+        finally:
+            clients.put_nowait(client)
+
+    await asyncio.sleep(args.poll_wait / 5) # Let the channels connect first
+    while True:
+        asyncio.create_task(send(random.choice(devices)))
+        await asyncio.sleep(random.expovariate(args.command_rate))
+
+
+async def print_progress(recorder, interval):
+    previous = {}
+    while True:
+        await asyncio.sleep(interval)
+        counts = recorder.counts()
+        rates = ", ".join(f"{op} {(count - previous.get(op, 0)) / interval:.1f}/s" for op, count in sorted(counts.items()))
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] {rates or 'no requests yet'}")
+        previous = counts
+
+
+async def simulate(args):
+    recorder = Recorder()
+    devices = [VirtualDevice(f"{args.device_prefix}_{index:05d}", args, recorder) for index in range(args.devices)]
+
+    registration = None
+    if args.register:
+        registration = Recorder()
+        limit = asyncio.Semaphore(args.operator_connections)
+
+        async def register(device):
+            async with limit:
+                await device.register(registration)
+
+        await asyncio.gather(*(register(device) for device in devices))
+        print(f"Registered {args.devices} devices.")
+
+    recorder.started_at = time.monotonic()
+    tasks = [asyncio.create_task(device.run()) for device in devices]
+    tasks.append(asyncio.create_task(print_progress(recorder, args.progress_interval)))
+    if args.command_rate > 0:
+        tasks.append(asyncio.create_task(drive_commands(devices, args, recorder)))
+    print(f"Simulating {args.devices} devices against {args.master} for {args.duration} seconds...")
+    await asyncio.sleep(args.duration)
+    summary = recorder.summary()
+    if registration is not None:
+        summary["registration"] = registration.summary()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return summary
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simulate a fleet of agents against a master to find its scaling limits.")
+    parser.add_argument("--master", default=slave.MASTER_API_BASE_URL, help="Master API base URL (.../api)")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--device-prefix", default="fleetsim", help="Device IDs are <prefix>_00000, <prefix>_00001, ...")
+    parser.add_argument("--register", action="store_true", help="Register the devices with the master first")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to run")
+    parser.add_argument("--report-interval", type=float, default=10, help="Seconds between reports per device")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Report interval jitter as a fraction")
+    parser.add_argument("--samples-per-report", type=int, default=10, help="Samples summarised into each report window")
+    parser.add_argument("--batch-size", type=int, default=1, help="Reports per upload; above 1 uses the gzip batch route")
+    parser.add_argument("--commands", action="store_true", help="Hold a command channel open per device")
+    parser.add_argument("--poll-wait", type=float, default=slave.COMMAND_CHANNEL_POLL_WAIT_SECONDS)
+    parser.add_argument("--reconnect-seconds", type=float, default=2)
+    parser.add_argument("--command-rate", type=float, default=0, help="Commands per second sent through the master (needs --commands)")
+    parser.add_argument("--command", default="ping_test")
+    parser.add_argument("--command-value", default="fleet simulator")
+    parser.add_argument("--operator-connections", type=int, default=16, help="Connections used for registering and sending commands")
+    parser.add_argument("--progress-interval", type=float, default=10)
+    parser.add_argument("--json", metavar="PATH", help="Also write the summary as JSON to PATH")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    summary = asyncio.run(simulate(args))
+    summary["config"] = {key: value for key, value in vars(args).items() if key != "json"}
+    print(json.dumps(summary, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
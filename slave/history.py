@@ -0,0 +1,107 @@
+# history.py
+# Fixed-size in-memory time series of recent device metrics, queryable by time range.
+import bisect
+import math
+import threading
+import time
+from array import array
+
+
+class HistoryStore:
+    """
+    Ring of the last `capacity` points, one typed array (8 bytes per point)
+    for the timestamps and one per field, so memory use is fixed at
+    startup. Missing values are stored as NaN and skipped by aggregates.
+    Points must be recorded in time order.
+    """
+
+    def __init__(self, fields, capacity=2880):
+        self.fields = tuple(fields)
+        self.capacity = capacity
+        self._timestamps = array("d", bytes(8 * capacity))
+        self._columns = {field: array("d", bytes(8 * capacity)) for field in self.fields}
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def record(self, values, timestamp=None):
+        """
+        Appends one point; `values` maps field names to numbers (None or absent = missing).
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            self._timestamps[self._next] = timestamp
+            for field, column in self._columns.items():
+                value = values.get(field)
+                column[self._next] = math.nan if value is None else float(value)
+            self._next = (self._next + 1) % self.capacity
+            if self._count < self.capacity:
+                self._count += 1
+
+    def query(self, start=None, end=None, fields=None, max_points=0):
+        """
+        Aggregates (count/min/max/mean/last) per field over points with
+        start <= timestamp <= end. With `max_points` > 0 the points
+        themselves are included too, thinned evenly to at most that many.
+        """
+        fields = self.fields if fields is None else [field for field in fields if field in self._columns]
+        with self._lock:
+            timestamps = self._ordered(self._timestamps)
+            lo = 0 if start is None else bisect.bisect_left(timestamps, start)
+            hi = len(timestamps) if end is None else bisect.bisect_right(timestamps, end)
+            timestamps = timestamps[lo:hi]
+            columns = {field: self._ordered(self._columns[field])[lo:hi] for field in fields}
+
+        result = {
+            "start": timestamps[0] if timestamps else None,
+            "end": timestamps[-1] if timestamps else None,
+            "points_in_range": len(timestamps),
+            "aggregates": {field: _aggregate(column) for field, column in columns.items()},
+        }
+        if max_points > 0:
+            step = max(1, math.ceil(len(timestamps) / max_points))
+            result["points"] = [
+                dict({"timestamp": timestamps[i]},
+                     **{field: (None if math.isnan(column[i]) else column[i]) for field, column in columns.items()})
+                for i in range(0, len(timestamps), step)
+            ]
+        return result
+
+    def stats(self):
+        with self._lock:
+            count = self._count
+            oldest = self._ordered(self._timestamps)[0] if count else None
+        return {
+            "points": count,
+            "capacity": self.capacity,
+            "fields": list(self.fields),
+            "oldest": oldest,
+            "memory_bytes": 8 * self.capacity * (len(self.fields) + 1),
+        }
+
+    def _ordered(self, column):
+        # Caller holds the lock. Returns the stored points oldest first.
+        if self._count < self.capacity:
+            return column[:self._count]
+        return column[self._next:] + column[:self._next]
+
+
+def _aggregate(column):
+    count = 0
+    total = 0.0
+    low = math.inf
+    high = -math.inf
+    last = None
+    for value in column:
+        if value != value: # NaN: missing
+            continue
+        count += 1
+        total += value
+        if value < low:
+            low = value
+        if value > high:
+            high = value
+        last = value
+    if not count:
+        return {"count": 0, "min": None, "max": None, "mean": None, "last": None}
+    return {"count": count, "min": low, "max": high, "mean": round(total / count, 3), "last": last}
@@ -0,0 +1,178 @@
+# jobs.py
+# Background job runner for long-running commands (update_system, run_speedtest, ...).
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+_current = threading.local()
+
+
+def current_job():
+    """
+    The Job being executed on this thread, or None outside a job worker.
+    """
+    return getattr(_current, "job", None)
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+    """
+    One submitted command. Output is appended while it runs and kept up to
+    `max_output_chars` (oldest text is discarded first).
+    """
+
+    def __init__(self, command, value, max_output_chars):
+        self.id = uuid.uuid4().hex
+        self.command = command
+        self.value = value
+        self.state = "queued"
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.return_code = None
+        self.http_status = None
+        self.result = None
+        self.max_output_chars = max_output_chars
+        self._output = []
+        self._output_chars = 0
+        self._output_offset = 0 # Number of characters discarded from the front
+        self._lock = threading.Lock()
+
+    def append_output(self, text):
+        with self._lock:
+            self._output.append(text)
+            self._output_chars += len(text)
+            while self._output_chars > self.max_output_chars and len(self._output) > 1:
+                dropped = self._output.pop(0)
+                self._output_chars -= len(dropped)
+                self._output_offset += len(dropped)
+
+    def output_since(self, offset=0):
+        """
+        Returns (text, next_offset) for output written at or after `offset`,
+        so pollers can fetch only what is new.
+        """
+        with self._lock:
+            text = "".join(self._output)
+            start = max(offset - self._output_offset, 0)
+            return text[start:], self._output_offset + len(text)
+
+    @property
+    def finished(self):
+        return self.state in ("succeeded", "failed")
+
+    def to_dict(self, output_offset=0, include_result=True):
+        output, next_offset = self.output_since(output_offset)
+        now = time.time()
+        job = {
+            "job_id": self.id,
+            "command": self.command,
+            "value": self.value,
+            "state": self.state,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queued_seconds": round((self.started_at or now) - self.submitted_at, 3),
+            "run_seconds": round((self.finished_at or now) - self.started_at, 3) if self.started_at else None,
+            "return_code": self.return_code,
+            "http_status": self.http_status,
+            "output": output,
+            "output_offset": next_offset,
+        }
+        if include_result:
+            job["result"] = self.result
+        return job
+
+
+class JobManager:
+    """
+    Runs commands on a bounded thread pool and keeps their records until they
+    are evicted, either by age (`retention_seconds`) or once more than
+    `max_finished_jobs` finished jobs are held.
+    """
+
+    def __init__(self, runner, max_workers=2, max_pending=16, max_finished_jobs=50,
+                 retention_seconds=3600, max_output_chars=64 * 1024):
+        self.runner = runner # runner(command, value) -> (response_dict, http_status)
+        self.max_pending = max_pending
+        self.max_finished_jobs = max_finished_jobs
+        self.retention_seconds = retention_seconds
+        self.max_output_chars = max_output_chars
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, command, value):
+        with self._lock:
+            self._evict_locked()
+            pending = sum(1 for job in self._jobs.values() if not job.finished)
+            if pending >= self.max_pending:
+                raise JobQueueFull(f"Too many pending jobs ({pending}); try again later.")
+            job = Job(command, value, self.max_output_chars)
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            self._evict_locked()
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            self._evict_locked()
+            return list(self._jobs.values())
+
+    def drain(self, timeout):
+        """
+        Waits up to `timeout` seconds for queued and running jobs to finish.
+        Returns the number of jobs still unfinished.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                unfinished = sum(1 for job in self._jobs.values() if not job.finished)
+            if unfinished == 0 or time.monotonic() >= deadline:
+                return unfinished
+            time.sleep(0.1)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def _run(self, job):
+        job.state = "running"
+        job.started_at = time.time()
+        _current.job = job
+        state = "failed"
+        try:
+            body, http_status = self.runner(job.command, job.value)
+            job.result = body
+            job.http_status = http_status
+            state = "succeeded" if 200 <= http_status < 300 else "failed"
+        except Exception as e:
+            log.error("Job %s (%s) crashed: %s", job.id, job.command, e)
+            job.result = {"status": "error", "message": f"Job failed: {str(e)}"}
+            job.http_status = 500
+        finally:
+            _current.job = None
+            # finished_at must be set before the state flips, eviction reads it for finished jobs
+            job.finished_at = time.time()
+            job.state = state
+
+    def _evict_locked(self):
+        cutoff = time.time() - self.retention_seconds
+        finished = [job for job in self._jobs.values() if job.finished]
+        for job in finished:
+            if job.finished_at < cutoff:
+                del self._jobs[job.id]
+        finished = [job for job in finished if job.id in self._jobs]
+        for job in finished[:max(len(finished) - self.max_finished_jobs, 0)]:
+            del self._jobs[job.id]
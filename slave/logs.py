@@ -0,0 +1,60 @@
+# logs.py
+# Levelled, non-blocking logging: callers only enqueue records, one background
+# thread formats them and writes to the console.
+import logging
+import logging.handlers
+import queue
+import sys
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler on a bounded queue that drops records (and counts them)
+    instead of blocking the caller when the console can't keep up.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler = None
+_listener = None
+
+
+def setup_logging(level="INFO", max_queued=10000, stream=None):
+    """
+    Routes every logger through a bounded queue to `stream` (stdout by
+    default). Safe to call again to change the level.
+    """
+    global _handler, _listener
+    root = logging.getLogger()
+    root.setLevel(level)
+    if _handler is not None:
+        return
+    _handler = DroppingQueueHandler(queue.Queue(maxsize=max_queued))
+    console = logging.StreamHandler(stream or sys.stdout)
+    console.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    _listener = logging.handlers.QueueListener(_handler.queue, console, respect_handler_level=True)
+    _listener.start()
+    root.addHandler(_handler)
+
+
+def stop_logging():
+    """
+    Writes out whatever is still queued and stops the writer thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def dropped_records():
+    return _handler.dropped if _handler is not None else 0
@@ -0,0 +1,101 @@
+# metrics.py
+# Latency histograms and a Prometheus text-format writer for the /metrics endpoint.
+import bisect
+import math
+import threading
+
+# Seconds; spans cached reads (ms) up to apt runs (tens of minutes)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram of durations in seconds, as Prometheus expects.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1) # Last slot is +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += seconds
+
+    def snapshot(self):
+        """
+        ([(upper_bound, cumulative_count), ..., (inf, total)], sum)
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total_sum = self._sum
+        cumulative = []
+        running = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            running += count
+            cumulative.append((bound, running))
+        return cumulative, total_sum
+
+
+class PrometheusWriter:
+    """
+    Collects samples by metric family and renders the text exposition
+    format (HELP and TYPE once per family).
+    """
+
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self._families = {}
+
+    def counter(self, name, help_text, value, labels=None):
+        self._add(name, "counter", help_text, "", value, labels)
+
+    def gauge(self, name, help_text, value, labels=None):
+        self._add(name, "gauge", help_text, "", value, labels)
+
+    def histogram(self, name, help_text, histogram, labels=None):
+        buckets, total_sum = histogram.snapshot()
+        for bound, count in buckets:
+            bucket_labels = dict(labels or {}, le="+Inf" if bound == math.inf else _format_value(bound))
+            self._add(name, "histogram", help_text, "_bucket", count, bucket_labels)
+        self._add(name, "histogram", help_text, "_sum", total_sum, labels)
+        self._add(name, "histogram", help_text, "_count", buckets[-1][1], labels)
+
+    def render(self):
+        lines = []
+        for name, (kind, help_text, samples) in self._families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, value, labels in samples:
+                lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _add(self, name, kind, help_text, suffix, value, labels):
+        if value is None:
+            return
+        name = self.prefix + name
+        family = self._families.setdefault(name, (kind, help_text, []))
+        family[2].append((suffix, value, labels))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels.items()) + "}"
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
@@ -0,0 +1,101 @@
+# profiler.py
+# On-demand sampling profiler: snapshots every thread's stack at a fixed interval
+# and reports the hottest stacks and functions.
+import os
+import sys
+import threading
+import time
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+class SamplingProfiler:
+    """
+    Samples all Python threads with sys._current_frames(). Cheap enough to
+    run on a live agent: nothing is traced between samples, and only one
+    profile runs at a time.
+    """
+
+    def __init__(self, max_seconds=60, max_stack_depth=40):
+        self.max_seconds = max_seconds
+        self.max_stack_depth = max_stack_depth
+        self._running = threading.Lock()
+
+    def profile(self, seconds, interval_seconds=0.005, top=20, include_idle=False):
+        """
+        Samples for `seconds` (capped at max_seconds) and returns the `top`
+        stacks and functions by sample count. Threads parked in a wait
+        (lock, select, sleep) are skipped unless `include_idle` is set.
+        Raises ProfilerBusy if a profile is already running.
+        """
+        seconds = min(max(float(seconds), 0.1), self.max_seconds)
+        if not self._running.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already running.")
+        try:
+            return self._sample(seconds, interval_seconds, top, include_idle)
+        finally:
+            self._running.release()
+
+    def _sample(self, seconds, interval_seconds, top, include_idle):
+        me = threading.get_ident()
+        thread_names = {}
+        stacks = {}
+        functions = {}
+        samples = 0
+        start = time.perf_counter()
+        deadline = start + seconds
+        while time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if not include_idle and _is_idle(frame):
+                    continue
+                stack = self._stack(frame)
+                key = (names.get(ident, str(ident)), stack)
+                stacks[key] = stacks.get(key, 0) + 1
+                function = stack[-1].rsplit(":", 1)[0] # Without the line number
+                functions[function] = functions.get(function, 0) + 1
+                thread_names[ident] = names.get(ident, str(ident))
+                samples += 1
+            time.sleep(interval_seconds)
+        elapsed = time.perf_counter() - start
+
+        hot_stacks = sorted(stacks.items(), key=lambda item: item[1], reverse=True)[:top]
+        hot_functions = sorted(functions.items(), key=lambda item: item[1], reverse=True)[:top]
+        return {
+            "seconds": round(elapsed, 3),
+            "interval_ms": interval_seconds * 1000,
+            "samples": samples,
+            "threads_seen": sorted(set(thread_names.values())),
+            "hot_stacks": [
+                {"thread": thread, "samples": count, "percent": round(100.0 * count / samples, 1), "stack": list(stack)}
+                for (thread, stack), count in hot_stacks
+            ],
+            "hot_functions": [
+                {"function": function, "samples": count, "percent": round(100.0 * count / samples, 1)}
+                for function, count in hot_functions
+            ],
+        }
+
+    def _stack(self, frame):
+        # Outermost call first, like a flame graph
+        entries = []
+        while frame is not None and len(entries) < self.max_stack_depth:
+            code = frame.f_code
+            entries.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        return tuple(reversed(entries))
+
+
+# Innermost functions where an idle thread sits waiting
+_IDLE_FUNCTIONS = {
+    "wait", "select", "poll", "accept", "_wait_for_tstate_lock", "get", "sleep",
+    "readinto", "recv_into", "serve_forever", "_worker",
+}
+
+
+def _is_idle(frame):
+    return frame.f_code.co_name in _IDLE_FUNCTIONS
@@ -0,0 +1,125 @@
+# registry.py
+# Maps command names to handlers, with lazy loading and per-command metrics.
+import importlib
+import threading
+import time
+
+from metrics import Histogram
+
+# Cost classes: how expensive a command is, so callers can schedule it
+CHEAP = "cheap" # Answers from memory or a few file reads
+SLOW = "slow" # Network lookups or short subprocesses (seconds)
+LONG_RUNNING = "long_running" # apt, speedtest, arbitrary shell commands (minutes)
+
+
+class CommandHandler:
+    """
+    A registered command. `target` is either the handler callable itself or
+    an import path "module:function", imported the first time the command
+    is dispatched. Handlers take the command value and return
+    (response_dict, http_status).
+    """
+
+    def __init__(self, name, target, cost=CHEAP, description=""):
+        self.name = name
+        self.cost = cost
+        self.description = description
+        self._target = target
+        self._func = target if callable(target) else None
+        self._load_lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.last_ms = None
+        self.latency = Histogram()
+
+    @property
+    def loaded(self):
+        return self._func is not None
+
+    def resolve(self):
+        if self._func is None:
+            with self._load_lock:
+                if self._func is None:
+                    module_name, _, attr = self._target.partition(":")
+                    self._func = getattr(importlib.import_module(module_name), attr)
+        return self._func
+
+
+class CommandRegistry:
+    def __init__(self):
+        self._handlers = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, target, cost=CHEAP, description=""):
+        if name in self._handlers:
+            raise ValueError(f"Command '{name}' is already registered")
+        self._handlers[name] = CommandHandler(name, target, cost, description)
+
+    def command(self, name, cost=CHEAP, description=""):
+        """
+        Decorator form of register().
+        """
+        def decorator(func):
+            self.register(name, func, cost, description or (func.__doc__ or "").strip())
+            return func
+        return decorator
+
+    def get(self, name):
+        return self._handlers.get(name)
+
+    def cost_of(self, name):
+        handler = self._handlers.get(name)
+        return handler.cost if handler is not None else None
+
+    def dispatch(self, name, value):
+        """
+        Runs the handler for `name`. Returns None for an unknown command,
+        otherwise the handler's (response_dict, http_status).
+        """
+        handler = self._handlers.get(name)
+        if handler is None:
+            return None
+        start = time.perf_counter()
+        status_code = 500
+        try:
+            response_body, status_code = handler.resolve()(value)
+            return response_body, status_code
+        finally:
+            elapsed = time.perf_counter() - start
+            elapsed_ms = elapsed * 1000
+            handler.latency.observe(elapsed)
+            with self._lock:
+                handler.calls += 1
+                if status_code >= 400:
+                    handler.errors += 1
+                handler.total_ms += elapsed_ms
+                handler.max_ms = max(handler.max_ms, elapsed_ms)
+                handler.last_ms = round(elapsed_ms, 2)
+
+    def handlers(self):
+        return list(self._handlers.values())
+
+    def describe(self):
+        return [
+            {"command": h.name, "cost": h.cost, "loaded": h.loaded, "description": h.description}
+            for h in self._handlers.values()
+        ]
+
+    def metrics(self):
+        """
+        Call count, error count and latency (ms) per command that has been called.
+        """
+        with self._lock:
+            return {
+                h.name: {
+                    "calls": h.calls,
+                    "errors": h.errors,
+                    "avg_ms": round(h.total_ms / h.calls, 2),
+                    "max_ms": round(h.max_ms, 2),
+                    "last_ms": h.last_ms,
+                    "cost": h.cost,
+                }
+                for h in self._handlers.values() if h.calls
+            }
@@ -0,0 +1,172 @@
+# sampling.py
+# High-rate sensor sampling into ring buffers, summarised once per report window.
+import logging
+import math
+import threading
+import time
+from array import array
+
+log = logging.getLogger(__name__)
+
+
+class RingBuffer:
+    """
+    Fixed-capacity buffer of floats; once full, new values overwrite the oldest.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._values = array("d", bytes(8 * capacity))
+        self._next = 0
+        self._count = 0
+
+    def append(self, value):
+        self._values[self._next] = value
+        self._next = (self._next + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+
+    def values(self):
+        """
+        Contents oldest first, as an array.
+        """
+        if self._count < self.capacity:
+            return self._values[:self._count]
+        return self._values[self._next:] + self._values[:self._next]
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+
+def summarize(values):
+    """
+    min/max/mean/p95/count of `values`, or None if there are none. p95 uses
+    the nearest-rank method, so it is always one of the samples.
+    """
+    count = len(values)
+    if not count:
+        return None
+    ordered = sorted(values)
+    return {
+        "min": ordered[0],
+        "max": ordered[-1],
+        "mean": round(sum(ordered) / count, 3),
+        "p95": ordered[math.ceil(0.95 * count) - 1],
+        "count": count,
+    }
+
+
+class WindowSampler:
+    """
+    Samples `read_sample()` (which returns {field: number or None}) each time
+    sample() is called and keeps the current window per field in a
+    RingBuffer of `capacity` values. take_window() summarises the window
+    and starts a new one.
+
+    With `deadband` ({field: threshold}), should_report() only lets a
+    window through when some field's mean has moved at least its threshold
+    since the last reported window, or `max_silence_seconds` have passed.
+    """
+
+    def __init__(self, read_sample, capacity=600, deadband=None, max_silence_seconds=3600):
+        self.read_sample = read_sample
+        self.capacity = capacity
+        self.deadband = deadband or {}
+        self.max_silence_seconds = max_silence_seconds
+        self._buffers = {}
+        self._latest = {}
+        self._window_started_at = time.time()
+        self._last_reported = None
+        self._last_reported_at = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "samples": 0,
+            "sample_errors": 0,
+            "windows": 0,
+            "reports_suppressed": 0,
+        }
+
+    def sample(self):
+        try:
+            values = self.read_sample()
+        except Exception as e:
+            log.warning("Error reading sensor sample: %s", e)
+            with self._lock:
+                self._stats["sample_errors"] += 1
+            return
+        with self._lock:
+            for field, value in values.items():
+                if value is None:
+                    continue
+                buffer = self._buffers.get(field)
+                if buffer is None:
+                    buffer = self._buffers[field] = RingBuffer(self.capacity)
+                buffer.append(float(value))
+            self._latest = values
+            self._stats["samples"] += 1
+
+    def latest(self):
+        """
+        The most recent sample, or {} before the first one.
+        """
+        with self._lock:
+            return dict(self._latest)
+
+    def take_window(self):
+        """
+        Returns {"started_at", "ended_at", field: summary, ...} for the
+        current window, or None if it holds no samples, and starts a new window.
+        """
+        now = time.time()
+        with self._lock:
+            summaries = {field: summarize(buffer.values()) for field, buffer in self._buffers.items() if len(buffer)}
+            for buffer in self._buffers.values():
+                buffer.clear()
+            started_at = self._window_started_at
+            self._window_started_at = now
+            if summaries:
+                self._stats["windows"] += 1
+        if not summaries:
+            return None
+        summaries["started_at"] = started_at
+        summaries["ended_at"] = now
+        return summaries
+
+    def should_report(self, window):
+        """
+        Applies the deadband to a window from take_window(). A True result
+        is recorded as the new baseline; a False one is counted as suppressed.
+        """
+        with self._lock:
+            report = self._outside_deadband_locked(window)
+            if report:
+                self._last_reported = {field: window[field]["mean"] for field in self.deadband if field in window}
+                self._last_reported_at = time.monotonic()
+            else:
+                self._stats["reports_suppressed"] += 1
+            return report
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["window_samples"] = {field: len(buffer) for field, buffer in self._buffers.items()}
+        stats["capacity"] = self.capacity
+        stats["deadband"] = self.deadband or None
+        return stats
+
+    def _outside_deadband_locked(self, window):
+        if not self.deadband or self._last_reported is None:
+            return True
+        if time.monotonic() - self._last_reported_at >= self.max_silence_seconds:
+            return True
+        for field, threshold in self.deadband.items():
+            if field not in window:
+                continue
+            previous = self._last_reported.get(field)
+            if previous is None or abs(window[field]["mean"] - previous) >= threshold:
+                return True
+        return False
@@ -0,0 +1,154 @@
+# serving.py
+# Production HTTP server for the agent: a fixed pool of worker threads, a cap
+# on queued connections with a fast 503, and graceful shutdown on SIGTERM/SIGINT.
+import json
+import logging
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+log = logging.getLogger(__name__)
+
+_OVERLOAD_BODY = json.dumps({"status": "error", "message": "Agent is overloaded, retry shortly."}).encode("utf-8")
+_OVERLOAD_RESPONSE = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    b"Content-Type: application/json\r\n"
+    b"Retry-After: 1\r\n"
+    b"Connection: close\r\n"
+    b"Content-Length: " + str(len(_OVERLOAD_BODY)).encode("ascii") + b"\r\n\r\n" + _OVERLOAD_BODY
+)
+
+_active_server = None
+
+
+def active_server():
+    """
+    The PooledWSGIServer currently running serve(), if any.
+    """
+    return _active_server
+
+
+class _KeepAliveRequestHandler(WSGIRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive and chunked (streaming) responses
+    timeout = 15 # Idle keep-alive connections give their worker back after this
+
+    def log_request(self, code="-", size="-"):
+        # Per-request access logging to the console is too costly on a Pi
+        pass
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    Werkzeug WSGI server that hands accepted connections to a fixed-size
+    thread pool instead of a new thread each. Once `max_pending` connections
+    are queued or being served, new ones get an immediate 503 from the
+    accept loop without tying up a worker.
+    """
+
+    multithread = True
+
+    def __init__(self, host, port, app, workers=8, max_pending=32, backlog=128, keepalive_timeout=15):
+        self.request_queue_size = backlog # listen() backlog, applied in server_activate()
+        handler = type("RequestHandler", (_KeepAliveRequestHandler,), {"timeout": keepalive_timeout})
+        super().__init__(host, port, app, handler=handler)
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http")
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+        self.rejected = 0
+        self.served = 0
+
+    def process_request(self, request, client_address):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                overloaded = True
+            else:
+                self._pending += 1
+                overloaded = False
+        if overloaded:
+            try:
+                request.settimeout(1)
+                request.sendall(_OVERLOAD_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        self._pool.submit(self._process_request_worker, request, client_address)
+
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._lock:
+                self._pending -= 1
+                self.served += 1
+                self._idle.notify_all()
+
+    def drain(self, timeout):
+        """
+        Waits up to `timeout` seconds for in-flight connections to finish.
+        Returns the number still running.
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self._pending > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._idle.wait(remaining)
+            return self._pending
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "served": self.served,
+                "rejected": self.rejected,
+            }
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=False)
+
+
+def serve(server, drain_timeout_seconds=30, on_shutdown=None):
+    """
+    Runs `server` until SIGTERM or SIGINT, then stops accepting, drains
+    in-flight requests for up to `drain_timeout_seconds` and calls
+    `on_shutdown()` before closing the socket.
+    """
+    global _active_server
+    _active_server = server
+    stopping = threading.Event()
+
+    def request_stop(signum, frame):
+        if not stopping.is_set():
+            stopping.set()
+            log.info("Received signal %s, shutting down...", signum)
+            # shutdown() blocks until serve_forever() returns, so it can't run on this thread
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+    previous_handlers = {sig: signal.signal(sig, request_stop) for sig in (signal.SIGTERM, signal.SIGINT)}
+    try:
+        server.serve_forever()
+    finally:
+        for sig, handler in previous_handlers.items():
+            signal.signal(sig, handler)
+        still_running = server.drain(drain_timeout_seconds)
+        if still_running:
+            log.warning("Drain timeout reached with %d requests still running.", still_running)
+        if on_shutdown is not None:
+            on_shutdown()
+        server.server_close()
+        _active_server = None
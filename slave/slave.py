@@ -1,24 +1,90 @@
 # laptop_slave_app.py (Run this on your laptop)
-from flask import Flask, request, jsonify
-import json
 import time
+import_started_at = time.perf_counter() # Before any other import, for the startup breakdown
+import argparse
+import hmac
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 import os
 import subprocess
 import random
 import re
-import requests
-from datetime import datetime
-from apscheduler.schedulers.background import BackgroundScheduler
+import shutil
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+from uploader import TelemetryUploader
+from spool import ReadingSpool
+from sampling import WindowSampler
+from history import HistoryStore
+import collectors
+from cache import TTLCache
+from jobs import JobManager, JobQueueFull, current_job
+from executor import CommandExecutor, ExecutorBusy, ResourceLimits, NO_LIMITS
+from registry import CommandRegistry, CHEAP, SLOW, LONG_RUNNING
+from admission import AdmissionController, CommandRejected
+from channel import CommandChannel
+import streaming
+import logs
+import startup
+from metrics import Histogram, PrometheusWriter
+from profiler import SamplingProfiler, ProfilerBusy
+# Flask, requests, APScheduler and werkzeug's server are imported where they are first used:
+# together they take longer to import than the rest of the agent, and on a Pi Zero that
+# delays the first report after a reboot by seconds.
 
 # If you want to use the private key for signing/verification on the laptop,
 # you would need a library like 'cryptography' (pip install cryptography)
 
-app = Flask(__name__)
+log = logging.getLogger("agent")
+startup_timer = startup.StartupTimer(import_started_at)
+
+# HTTP routes, added to the Flask app when create_app() first builds it
+http_routes = []
+
+def route(rule, **options):
+    def register(view_func):
+        http_routes.append((rule, options, view_func))
+        return view_func
+    return register
+
+def create_app():
+    """
+    Imports Flask and builds the app from http_routes. Also binds the Flask
+    request helpers the route functions use.
+    """
+    global app, request, jsonify, Response
+    from flask import Flask, request, jsonify, Response
+    app = Flask(__name__)
+    for rule, options, view_func in http_routes:
+        app.add_url_rule(rule, view_func=view_func, **options)
+    return app
+
+def active_server():
+    # The pooled server, if running; serving (and werkzeug) is only imported once it starts
+    serving = sys.modules.get("serving")
+    return serving.active_server() if serving is not None else None
+
+def __getattr__(name):
+    # slave.app from other modules (benchmark, tests) builds the app on first access
+    if name == "app":
+        return create_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # --- Configuration for this Laptop Slave API ---
 SLAVE_API_PORT = 5001
 SLAVE_API_PATH = '/execute_command'
 
+# HTTP server: "threaded" (pooled production server) or "dev" (Flask development server)
+SERVER_MODE = "threaded"
+SERVER_WORKERS = 8
+SERVER_MAX_PENDING_CONNECTIONS = 32 # Beyond this new connections get an immediate 503
+SERVER_LISTEN_BACKLOG = 128
+SERVER_KEEPALIVE_TIMEOUT_SECONDS = 15
+SERVER_DRAIN_TIMEOUT_SECONDS = 30 # On SIGTERM, wait this long for in-flight requests and jobs
+
 # --- Configuration for Master Backend API ---
 # IMPORTANT: Replace with the actual IP and port of your Express.js server
 MASTER_API_BASE_URL = "http://172.20.10.2:5000/api"
@@ -28,6 +94,131 @@ THIS_DEVICE_ID = "laptop_tashi" # <-- IMPORTANT: Match the device_id you registe
 # NEW: Sensor data sending interval (in seconds)
 SENSOR_DATA_SEND_INTERVAL_SECONDS = 300 # Send data every 30 seconds
 
+# Cold start: report "online" with one sample as soon as the agent starts (before the scheduler
+# and HTTP server are up), and send the first windowed report after FIRST_SENSOR_REPORT_DELAY_SECONDS
+# rather than a full SENSOR_DATA_SEND_INTERVAL_SECONDS
+STARTUP_ONLINE_REPORT_ENABLED = True
+FIRST_SENSOR_REPORT_DELAY_SECONDS = 30
+
+# High-rate sampling: sensors are read every SAMPLE_INTERVAL_SECONDS and each report carries
+# min/max/mean/p95/count for the window since the previous one. With sampling disabled the
+# report takes a single sample as before.
+SAMPLING_ENABLED = True
+SAMPLE_INTERVAL_SECONDS = 1
+SAMPLING_WINDOW_CAPACITY = 600 # Samples kept per field and window; the oldest are overwritten beyond this
+# Deadband: skip a report unless a field's mean moved at least this much since the last one sent
+SAMPLING_DEADBAND_ENABLED = False
+SAMPLING_DEADBAND_THRESHOLDS = {"temperature": 0.5, "humidity": 2.0}
+SAMPLING_DEADBAND_MAX_SILENCE_SECONDS = 3600 # Report anyway after this long, as a heartbeat
+
+# Local metric history, queried with the "history" command or GET /history
+HISTORY_ENABLED = True
+HISTORY_RECORD_INTERVAL_SECONDS = 30
+HISTORY_CAPACITY = 2880 # Points kept (24 hours at 30 s), about 140 KB
+HISTORY_DISK_MOUNT = "/" # Filesystem whose used_percent is recorded
+HISTORY_MAX_POINTS = 500 # Most raw points one query returns
+
+# Telemetry upload batching. With UPLOAD_BATCHING_ENABLED = False every reading is
+# POSTed to /sensor_data/<device_id>/report as before.
+UPLOAD_BATCHING_ENABLED = True
+UPLOAD_MAX_BATCH_SIZE = 50 # Flush once this many readings are buffered
+UPLOAD_MAX_BATCH_AGE_SECONDS = 600 # ...or once the oldest buffered reading is this old
+UPLOAD_MAX_BUFFERED_READINGS = 1000 # Oldest readings are dropped beyond this
+UPLOAD_COMPRESS = True # gzip request bodies
+UPLOAD_MAX_BATCH_BYTES = 64 * 1024 # JSON per batch request, before gzip; larger batches are split
+UPLOAD_TIMEOUT_SECONDS = 10
+UPLOAD_FLUSH_CHECK_INTERVAL_SECONDS = 30
+
+# Store-and-forward: readings the master doesn't accept are kept on disk and replayed in order.
+# The spool is opened at startup (not on import); if SPOOL_PATH isn't writable the agent runs without it.
+SPOOL_ENABLED = True
+SPOOL_PATH = os.environ.get("AGENT_SPOOL_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "telemetry_spool.db")
+SPOOL_MAX_READINGS = 100000 # Oldest spooled readings are evicted beyond this (~15 MB on disk)
+SPOOL_REPLAY_BATCH_SIZE = 500 # Readings read from the spool per replayed batch (sent in UPLOAD_MAX_BATCH_BYTES chunks)
+SPOOL_REPLAY_MAX_BATCHES = 20 # Batches per replay run
+SPOOL_REPLAY_CHECK_INTERVAL_SECONDS = 15
+SPOOL_RETRY_INITIAL_SECONDS = 5 # Backoff after a failed send doubles from here...
+SPOOL_RETRY_MAX_SECONDS = 600 # ...up to this
+
+# Lookup cache for slow or static data (public IP, geolocation, host facts)
+LOOKUP_CACHE_MAX_ENTRIES = 256
+PUBLIC_IP_CACHE_TTL_SECONDS = 300
+PUBLIC_IP_STALE_TTL_SECONDS = 3600 # Serve a stale public IP this long while refreshing in the background
+GEOLOCATION_CACHE_TTL_SECONDS = 24 * 3600
+HOST_FACTS_CACHE_TTL_SECONDS = 3600
+TOOL_AVAILABILITY_CACHE_TTL_SECONDS = 3600
+LOOKUP_FAILURE_CACHE_TTL_SECONDS = 30 # Failed lookups are not retried for this long
+EXTERNAL_LOOKUP_TIMEOUT_SECONDS = 5
+PUBLIC_IP_LOOKUP_URL = "https://ifconfig.me/ip"
+GEOLOCATION_LOOKUP_URL = "http://ip-api.com/json/{ip}"
+
+# Background jobs for long-running commands (send {"async": true} with a command)
+JOB_MAX_WORKERS = 2
+JOB_MAX_PENDING = 16 # Queued + running jobs; further submissions get a 503
+JOB_MAX_FINISHED = 50 # Finished jobs kept for polling...
+JOB_RETENTION_SECONDS = 3600 # ...and for at most this long
+JOB_MAX_OUTPUT_CHARS = 64 * 1024 # Output kept per job (oldest discarded first)
+
+# Streaming execute_command (send {"stream": true}): output beyond the cap is discarded
+STREAM_MAX_OUTPUT_BYTES = 1024 * 1024
+STREAM_CHUNK_SIZE = 4096
+
+# Child process execution: every command goes through one executor
+EXEC_MAX_CONCURRENT_PROCESSES = 4 # Further commands wait EXEC_SLOT_WAIT_SECONDS, then get a 503
+EXEC_SLOT_WAIT_SECONDS = 2
+EXEC_DEFAULT_TIMEOUT_SECONDS = 60 # Process group is killed after this
+EXEC_DEFAULT_LIMITS = ResourceLimits(cpu_seconds=120, address_space_mb=512, open_files=256)
+SHELL_FALLBACK_TIMEOUT_SECONDS = 10
+# Per-command (timeout_seconds, ResourceLimits); anything else uses the defaults above
+COMMAND_EXEC_POLICIES = {
+    "update_system": (1800, NO_LIMITS), # apt runs under sudo and needs its memory
+    "run_speedtest": (180, ResourceLimits(cpu_seconds=120, address_space_mb=None, open_files=256)),
+    "execute_command": (300, EXEC_DEFAULT_LIMITS),
+    "reboot_pi": (30, EXEC_DEFAULT_LIMITS),
+    "shutdown_pi": (30, EXEC_DEFAULT_LIMITS),
+    "cpu_temp": (10, EXEC_DEFAULT_LIMITS),
+}
+SPEEDTEST_INSTALL_TIMEOUT_SECONDS = 600
+
+# Batch endpoint: independent commands in one request run in parallel on this many threads
+BATCH_MAX_WORKERS = 4
+BATCH_MAX_ITEMS = 20
+# Whole-batch deadline; items still unfinished then are reported as 504 (kept under the channel's 300 s wait)
+BATCH_DEADLINE_SECONDS = 240
+# These change system state, so they run one at a time after the rest (as do long-running commands)
+BATCH_SERIAL_COMMANDS = {"reboot_pi", "shutdown_pi"}
+
+# Admission control in front of every command: (max_concurrent, max_queued) per cost class,
+# None for no limit. Requests beyond both get a 503 with Retry-After.
+ADMISSION_LIMITS_BY_COST = {CHEAP: None, SLOW: (4, 8), LONG_RUNNING: (1, 2)}
+COMMAND_ADMISSION_LIMITS = {
+    "run_speedtest": (1, 0), # Concurrent speedtests skew each other's results
+    "update_system": (1, 0), # apt holds the dpkg lock
+    "execute_command": None, # Arbitrary shell commands are already capped by the executor
+}
+ADMISSION_MAX_WAIT_SECONDS = 30 # Longest a queued request waits for a slot
+# Identical in-flight requests (same command and value) share one run, except cheap
+# commands and these, where every request must have its own effect
+ADMISSION_NO_COALESCE = {"execute_command", "display_message", "send_sensor_data"}
+
+# Outbound command channel (--channel): the agent long-polls the master for commands, so they
+# reach it behind NAT without an inbound connection to SLAVE_API_PORT
+COMMAND_CHANNEL_ENABLED = False
+COMMAND_CHANNEL_POLL_WAIT_SECONDS = 25 # The master holds each poll open this long; also the heartbeat
+COMMAND_CHANNEL_WORKERS = 4 # Channel commands that can run at once
+COMMAND_CHANNEL_RECONNECT_MAX_SECONDS = 60
+
+# Observability: levelled logging through a non-blocking queue, counters and latency histograms
+# on GET /metrics (Prometheus text format), and a sampling profiler on POST /debug/profile
+LOG_LEVEL = "INFO" # DEBUG adds apt/speedtest output and per-sample messages
+LOG_QUEUE_SIZE = 10000 # Records waiting for the console; beyond this new ones are dropped and counted
+AGENT_ADMIN_TOKEN = os.environ.get("AGENT_ADMIN_TOKEN") # Sent as X-Agent-Token to /debug/profile; unset disables it
+PROFILE_MAX_SECONDS = 60
+
+# Additional command handlers living in other modules: name -> ("module:function", cost class).
+# They are imported on first use, e.g. {"read_dht22": ("dht_sensor:handle_read", SLOW)}
+EXTRA_COMMAND_HANDLERS = {}
+
 # IMPORTANT: Implement proper authentication for incoming commands
 # This example uses a very basic check. In production:
 # 1. Have your laptop verify a JWT signed by your Express backend's private key.
@@ -35,418 +226,1307 @@ SENSOR_DATA_SEND_INTERVAL_SECONDS = 300 # Send data every 30 seconds
 # 3. For security, don't expose this port directly to the internet without proper firewall/VPN.
 
 
+# Shared uploader: one keep-alive session to the master, readings batched and gzipped
+telemetry_uploader = TelemetryUploader(
+    MASTER_API_BASE_URL,
+    THIS_DEVICE_ID,
+    batching=UPLOAD_BATCHING_ENABLED,
+    max_batch_size=UPLOAD_MAX_BATCH_SIZE,
+    max_batch_age_seconds=UPLOAD_MAX_BATCH_AGE_SECONDS,
+    max_buffered_readings=UPLOAD_MAX_BUFFERED_READINGS,
+    compress=UPLOAD_COMPRESS,
+    timeout_seconds=UPLOAD_TIMEOUT_SECONDS,
+    replay_batch_size=SPOOL_REPLAY_BATCH_SIZE,
+    replay_backoff_initial_seconds=SPOOL_RETRY_INITIAL_SECONDS,
+    replay_backoff_max_seconds=SPOOL_RETRY_MAX_SECONDS,
+    max_batch_bytes=UPLOAD_MAX_BATCH_BYTES
+)
+
+def open_spool(path):
+    """
+    Opens the reading spool at `path` and attaches it to the uploader. On
+    failure (e.g. a read-only install directory) the agent carries on
+    without one, and unsent readings wait in memory instead.
+    """
+    try:
+        telemetry_uploader.spool = ReadingSpool(path, max_readings=SPOOL_MAX_READINGS)
+    except (sqlite3.Error, OSError) as e:
+        log.warning("Could not open the reading spool at %s, running without one: %s", path, e)
+
 # Function to send sensor data to the master backend
-def send_sensor_data_to_master(temperature, humidity, status="active"):
+def send_sensor_data_to_master(temperature, humidity, status="active", flush=False, window=None):
     """
     Sends sensor data to the master Express.js backend.
+    With batching enabled the reading is queued and uploaded with the next
+    batch, unless `flush` is True. `window` is an optional summary of the
+    samples behind the reading (see sampling.WindowSampler.take_window).
     """
     try:
-        report_url = f"{MASTER_API_BASE_URL}/sensor_data/{THIS_DEVICE_ID}/report"
         payload = {
             "timestamp": datetime.now().isoformat(),
             "temperature": temperature,
             "humidity": humidity,
             "status": status
         }
-        headers = {'Content-Type': 'application/json'}
-
-        # In a real scenario, you'd add authentication headers here (e.g., a signed JWT from this device)
-        # headers['Authorization'] = 'Bearer YOUR_DEVICE_JWT'
-
-        print(f"Sending sensor data to master: {report_url} with payload: {payload}")
-        response = requests.post(report_url, json=payload, headers=headers)
-        response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-        print(f"Sensor data sent successfully. Master response: {response.json()}")
-        return True, response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error sending sensor data to master: {e}")
-        return False, {"error": str(e)}
+        if window is not None:
+            payload["window"] = window
+        return telemetry_uploader.submit(payload, flush=flush)
     except Exception as e:
-        print(f"Unexpected error in send_sensor_data_to_master: {e}")
+        log.error("Unexpected error in send_sensor_data_to_master: %s", e)
         return False, {"error": f"An unexpected error occurred: {e}"}
 
+# Scheduled job function to upload batched readings that have waited long enough
+def flush_telemetry_uploads():
+    success, response = telemetry_uploader.flush_if_due()
+    if not success:
+        log.warning("Failed to upload batched sensor data: %s", response)
+
+# Scheduled job function to replay spooled readings once the master is reachable again
+def replay_spooled_readings():
+    if telemetry_uploader.spool is None or not telemetry_uploader.spool.depth():
+        return
+    success, response = telemetry_uploader.replay(max_batches=SPOOL_REPLAY_MAX_BATCHES)
+    if not success:
+        log.info("Spool replay deferred: %s", response)
+
+lookup_cache = TTLCache(max_entries=LOOKUP_CACHE_MAX_ENTRIES)
+
+def get_public_ip():
+    """
+    Public IP as seen by ifconfig.me, cached. Raises requests.exceptions.RequestException on failure.
+    """
+    def load():
+        import requests
+        response = requests.get(PUBLIC_IP_LOOKUP_URL, timeout=EXTERNAL_LOOKUP_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        return response.text.strip()
+    return lookup_cache.get_or_load(
+        "public_ip", load,
+        ttl=PUBLIC_IP_CACHE_TTL_SECONDS,
+        negative_ttl=LOOKUP_FAILURE_CACHE_TTL_SECONDS,
+        stale_ttl=PUBLIC_IP_STALE_TTL_SECONDS
+    )
+
+def get_ip_geolocation(ip):
+    """
+    Raw ip-api.com lookup for `ip`, cached per IP.
+    """
+    def load():
+        import requests
+        response = requests.get(GEOLOCATION_LOOKUP_URL.format(ip=ip), timeout=EXTERNAL_LOOKUP_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        return response.json()
+    return lookup_cache.get_or_load(
+        ("geolocation", ip), load,
+        ttl=GEOLOCATION_CACHE_TTL_SECONDS,
+        negative_ttl=LOOKUP_FAILURE_CACHE_TTL_SECONDS
+    )
+
+def get_host_facts():
+    """
+    Host facts that do not change while the agent runs (hostname, OS, kernel, CPU model).
+    """
+    def load():
+        return {
+            "hostname": collectors.hostname(),
+            "os": collectors.os_pretty_name(),
+            "kernel": collectors.kernel_release(),
+            "cpu": collectors.cpu_model() or run_shell_output("lscpu 2>/dev/null | grep \"Model name\" | cut -d ':' -f 2 | xargs"),
+            "cpu_count": collectors.cpu_count()
+        }
+    return lookup_cache.get_or_load("host_facts", load, ttl=HOST_FACTS_CACHE_TTL_SECONDS)
+
+def is_tool_installed(name):
+    return lookup_cache.get_or_load(
+        ("tool", name), lambda: shutil.which(name) is not None,
+        ttl=TOOL_AVAILABILITY_CACHE_TTL_SECONDS
+    )
+
+command_executor = CommandExecutor(
+    max_concurrent=EXEC_MAX_CONCURRENT_PROCESSES,
+    acquire_timeout_seconds=EXEC_SLOT_WAIT_SECONDS,
+    default_timeout_seconds=EXEC_DEFAULT_TIMEOUT_SECONDS,
+    default_limits=EXEC_DEFAULT_LIMITS
+)
+
+# (timeout_seconds, ResourceLimits) for a command name
+def exec_policy(command):
+    return COMMAND_EXEC_POLICIES.get(command, (EXEC_DEFAULT_TIMEOUT_SECONDS, EXEC_DEFAULT_LIMITS))
+
+# Runs a shell command like subprocess.run(cmd, shell=True, text=True, capture_output=True),
+# through the executor with the timeout and rlimits configured for `command`.
+# Inside a background job the output is also streamed into the job as it is produced,
+# so pollers see partial output while e.g. apt is still running; the captured result is then
+# capped at STREAM_MAX_OUTPUT_BYTES like a streamed command's.
+# Inside a batch the timeout is also capped at the time left before the batch deadline.
+def run_subprocess(cmd, command, check=False, timeout=None):
+    default_timeout, limits = exec_policy(command)
+    timeout = timeout if timeout is not None else default_timeout
+    deadline = getattr(batch_context, "deadline", None)
+    if deadline is not None:
+        timeout = min(timeout, max(round(deadline - time.perf_counter(), 1), 0.1))
+    job = current_job()
+    result = command_executor.run(
+        cmd,
+        timeout=timeout,
+        check=check,
+        limits=limits,
+        on_output=job.append_output if job is not None else None,
+        max_output_chars=STREAM_MAX_OUTPUT_BYTES if job is not None else None
+    )
+    if job is not None:
+        job.return_code = result.returncode
+    return result
+
+# Runs a shell command and returns its stripped stdout ("" on failure)
+def run_shell_output(cmd):
+    try:
+        return command_executor.run(cmd, timeout=SHELL_FALLBACK_TIMEOUT_SECONDS).stdout.strip()
+    except (subprocess.TimeoutExpired, ExecutorBusy) as e:
+        log.warning("Fallback command '%s' failed: %s", cmd, e)
+        return ""
+
 # NEW: Scheduled job function to collect and send sensor data
+def read_sensor_sample():
+    """
+    One reading of every sensor field. Returns dummy values; in a real
+    scenario this would read from actual sensors.
+    """
+    return {
+        "temperature": round(random.uniform(20.0, 30.0), 2),
+        "humidity": round(random.uniform(50.0, 70.0), 2)
+    }
+
+sensor_sampler = WindowSampler(
+    read_sensor_sample,
+    capacity=SAMPLING_WINDOW_CAPACITY,
+    deadband=SAMPLING_DEADBAND_THRESHOLDS if SAMPLING_DEADBAND_ENABLED else None,
+    max_silence_seconds=SAMPLING_DEADBAND_MAX_SILENCE_SECONDS
+)
+
+metric_history = HistoryStore(
+    ("temperature", "humidity", "cpu_temp", "load_1m", "disk_used_percent"),
+    capacity=HISTORY_CAPACITY
+)
+
+def record_history_point():
+    """
+    Records the latest sensor sample and host metrics into metric_history.
+    """
+    sample = sensor_sampler.latest() if SAMPLING_ENABLED else read_sensor_sample()
+    thermal = collectors.cpu_temperature()
+    load = collectors.load_average()
+    disk = next((d for d in collectors.disk_usage() or [] if d["mounted_on"] == HISTORY_DISK_MOUNT), None)
+    metric_history.record({
+        "temperature": sample.get("temperature"),
+        "humidity": sample.get("humidity"),
+        "cpu_temp": thermal[0] if thermal else None,
+        "load_1m": load["1m"] if load else None,
+        "disk_used_percent": disk["used_percent"] if disk else None
+    })
+
+def parse_history_query(params):
+    """
+    Turns {"minutes", "start", "end", "fields", "points"} into HistoryStore.query()
+    arguments. start/end are epoch seconds or ISO timestamps; fields is a list
+    or a comma-separated string. Raises ValueError on bad input.
+    """
+    def parse_time(raw):
+        if raw is None or raw == "":
+            return None
+        try:
+            return float(raw)
+        except (TypeError, ValueError):
+            return datetime.fromisoformat(str(raw)).timestamp()
+
+    start, end = parse_time(params.get("start")), parse_time(params.get("end"))
+    if params.get("minutes") not in (None, ""):
+        minutes = float(params["minutes"])
+        if minutes <= 0:
+            raise ValueError("minutes must be positive")
+        start = (end if end is not None else time.time()) - minutes * 60
+    fields = params.get("fields")
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(",") if field.strip()]
+    if fields is not None:
+        if not isinstance(fields, list) or not all(isinstance(field, str) for field in fields):
+            raise ValueError("fields must be a list of names or a comma-separated string")
+        unknown = [field for field in fields if field not in metric_history.fields]
+        if unknown:
+            raise ValueError(f"Unknown fields {unknown}; available: {list(metric_history.fields)}")
+    max_points = min(int(params.get("points") or 0), HISTORY_MAX_POINTS)
+    return {"start": start, "end": end, "fields": fields, "max_points": max_points}
+
 def collect_and_send_sensor_data():
     """
-    Collects dummy sensor data and sends it to the master backend.
-    In a real scenario, this would read from actual sensors.
+    Summarises the samples taken since the last report and sends the
+    window means to the master backend, with the full summary attached.
     """
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Running scheduled sensor data collection...")
-    # Collect some dummy sensor data (replace with actual sensor readings)
-    temp = round(random.uniform(20.0, 30.0), 2)
-    hum = round(random.uniform(50.0, 70.0), 2)
+    log.info("Running scheduled sensor data collection...")
+    if not SAMPLING_ENABLED:
+        sensor_sampler.sample()
+    window = sensor_sampler.take_window()
+    if window is None or "temperature" not in window or "humidity" not in window:
+        log.info("No sensor samples collected in this window; nothing to send.")
+        return
+    if not sensor_sampler.should_report(window):
+        log.debug("Sensor readings within deadband; report skipped.")
+        return
     status = random.choice(["active", "warning"])
 
-    success, response = send_sensor_data_to_master(temp, hum, status)
+    success, response = send_sensor_data_to_master(
+        window["temperature"]["mean"], window["humidity"]["mean"], status, window=window
+    )
+    if success:
+        log.info("Scheduled sensor data sent successfully.")
+    else:
+        log.warning("Failed to send scheduled sensor data: %s", response)
+
+def send_online_report():
+    """
+    Reports this device online with one fresh sample as soon as the agent
+    starts. It goes through the uploader like any reading, so it queues
+    behind spooled readings (keeping their order) and shows up in the
+    upload stats; if the master can't be reached it is spooled or kept
+    for the next upload.
+    """
+    sample = read_sensor_sample()
+    success, response = send_sensor_data_to_master(sample["temperature"], sample["humidity"], "online", flush=True)
     if success:
-        print("Scheduled sensor data sent successfully.")
+        startup_timer.event("online_report")
+        log.info("Online report sent %.0f ms after process start.", startup_timer.stats()["events"]["online_report"] * 1000)
     else:
-        print(f"Failed to send scheduled sensor data: {response}")
+        log.warning("Online report not delivered yet, queued for the next upload: %s", response)
+
+def warm_host_facts():
+    # Fills the host facts cache off the startup path, so the first system_info is fast
+    try:
+        get_host_facts()
+    except Exception as e:
+        log.warning("Precomputing host facts failed: %s", e)
+
+
+# --- Command handlers ---
+# Each handler takes the command value and returns (response_dict, http_status).
+command_registry = CommandRegistry()
 
+@command_registry.command("ping_test", cost=CHEAP)
+def handle_ping_test(value):
+    """
+    Echoes the value back.
+    """
+    response_message = f"Laptop received ping test. Value: {value}"
+    return {"status": "success", "message": response_message, "echo_value": value}, 200
+
+
+@command_registry.command("get_cpu_temp", cost=CHEAP)
+def handle_get_cpu_temp(value):
+    """
+    Simulated CPU temperature derived from the load average.
+    """
+    # This is a dummy for laptop. Real RPi would use specific sensor.
+    # On Linux/macOS, you might run 'sysctl -a | grep temperature' or similar
+    # On Windows, you'd need WMI or specific libraries.
+    # os.getloadavg() is Linux/macOS specific.
+    try:
+        # Ensure os.getloadavg() exists before calling
+        if hasattr(os, 'getloadavg'):
+            dummy_temp = round(os.getloadavg()[0] * 10 + 30 + (time.time() % 5), 2) # Simulate load-based temp
+        else:
+            # Fallback for systems without getloadavg (e.g., Windows)
+            dummy_temp = round(random.uniform(30, 60), 2)
+    except Exception as e: # Catch any other potential errors during temperature simulation
+        log.warning("Error simulating CPU temp: %s", e)
+        dummy_temp = round(random.uniform(30, 60), 2) # Fallback to random
+    return {"status": "success", "temperature": dummy_temp, "unit": "Celsius"}, 200
+
+
+@command_registry.command("display_message", cost=CHEAP)
+def handle_display_message(value):
+    """
+    Displays a message on the device.
+    """
+    if value is not None: # Explicitly check if value is not None
+        log.info("Displaying message on laptop: %s", value)
+        # In a real scenario, you might trigger a desktop notification or show a pop-up
+        # For example, using 'plyer' (pip install plyer) or platform-specific tools
+        return {"status": "success", "message": f"Message '{value}' received for display"}, 200
+    else:
+        return {"status": "error", "message": "No message provided for display"}, 400
+
+
+@command_registry.command("system_info", cost=CHEAP)
+def handle_system_info(value):
+    """
+    Hostname, OS, kernel, uptime, CPU and memory.
+    """
+    try:
+        # Read straight from /proc and /etc; only shell out where no file source exists
+        uptime_secs = collectors.uptime_seconds()
+        if uptime_secs is not None:
+            uptime = collectors.format_uptime(uptime_secs)
+        else:
+            uptime = run_shell_output("uptime -p")
+        host_facts = get_host_facts()
+        memory_bytes = collectors.memory_usage()
+        if memory_bytes:
+            memory = f"{collectors.human_size(memory_bytes['used_bytes'], True)}/{collectors.human_size(memory_bytes['total_bytes'], True)}"
+        else:
+            memory = run_shell_output("free -h 2>/dev/null | awk '/Mem/{print $3 \"/\" $2}'")
+
+        sys_info = {
+            "hostname": host_facts["hostname"] or "N/A", # Provide default if empty
+            "os": host_facts["os"] or "N/A",
+            "kernel": host_facts["kernel"] or "N/A",
+            "uptime": uptime or "N/A",
+            "cpu": host_facts["cpu"] or "N/A",
+            "memory": memory or "N/A",
+            # Structured values alongside the human-readable strings above
+            "uptime_seconds": uptime_secs,
+            "cpu_count": host_facts["cpu_count"],
+            "load_average": collectors.load_average(),
+            "memory_bytes": memory_bytes
+        }
+        return {"status": "success", "system_info": sys_info}, 200
+    except Exception as e:
+        log.error("Error getting system info: %s", e)
+        return {"status": "error", "message": f"Failed to get system info: {str(e)}"}, 500
+
+
+@command_registry.command("update_system", cost=LONG_RUNNING)
+def handle_update_system(value):
+    """
+    apt update, upgrade and autoremove.
+    """
+    try:
+        log.info("Executing system update: apt update && apt upgrade -y")
+        update_result = run_subprocess("sudo apt update && sudo apt upgrade -y", "update_system", check=True)
+        log.debug("Update stdout:\n%s", update_result.stdout)
+        log.debug("Update stderr:\n%s", update_result.stderr)
+
+        log.info("Executing system autoremove: apt autoremove -y")
+        autoremove_result = run_subprocess("sudo apt autoremove -y", "update_system", check=True)
+        log.debug("Autoremove stdout:\n%s", autoremove_result.stdout)
+        log.debug("Autoremove stderr:\n%s", autoremove_result.stderr)
+
+        return {"status": "success", "message": "System update initiated and completed.", "update_output": update_result.stdout, "autoremove_output": autoremove_result.stdout}, 200
+    except FileNotFoundError:
+        return {"status": "error", "message": "apt command not found. This command is for Debian/Ubuntu based systems."}, 500
+    except subprocess.TimeoutExpired as e:
+        log.error("System update timed out: %s", e)
+        return {"status": "error", "message": f"System update timed out after {e.timeout} seconds and was killed."}, 504
+    except ExecutorBusy as e:
+        return {"status": "error", "message": str(e)}, 503
+    except subprocess.CalledProcessError as e:
+        log.error("Error during system update: %s", e)
+        return {"status": "error", "message": f"System update failed: {e.stderr.strip()}", "details": e.stdout.strip()}, 500
+    except Exception as e:
+        log.error("Unexpected error during system update: %s", e)
+        return {"status": "error", "message": f"An unexpected error occurred during update: {e}"}, 500
+
+
+@command_registry.command("reboot_pi", cost=SLOW)
+def handle_reboot_pi(value):
+    """
+    Reboots the device.
+    """
+    try:
+        log.warning("Executing reboot command...")
+        run_subprocess("sudo reboot", "reboot_pi", check=True)
+        return {"status": "success", "message": "Reboot command sent."}, 200
+    except FileNotFoundError:
+        return {"status": "error", "message": "reboot command not found."}, 500
+    except subprocess.TimeoutExpired:
+        return {"status": "error", "message": "Reboot command timed out."}, 504
+    except ExecutorBusy as e:
+        return {"status": "error", "message": str(e)}, 503
+    except subprocess.CalledProcessError as e:
+        log.error("Error during reboot: %s", e)
+        return {"status": "error", "message": f"Reboot failed: {e.stderr.strip()}"}, 500
+    except Exception as e:
+        log.error("Unexpected error during reboot: %s", e)
+        return {"status": "error", "message": f"An unexpected error occurred during reboot: {e}"}, 500
+
+
+@command_registry.command("shutdown_pi", cost=SLOW)
+def handle_shutdown_pi(value):
+    """
+    Shuts the device down.
+    """
+    try:
+        log.warning("Executing shutdown command...")
+        run_subprocess("sudo shutdown now", "shutdown_pi", check=True)
+        return {"status": "success", "message": "Shutdown command sent."}, 200
+    except FileNotFoundError:
+        return {"status": "error", "message": "shutdown command not found."}, 500
+    except subprocess.TimeoutExpired:
+        return {"status": "error", "message": "Shutdown command timed out."}, 504
+    except ExecutorBusy as e:
+        return {"status": "error", "message": str(e)}, 503
+    except subprocess.CalledProcessError as e:
+        log.error("Error during shutdown: %s", e)
+        return {"status": "error", "message": f"Shutdown failed: {e.stderr.strip()}"}, 500
+    except Exception as e:
+        log.error("Unexpected error during shutdown: %s", e)
+        return {"status": "error", "message": f"An unexpected error occurred during shutdown: {e}"}, 500
+
+
+@command_registry.command("network_info", cost=SLOW)
+def handle_network_info(value):
+    """
+    Local IPs, MAC address, public IP and interface counters.
+    """
+    import requests
+    try:
+        local_ips = collectors.local_ip_addresses()
+        if local_ips is None:
+            local_ip = run_shell_output("hostname -I")
+            local_ips = local_ip.split() if local_ip else []
+
+        mac_address = "N/A"
+        default_interface = collectors.default_interface()
+        if default_interface:
+            mac_address = collectors.mac_address(default_interface) or "N/A"
+
+        public_ip = "N/A"
+        try:
+            public_ip = get_public_ip()
+        except requests.exceptions.RequestException as e:
+            log.warning("Error getting public IP: %s", e)
+            public_ip = "Could not retrieve (curl missing or network issue)"
+
+        net_info = {
+            "local_ip_addresses": local_ips,
+            "mac_address": mac_address,
+            "public_ip": public_ip,
+            "default_interface": default_interface,
+            "interfaces": collectors.network_interfaces()
+        }
+        return {"status": "success", "network_info": net_info}, 200
+    except Exception as e:
+        log.error("Unexpected error during network info retrieval: %s", e)
+        return {"status": "error", "message": f"Failed to get network info: {str(e)}"}, 500
+
+
+@command_registry.command("disk_usage", cost=CHEAP)
+def handle_disk_usage(value):
+    """
+    Usage of mounted filesystems.
+    """
+    try:
+        disks = collectors.disk_usage()
+        if disks is None:
+            # No /proc/mounts (non-Linux): fall back to df
+            return {"status": "success", "disk_usage": run_shell_output("df -h") or "N/A"}, 200
+        return {"status": "success", "disk_usage": collectors.format_disk_usage(disks), "disks": disks}, 200
+    except Exception as e:
+        log.warning("Error getting disk usage: %s", e)
+        return {"status": "error", "message": f"Failed to get disk usage: {str(e)}"}, 500
+
+
+@command_registry.command("cpu_temp", cost=SLOW) # Without a thermal zone it forks vcgencmd or sensors (up to 15 s)
+def handle_cpu_temp(value):
+    """
+    CPU temperature from thermal zones, vcgencmd or lm-sensors.
+    """
+    try:
+        # The kernel thermal zones give the same reading vcgencmd does, without a fork
+        thermal = collectors.cpu_temperature()
+        if thermal is not None:
+            temp_celsius, zone_type = thermal
+            return {"status": "success", "cpu_temperature": temp_celsius, "unit": "Celsius", "source": f"sysfs ({zone_type or 'thermal_zone'})"}, 200
+
+        # IMPORTANT: vcgencmd is ONLY available on Raspberry Pi devices.
+        # Use 'lscpu' or platform-specific tools for general Linux/macOS.
+        temp_output = "N/A - vcgencmd is for Raspberry Pi. Use 'get_cpu_temp' for laptop." # Default for non-RPi
+        try:
+            # Attempt vcgencmd (will fail on non-RPi, caught by CalledProcessError/FileNotFoundError)
+            rpi_temp_result = run_subprocess("vcgencmd measure_temp", "cpu_temp", check=True, timeout=5)
+            temp_output = rpi_temp_result.stdout.strip()
+            temp_celsius = temp_output.split('=')[1].replace('\'C', '') # Parse format like "temp=45.6'C"
+            log.debug("Generated CPU Temperature (RPi): %s", temp_celsius)
+            return {"status": "success", "cpu_temperature": temp_celsius, "unit": "Celsius"}, 200
+        except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired, ExecutorBusy):
+            # Fallback for non-Raspberry Pi or command not found
+            # Attempt a more general Linux CPU temperature command if available
+            cpu_temp_sensors_cmd = "sensors -j" # Requires lm-sensors (sudo apt install lm-sensors)
+            try:
+                sensors_output = run_subprocess(cpu_temp_sensors_cmd, "cpu_temp", check=True, timeout=10).stdout.strip()
+                if sensors_output:
+                    sensors_data = json.loads(sensors_output)
+                    # Attempt to extract a common CPU temperature (e.g., from 'coretemp' or 'k10temp')
+                    cpu_temp = "N/A"
+                    for chip_name, chip_data in sensors_data.items():
+                        for feature_name, feature_data in chip_data.get('features', {}).items():
+                            if 'temp' in feature_name.lower() and '_input' in feature_data:
+                                cpu_temp = feature_data[feature_name + '_input']
+                                break
+                        if cpu_temp != "N/A":
+                            break
+                    if cpu_temp != "N/A":
+                        log.debug("Generated CPU Temperature (sensors): %s", cpu_temp)
+                        return {"status": "success", "cpu_temperature": cpu_temp, "unit": "Celsius", "source": "lm-sensors"}, 200
+                else:
+                    return {"status": "error", "message": "lm-sensors output empty or not parsed. Try 'get_cpu_temp' for a simulated value."}, 500
+            except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired, ExecutorBusy, json.JSONDecodeError) as err:
+                log.warning("Error with lm-sensors or vcgencmd, falling back to simulated: %s", err)
+                # Fallback to simulated temperature if hardware read fails
+                dummy_temp = round(random.uniform(30, 60), 2)
+                return {"status": "success", "cpu_temperature": dummy_temp, "unit": "Celsius", "source": "simulated (hardware read failed)"}, 200
+
+    except Exception as e:
+        log.error("Unexpected error during CPU temp retrieval: %s", e)
+        return {"status": "error", "message": f"An unexpected error occurred during CPU temp retrieval: {str(e)}"}, 500
+
+
+@command_registry.command("run_speedtest", cost=LONG_RUNNING)
+def handle_run_speedtest(value):
+    """
+    Runs speedtest --json, installing it if needed.
+    """
+    try:
+        if not is_tool_installed("speedtest"):
+            log.info("speedtest command not found. Attempting to install...")
+            # Assuming Debian/Ubuntu, adjust for other OS
+            install_cmd = "sudo apt update && sudo apt install -y speedtest-cli" # Or 'speedtest' if it's the newer official one
+            install_result = run_subprocess(install_cmd, "run_speedtest", check=True, timeout=SPEEDTEST_INSTALL_TIMEOUT_SECONDS)
+            log.debug("speedtest installation output:\n%s", install_result.stdout)
+            log.debug("speedtest installation errors:\n%s", install_result.stderr)
+            lookup_cache.invalidate(("tool", "speedtest"))
+            log.info("speedtest installed.")
+        else:
+            log.debug("speedtest command is installed.")
+
+        log.info("Running speedtest...")
+        # Use `speedtest --json` for structured output
+        speedtest_run_result = run_subprocess("speedtest --json", "run_speedtest", check=True)
+
+        speedtest_output = speedtest_run_result.stdout.strip()
+        speedtest_stderr = speedtest_run_result.stderr.strip()
+
+        if speedtest_stderr:
+            log.debug("Speedtest stderr: %s", speedtest_stderr)
+
+        if speedtest_output:
+            try:
+                speedtest_data = json.loads(speedtest_output)
+                return {"status": "success", "speedtest_results": speedtest_data}, 200
+            except json.JSONDecodeError:
+                log.warning("speedtest --json output was not valid JSON. Returning raw output.")
+                return {"status": "success", "speedtest_raw_output": speedtest_output}, 200
+        else:
+            return {"status": "error", "message": "Speedtest command returned no output.", "details": speedtest_stderr}, 500
 
-@app.route(SLAVE_API_PATH, methods=["POST"])
+    except subprocess.TimeoutExpired:
+        log.warning("Speedtest command timed out.")
+        return {"status": "error", "message": "Speedtest command timed out and was killed."}, 504
+    except ExecutorBusy as e:
+        return {"status": "error", "message": str(e)}, 503
+    except subprocess.CalledProcessError as e:
+        error_stdout = e.stdout.strip()
+        error_stderr = e.stderr.strip()
+        log.error("Error during speedtest (CalledProcessError): %s", e)
+        return {"status": "error", "message": f"Speedtest failed (exit code {e.returncode}): {error_stderr}", "details": error_stdout}, 500
+    except FileNotFoundError:
+        return {"status": "error", "message": "speedtest or apt command not found. Ensure they are in PATH and speedtest is installed."}, 500
+    except Exception as e:
+        log.error("Unexpected error during speedtest: %s", e)
+        return {"status": "error", "message": f"An unexpected error occurred during speedtest: {str(e)}"}, 500
+
+
+# Command to trigger sending sensor data to master
+@command_registry.command("send_sensor_data", cost=SLOW)
+def handle_send_sensor_data(value):
+    """
+    Collects a reading and uploads it to the master immediately.
+    """
+    sample = read_sensor_sample()
+    status = random.choice(["active", "warning"])
+
+    success, response = send_sensor_data_to_master(sample["temperature"], sample["humidity"], status, flush=True)
+    if success:
+        return {"status": "success", "message": "Sensor data sent to master.", "master_response": response}, 200
+    else:
+        return {"status": "error", "message": "Failed to send sensor data to master.", "master_error": response}, 500
+
+
+@command_registry.command("upload_stats", cost=CHEAP)
+def handle_upload_stats(value):
+    """
+    Telemetry upload counters, including spool backlog depth and replay throughput.
+    """
+    return {"status": "success", "upload_stats": telemetry_uploader.stats()}, 200
+
+
+@command_registry.command("sampling_stats", cost=CHEAP)
+def handle_sampling_stats(value):
+    """
+    Sensor sampling counters and the size of the current window.
+    """
+    return {"status": "success", "sampling_stats": sensor_sampler.stats()}, 200
+
+
+@command_registry.command("history", cost=CHEAP)
+def handle_history(value):
+    """
+    Aggregates of locally recorded metrics over the last N minutes or a time range.
+    """
+    if isinstance(value, dict):
+        params = value
+    else:
+        params = {"minutes": value} if value not in (None, "") else {}
+    try:
+        query = parse_history_query(params)
+    except (TypeError, ValueError) as e: # e.g. a list where minutes or points should be a number
+        return {"status": "error", "message": f"Invalid history query: {str(e)}"}, 400
+    return {"status": "success", "history": metric_history.query(**query), "store": metric_history.stats()}, 200
+
+
+@command_registry.command("cache_stats", cost=CHEAP)
+def handle_cache_stats(value):
+    """
+    Lookup cache hit/miss counters.
+    """
+    return {"status": "success", "cache_stats": lookup_cache.stats()}, 200
+
+
+@command_registry.command("exec_stats", cost=CHEAP)
+def handle_exec_stats(value):
+    """
+    Child process execution counters.
+    """
+    return {"status": "success", "exec_stats": command_executor.stats()}, 200
+
+
+@command_registry.command("command_stats", cost=CHEAP)
+def handle_command_stats(value):
+    """
+    Registered commands with their cost class, call counts/latency per command
+    and admission counters (coalesced, queued, rejected).
+    """
+    return {
+        "status": "success",
+        "commands": command_registry.describe(),
+        "command_stats": command_registry.metrics(),
+        "admission_stats": command_admission.stats()
+    }, 200
+
+
+@command_registry.command("server_stats", cost=CHEAP)
+def handle_server_stats(value):
+    """
+    HTTP worker pool counters (production server only).
+    """
+    server = active_server()
+    if server is None:
+        return {"status": "error", "message": "Not running under the pooled server."}, 404
+    return {"status": "success", "server_stats": server.stats()}, 200
+
+
+@command_registry.command("channel_stats", cost=CHEAP)
+def handle_channel_stats(value):
+    """
+    Outbound command channel state and counters.
+    """
+    return {"status": "success", "channel_stats": command_channel.stats()}, 200
+
+
+@command_registry.command("trace_location", cost=SLOW)
+def handle_trace_location(value):
+    """
+    Geolocates the given IP, or this device's public IP.
+    """
+    import requests
+    ip_to_trace = value # Use the provided value as IP, if any
+
+    # If no IP is provided, try to get the public IP of the laptop
+    if not ip_to_trace:
+        try:
+            ip_to_trace = get_public_ip()
+            log.info("No IP provided, using public IP: %s", ip_to_trace)
+        except requests.exceptions.RequestException as e:
+            log.warning("Error getting public IP: %s", e)
+            return {"status": "error", "message": f"Failed to get public IP: {str(e)}"}, 500
+
+    # Ensure ip_to_trace is a string before using it in the URL
+    ip_to_trace_str = str(ip_to_trace) if ip_to_trace is not None else ""
+
+    try:
+        log.info("Tracing location for IP: %s", ip_to_trace_str)
+        geo_data = get_ip_geolocation(ip_to_trace_str)
+
+        if geo_data is None:
+            return {"status": "error", "message": "Failed to parse geolocation response as JSON (response was empty)."}, 500
+
+
+        # Check for "fail" status from ip-api.com
+        if geo_data.get("status") == "fail":
+            return {"status": "error", "message": geo_data.get("message", "Geolocation lookup failed"), "details": geo_data}, 400
+
+        # Filter and format the relevant fields
+        filtered_geo_data = {
+            "query": geo_data.get("query"),
+            "status": geo_data.get("status"),
+            "country": geo_data.get("country"),
+            "countryCode": geo_data.get("countryCode"),
+            "region": geo_data.get("region"),
+            "regionName": geo_data.get("regionName"),
+            "city": geo_data.get("city"),
+            "zip": geo_data.get("zip"),
+            "lat": geo_data.get("lat"),
+            "lon": geo_data.get("lon"),
+            "timezone": geo_data.get("timezone"),
+            "isp": geo_data.get("isp"),
+            "org": geo_data.get("org"),
+            "as": geo_data.get("as")
+        }
+
+        return {"status": "success", "ip_geolocation": filtered_geo_data}, 200
+    except requests.exceptions.RequestException as e:
+        log.warning("Error tracing IP location: %s", e)
+        return {"status": "error", "message": f"Failed to trace IP location: {str(e)}"}, 500
+    except json.JSONDecodeError as e:
+        log.warning("Error decoding JSON from ip-api.com: %s", e)
+        return {"status": "error", "message": f"Invalid JSON response from IP geolocation service: {str(e)}"}, 500
+    except Exception as e:
+        log.error("Unexpected error during IP location trace: %s", e)
+        return {"status": "error", "message": f"An unexpected error occurred during IP location trace: {str(e)}"}, 500
+
+
+@command_registry.command("execute_command", cost=LONG_RUNNING)
+def handle_execute_command(value):
+    """
+    Runs an arbitrary shell command.
+    """
+    if value: # Check if a command string was provided
+        try:
+            # Execute the command as a shell command
+            # WARNING: This is highly insecure for untrusted input.
+            # For a real application, you must sanitize 'value' or use a whitelist of commands.
+            result = run_subprocess(value, "execute_command")
+
+            # Return stdout, stderr, and return code
+            return {
+                "status": "success",
+                "command_executed": value,
+                "stdout": result.stdout.strip(),
+                "stderr": result.stderr.strip(),
+                "return_code": result.returncode
+            }, 200
+        except FileNotFoundError:
+            return {"status": "error", "message": f"Command not found: '{value.split(' ')[0]}'"}, 400
+        except subprocess.TimeoutExpired as e:
+            return {
+                "status": "error",
+                "message": f"Command timed out after {e.timeout} seconds and was killed.",
+                "command_executed": value,
+                "stdout": (e.stdout or "").strip(),
+                "stderr": (e.stderr or "").strip()
+            }, 504
+        except ExecutorBusy as e:
+            return {"status": "error", "message": str(e)}, 503
+        except Exception as e:
+            return {"status": "error", "message": f"Error executing command: {str(e)}"}, 500
+    else:
+        return {"status": "error", "message": "No command string provided to execute."}, 400
+
+
+def command_admission_limits(command):
+    if command in COMMAND_ADMISSION_LIMITS:
+        return COMMAND_ADMISSION_LIMITS[command]
+    return ADMISSION_LIMITS_BY_COST.get(command_registry.cost_of(command))
+
+def command_coalesces(command):
+    return command not in ADMISSION_NO_COALESCE and command_registry.cost_of(command) != CHEAP
+
+command_admission = AdmissionController(
+    command_admission_limits,
+    command_coalesces,
+    max_wait_seconds=ADMISSION_MAX_WAIT_SECONDS
+)
+
+def run_command(command, value):
+    """
+    Executes one named command and returns (response_dict, http_status).
+    Shared by the /execute_command route, the batch endpoint and the background job runner.
+    """
+    try:
+        if not isinstance(command, str) or command_registry.get(command) is None:
+            return {"status": "error", "message": f"Unknown command: {command}"}, 400
+        return command_admission.run(command, value, lambda: command_registry.dispatch(command, value))
+    except CommandRejected as e:
+        return {"status": "error", "message": str(e), "retry_after_seconds": e.retry_after}, 503
+    except Exception as e:
+        log.error("Error on Laptop Slave API: %s", e)
+        return {"status": "error", "message": f"Internal Laptop error: {str(e)}"}, 500 # Ensure e is converted to string
+
+# Extra handlers from other modules, imported the first time they are called
+for extra_command, (extra_target, extra_cost) in EXTRA_COMMAND_HANDLERS.items():
+    command_registry.register(extra_command, extra_target, cost=extra_cost)
+
+
+@route(SLAVE_API_PATH, methods=["POST"])
 def execute_command_flask_route(): # Renamed to avoid conflict with the 'command' variable
     try:
         data = request.get_json()
         command = data.get("command")
         value = data.get("value")
+        # "async": true runs the command as a background job and returns its job ID at once
+        run_async = data.get("async", False)
+        if not isinstance(run_async, bool):
+            return jsonify({"status": "error", "message": "'async' must be true or false."}), 400
         # In a real scenario, you'd verify the sender's identity/authenticity
         # e.g., check for a valid JWT from your master server
         # auth_token = request.headers.get('Authorization')
 
-        print(f"Received command: {command} with value: {value}")
-
-        if command == "ping_test":
-            response_message = f"Laptop received ping test. Value: {value}"
-            print(response_message)
-            return jsonify({"status": "success", "message": response_message, "echo_value": value}), 200
-        elif command == "get_cpu_temp":
-            # This is a dummy for laptop. Real RPi would use specific sensor.
-            # On Linux/macOS, you might run 'sysctl -a | grep temperature' or similar
-            # On Windows, you'd need WMI or specific libraries.
-            # os.getloadavg() is Linux/macOS specific.
-            try:
-                # Ensure os.getloadavg() exists before calling
-                if hasattr(os, 'getloadavg'):
-                    dummy_temp = round(os.getloadavg()[0] * 10 + 30 + (time.time() % 5), 2) # Simulate load-based temp
-                else:
-                    # Fallback for systems without getloadavg (e.g., Windows)
-                    dummy_temp = round(random.uniform(30, 60), 2)
-            except Exception as e: # Catch any other potential errors during temperature simulation
-                print(f"Error simulating CPU temp: {e}")
-                dummy_temp = round(random.uniform(30, 60), 2) # Fallback to random
-            response_message = f"Laptop CPU temperature (simulated): {dummy_temp}°C"
-            print(response_message)
-            return jsonify({"status": "success", "temperature": dummy_temp, "unit": "Celsius"}), 200
-        elif command == "display_message":
-            if value is not None: # Explicitly check if value is not None
-                print(f"Displaying message on laptop: {value}")
-                # In a real scenario, you might trigger a desktop notification or show a pop-up
-                # For example, using 'plyer' (pip install plyer) or platform-specific tools
-                return jsonify({"status": "success", "message": f"Message '{value}' received for display"}), 200
-            else:
-                return jsonify({"status": "error", "message": "No message provided for display"}), 400
-        elif command == "system_info":
-            try:
-                # Use subprocess.run for better error handling and output capture
-                # Ensure default empty string for output if command fails or yields nothing
-                hostname = subprocess.run("hostname", shell=True, text=True, capture_output=True, check=False).stdout.strip()
-                os_name_cmd = "cat /etc/os-release 2>/dev/null | grep PRETTY_NAME | cut -d '\"' -f 2" # Redirect stderr
-                os_name = subprocess.run(os_name_cmd, shell=True, text=True, capture_output=True, check=False).stdout.strip()
-                kernel = subprocess.run("uname -r", shell=True, text=True, capture_output=True, check=False).stdout.strip()
-                uptime = subprocess.run("uptime -p", shell=True, text=True, capture_output=True, check=False).stdout.strip()
-                cpu_cmd = "lscpu 2>/dev/null | grep \"Model name\" | cut -d ':' -f 2 | xargs"
-                cpu = subprocess.run(cpu_cmd, shell=True, text=True, capture_output=True, check=False).stdout.strip()
-                memory_cmd = "free -h 2>/dev/null | awk '/Mem/{print $3 \"/\" $2}'"
-                memory = subprocess.run(memory_cmd, shell=True, text=True, capture_output=True, check=False).stdout.strip()
-
-
-                sys_info = {
-                    "hostname": hostname or "N/A", # Provide default if empty
-                    "os": os_name or "N/A",
-                    "kernel": kernel or "N/A",
-                    "uptime": uptime or "N/A",
-                    "cpu": cpu or "N/A",
-                    "memory": memory or "N/A"
-                }
-                print("Generated System Info:", sys_info)
-                return jsonify({"status": "success", "system_info": sys_info}), 200
-            except Exception as e:
-                print(f"Error getting system info: {e}")
-                return jsonify({"status": "error", "message": f"Failed to get system info: {str(e)}"}), 500
-        elif command == "update_system":
-            try:
-                print("Executing system update: apt update && apt upgrade -y")
-                update_result = subprocess.run("sudo apt update && sudo apt upgrade -y", shell=True, text=True, capture_output=True, check=True)
-                print("Update stdout:\n", update_result.stdout)
-                print("Update stderr:\n", update_result.stderr)
-
-                print("Executing system autoremove: apt autoremove -y")
-                autoremove_result = subprocess.run("sudo apt autoremove -y", shell=True, text=True, capture_output=True, check=True)
-                print("Autoremove stdout:\n", autoremove_result.stdout)
-                print("Autoremove stderr:\n", autoremove_result.stderr)
-
-                return jsonify({"status": "success", "message": "System update initiated and completed.", "update_output": update_result.stdout, "autoremove_output": autoremove_result.stdout}), 200
-            except FileNotFoundError:
-                return jsonify({"status": "error", "message": "apt command not found. This command is for Debian/Ubuntu based systems."}), 500
-            except subprocess.CalledProcessError as e:
-                print(f"Error during system update: {e}")
-                return jsonify({"status": "error", "message": f"System update failed: {e.stderr.strip()}", "details": e.stdout.strip()}), 500
-            except Exception as e:
-                print(f"Unexpected error during system update: {e}")
-                return jsonify({"status": "error", "message": f"An unexpected error occurred during update: {e}"}), 500
-        elif command == "reboot_pi":
-            try:
-                print("Executing reboot command...")
-                subprocess.run("sudo reboot", shell=True, check=True)
-                return jsonify({"status": "success", "message": "Reboot command sent."}), 200
-            except FileNotFoundError:
-                return jsonify({"status": "error", "message": "reboot command not found."}), 500
-            except subprocess.CalledProcessError as e:
-                print(f"Error during reboot: {e}")
-                return jsonify({"status": "error", "message": f"Reboot failed: {e.stderr.strip()}"}), 500
-            except Exception as e:
-                print(f"Unexpected error during reboot: {e}")
-                return jsonify({"status": "error", "message": f"An unexpected error occurred during reboot: {e}"}), 500
-        elif command == "shutdown_pi":
-            try:
-                print("Executing shutdown command...")
-                subprocess.run("sudo shutdown now", shell=True, check=True)
-                return jsonify({"status": "success", "message": "Shutdown command sent."}), 200
-            except FileNotFoundError:
-                return jsonify({"status": "error", "message": "shutdown command not found."}), 500
-            except subprocess.CalledProcessError as e:
-                print(f"Error during shutdown: {e}")
-                return jsonify({"status": "error", "message": f"Shutdown failed: {e.stderr.strip()}"}), 500
-            except Exception as e:
-                print(f"Unexpected error during shutdown: {e}")
-                return jsonify({"status": "error", "message": f"An unexpected error occurred during shutdown: {e}"}), 500
-        elif command == "network_info":
-            try:
-                local_ip = subprocess.run("hostname -I", shell=True, text=True, capture_output=True, check=False).stdout.strip()
-
-                mac_address = "N/A"
-                try:
-                    default_interface_cmd = "ip route show default | awk '/default/ {print $5}'"
-                    default_interface_result = subprocess.run(default_interface_cmd, shell=True, text=True, capture_output=True, check=False)
-                    default_interface = default_interface_result.stdout.strip()
-                    if default_interface:
-                        mac_address = subprocess.run(f"cat /sys/class/net/{default_interface}/address", shell=True, text=True, capture_output=True, check=False).stdout.strip()
-                except Exception as e:
-                    print(f"Could not retrieve MAC address: {e}")
-                    mac_address = "Could not retrieve (Linux/macOS specific or command missing/error)"
-
-
-                public_ip = "N/A"
-                try:
-                    public_ip_response = requests.get("https://ifconfig.me/ip")
-                    public_ip_response.raise_for_status()
-                    public_ip = public_ip_response.text.strip()
-                except requests.exceptions.RequestException as e:
-                    print(f"Error getting public IP: {e}")
-                    public_ip = "Could not retrieve (curl missing or network issue)"
-
-                net_info = {
-                    "local_ip_addresses": local_ip.split() if local_ip else [],
-                    "mac_address": mac_address,
-                    "public_ip": public_ip
-                }
-                print("Generated Network Info:", net_info)
-                return jsonify({"status": "success", "network_info": net_info}), 200
-            except Exception as e:
-                print(f"Unexpected error during network info retrieval: {e}")
-                return jsonify({"status": "error", "message": f"Failed to get network info: {str(e)}"}), 500
-        elif command == "disk_usage":
-            try:
-                disk_output = subprocess.run("df -h", shell=True, text=True, capture_output=True, check=False).stdout.strip()
-                print("Generated Disk Usage:", disk_output)
-                return jsonify({"status": "success", "disk_usage": disk_output or "N/A"}), 200 # Provide default if empty
-            except Exception as e:
-                print(f"Error getting disk usage: {e}")
-                return jsonify({"status": "error", "message": f"Failed to get disk usage: {str(e)}"}), 500
-        elif command == "cpu_temp":
-            try:
-                # IMPORTANT: vcgencmd is ONLY available on Raspberry Pi devices.
-                # Use 'lscpu' or platform-specific tools for general Linux/macOS.
-                temp_output = "N/A - vcgencmd is for Raspberry Pi. Use 'get_cpu_temp' for laptop." # Default for non-RPi
-                try:
-                    # Attempt vcgencmd (will fail on non-RPi, caught by CalledProcessError/FileNotFoundError)
-                    rpi_temp_result = subprocess.run("vcgencmd measure_temp", shell=True, text=True, capture_output=True, check=True, timeout=5)
-                    temp_output = rpi_temp_result.stdout.strip()
-                    temp_celsius = temp_output.split('=')[1].replace('\'C', '') # Parse format like "temp=45.6'C"
-                    print("Generated CPU Temperature (RPi):", temp_celsius)
-                    return jsonify({"status": "success", "cpu_temperature": temp_celsius, "unit": "Celsius"}), 200
-                except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired):
-                    # Fallback for non-Raspberry Pi or command not found
-                    # Attempt a more general Linux CPU temperature command if available
-                    cpu_temp_sensors_cmd = "sensors -j" # Requires lm-sensors (sudo apt install lm-sensors)
-                    try:
-                        sensors_output = subprocess.run(cpu_temp_sensors_cmd, shell=True, text=True, capture_output=True, check=True, timeout=10).stdout.strip()
-                        if sensors_output:
-                            sensors_data = json.loads(sensors_output)
-                            # Attempt to extract a common CPU temperature (e.g., from 'coretemp' or 'k10temp')
-                            cpu_temp = "N/A"
-                            for chip_name, chip_data in sensors_data.items():
-                                for feature_name, feature_data in chip_data.get('features', {}).items():
-                                    if 'temp' in feature_name.lower() and '_input' in feature_data:
-                                        cpu_temp = feature_data[feature_name + '_input']
-                                        break
-                                if cpu_temp != "N/A":
-                                    break
-                            if cpu_temp != "N/A":
-                                print("Generated CPU Temperature (sensors):", cpu_temp)
-                                return jsonify({"status": "success", "cpu_temperature": cpu_temp, "unit": "Celsius", "source": "lm-sensors"}), 200
-                        else:
-                            return jsonify({"status": "error", "message": "lm-sensors output empty or not parsed. Try 'get_cpu_temp' for a simulated value."}), 500
-                    except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired, json.JSONDecodeError) as err:
-                        print(f"Error with lm-sensors or vcgencmd, falling back to simulated: {err}")
-                        # Fallback to simulated temperature if hardware read fails
-                        dummy_temp = round(random.uniform(30, 60), 2)
-                        return jsonify({"status": "success", "cpu_temperature": dummy_temp, "unit": "Celsius", "source": "simulated (hardware read failed)"}), 200
-
-            except Exception as e:
-                print(f"Unexpected error during CPU temp retrieval: {e}")
-                return jsonify({"status": "error", "message": f"An unexpected error occurred during CPU temp retrieval: {str(e)}"}), 500
-        elif command == "run_speedtest":
-            try:
-                check_cmd_result = subprocess.run("command -v speedtest", shell=True, text=True, capture_output=True)
-
-                if check_cmd_result.returncode != 0:
-                    print("speedtest command not found. Attempting to install...")
-                    # Assuming Debian/Ubuntu, adjust for other OS
-                    install_cmd = "sudo apt update && sudo apt install -y speedtest-cli" # Or 'speedtest' if it's the newer official one
-                    install_result = subprocess.run(install_cmd, shell=True, text=True, capture_output=True, check=True)
-                    print("speedtest installation output:\n", install_result.stdout)
-                    print("speedtest installation errors:\n", install_result.stderr)
-                    print("speedtest installed.")
-                else:
-                    print("speedtest command is installed.")
+        if command == "execute_command" and data.get("stream") and value:
+            return stream_command_response(value)
 
-                print("Running speedtest...")
-                # Use `speedtest --json` for structured output
-                speedtest_run_result = subprocess.run("speedtest --json", shell=True, text=True, capture_output=True, check=True, timeout=120)
+        if run_async:
+            response_body, status_code = submit_job(command, value)
+            return jsonify(response_body), status_code
 
-                speedtest_output = speedtest_run_result.stdout.strip()
-                speedtest_stderr = speedtest_run_result.stderr.strip()
+        response_body, status_code = run_command(command, value)
+        response = jsonify(response_body)
+        if "retry_after_seconds" in response_body:
+            response.headers["Retry-After"] = str(response_body["retry_after_seconds"])
+        return response, status_code
+    except Exception as e:
+        log.error("Error on Laptop Slave API: %s", e)
+        return jsonify({"status": "error", "message": f"Internal Laptop error: {str(e)}"}), 500 # Ensure e is converted to string
+
+def stream_command_response(cmd):
+    """
+    Streams a shell command's output while it runs: server-sent events if the
+    client accepts text/event-stream, newline-delimited JSON otherwise. The last
+    frame carries the return code and wall/CPU time.
+    """
+    if request.accept_mimetypes.best_match(["application/x-ndjson", "text/event-stream"]) == "text/event-stream":
+        encode, mimetype = streaming.format_sse, "text/event-stream"
+    else:
+        encode, mimetype = streaming.format_ndjson, "application/x-ndjson"
 
-                if speedtest_stderr:
-                    print(f"Speedtest stderr: {speedtest_stderr}")
+    timeout, limits = exec_policy("execute_command")
+    try:
+        events = command_executor.stream(cmd, timeout=timeout, limits=limits, max_output_bytes=STREAM_MAX_OUTPUT_BYTES, chunk_size=STREAM_CHUNK_SIZE)
+    except ExecutorBusy as e:
+        return jsonify({"status": "error", "message": str(e)}), 503
 
-                if speedtest_output:
-                    try:
-                        speedtest_data = json.loads(speedtest_output)
-                        return jsonify({"status": "success", "speedtest_results": speedtest_data}), 200
-                    except json.JSONDecodeError:
-                        print("Warning: speedtest --json output was not valid JSON. Returning raw output.")
-                        return jsonify({"status": "success", "speedtest_raw_output": speedtest_output}), 200
-                else:
-                    return jsonify({"status": "error", "message": "Speedtest command returned no output.", "details": speedtest_stderr}), 500
-
-            except subprocess.TimeoutExpired:
-                print("Speedtest command timed out.")
-                return jsonify({"status": "error", "message": "Speedtest command timed out after 120 seconds."}), 500
-            except subprocess.CalledProcessError as e:
-                error_stdout = e.stdout.strip()
-                error_stderr = e.stderr.strip()
-                print(f"Error during speedtest (CalledProcessError): {e}")
-                return jsonify({"status": "error", "message": f"Speedtest failed (exit code {e.returncode}): {error_stderr}", "details": error_stdout}), 500
-            except FileNotFoundError:
-                return jsonify({"status": "error", "message": "speedtest or apt command not found. Ensure they are in PATH and speedtest is installed."}), 500
-            except Exception as e:
-                print(f"Unexpected error during speedtest: {e}")
-                return jsonify({"status": "error", "message": f"An unexpected error occurred during speedtest: {str(e)}"}), 500
-        elif command == "send_sensor_data": # Command to trigger sending sensor data to master
-            temp = round(random.uniform(20.0, 30.0), 2)
-            hum = round(random.uniform(50.0, 70.0), 2)
-            status = random.choice(["active", "warning"])
-
-            success, response = send_sensor_data_to_master(temp, hum, status)
-            if success:
-                return jsonify({"status": "success", "message": "Sensor data sent to master.", "master_response": response}), 200
-            else:
-                return jsonify({"status": "error", "message": "Failed to send sensor data to master.", "master_error": response}), 500
-        elif command == "trace_location":
-            ip_to_trace = value # Use the provided value as IP, if any
-
-            # If no IP is provided, try to get the public IP of the laptop
-            if not ip_to_trace:
-                try:
-                    public_ip_response = requests.get("https://ifconfig.me/ip")
-                    public_ip_response.raise_for_status()
-                    ip_to_trace = public_ip_response.text.strip()
-                    print(f"No IP provided, using public IP: {ip_to_trace}")
-                except requests.exceptions.RequestException as e:
-                    print(f"Error getting public IP: {e}")
-                    return jsonify({"status": "error", "message": f"Failed to get public IP: {str(e)}"}), 500
-
-            # Ensure ip_to_trace is a string before using it in the URL
-            ip_to_trace_str = str(ip_to_trace) if ip_to_trace is not None else ""
+    def generate():
+        try:
+            for event in events:
+                yield encode(event)
+        except OSError as e:
+            yield encode({"type": "error", "message": f"Error executing command: {str(e)}"})
 
-            try:
-                print(f"Tracing location for IP: {ip_to_trace_str}")
-                geo_response = requests.get(f"http://ip-api.com/json/{ip_to_trace_str}")
-                geo_response.raise_for_status()
-                geo_data = geo_response.json()
-
-                if geo_data is None:
-                    return jsonify({"status": "error", "message": "Failed to parse geolocation response as JSON (response was empty).", "details": geo_response.text}), 500
-
-
-                # Check for "fail" status from ip-api.com
-                if geo_data.get("status") == "fail":
-                    return jsonify({"status": "error", "message": geo_data.get("message", "Geolocation lookup failed"), "details": geo_data}), 400
-
-                # Filter and format the relevant fields
-                filtered_geo_data = {
-                    "query": geo_data.get("query"),
-                    "status": geo_data.get("status"),
-                    "country": geo_data.get("country"),
-                    "countryCode": geo_data.get("countryCode"),
-                    "region": geo_data.get("region"),
-                    "regionName": geo_data.get("regionName"),
-                    "city": geo_data.get("city"),
-                    "zip": geo_data.get("zip"),
-                    "lat": geo_data.get("lat"),
-                    "lon": geo_data.get("lon"),
-                    "timezone": geo_data.get("timezone"),
-                    "isp": geo_data.get("isp"),
-                    "org": geo_data.get("org"),
-                    "as": geo_data.get("as")
-                }
-
-                return jsonify({"status": "success", "ip_geolocation": filtered_geo_data}), 200
-            except requests.exceptions.RequestException as e:
-                print(f"Error tracing IP location: {e}")
-                return jsonify({"status": "error", "message": f"Failed to trace IP location: {str(e)}"}), 500
-            except json.JSONDecodeError as e:
-                 print(f"Error decoding JSON from ip-api.com: {e}")
-                 return jsonify({"status": "error", "message": f"Invalid JSON response from IP geolocation service: {str(e)}"}), 500
-            except Exception as e:
-                print(f"Unexpected error during IP location trace: {e}")
-                return jsonify({"status": "error", "message": f"An unexpected error occurred during IP location trace: {str(e)}"}), 500
-        elif command == "execute_command": # This is the new command handler
-            if value: # Check if a command string was provided
-                try:
-                    # Execute the command as a shell command
-                    # WARNING: This is highly insecure for untrusted input.
-                    # For a real application, you must sanitize 'value' or use a whitelist of commands.
-                    result = subprocess.run(value, shell=True, text=True, capture_output=True, check=False)
-
-                    # Return stdout, stderr, and return code
-                    return jsonify({
-                        "status": "success",
-                        "command_executed": value,
-                        "stdout": result.stdout.strip(),
-                        "stderr": result.stderr.strip(),
-                        "return_code": result.returncode
-                    }), 200
-                except FileNotFoundError:
-                    return jsonify({"status": "error", "message": f"Command not found: '{value.split(' ')[0]}'"}), 400
-                except Exception as e:
-                    return jsonify({"status": "error", "message": f"Error executing command: {str(e)}"}), 500
+    # X-Accel-Buffering stops reverse proxies from buffering the stream
+    return Response(generate(), mimetype=mimetype, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+batch_pool = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix="batch")
+batch_context = threading.local() # .deadline: perf_counter() deadline of the batch item running on this thread
+
+def run_timed_command(command, value, deadline=None):
+    start = time.perf_counter()
+    batch_context.deadline = deadline
+    try:
+        response_body, status_code = run_command(command, value)
+    except Exception as e:
+        response_body, status_code = {"status": "error", "message": f"Internal Laptop error: {str(e)}"}, 500
+    finally:
+        batch_context.deadline = None
+    if deadline is not None and status_code >= 500 and time.perf_counter() >= deadline:
+        status_code = 504 # Stopped at the batch deadline
+    return {
+        "command": command,
+        "value": value,
+        "status_code": status_code,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+        "response": response_body
+    }
+
+def runs_serially_in_batch(command):
+    return command in BATCH_SERIAL_COMMANDS or command_registry.cost_of(command) == LONG_RUNNING
+
+def batch_item_error(item, status_code, message):
+    command = item.get("command") if isinstance(item, dict) else None
+    return {
+        "command": command,
+        "value": item.get("value") if isinstance(item, dict) else None,
+        "status_code": status_code,
+        "elapsed_ms": 0,
+        "response": {"status": "error", "message": message}
+    }
+
+def run_batch(items):
+    """
+    Runs a list of {"command": ..., "value": ...} items and returns
+    (response_dict, http_status). Independent commands run in parallel;
+    results come back in request order. Malformed items fail on their own.
+    Every item's child processes are killed at BATCH_DEADLINE_SECONDS (their
+    timeouts are capped at the time left), and anything unfinished by then
+    is reported as 504.
+    """
+    if not isinstance(items, list) or not items:
+        return {"status": "error", "message": "A non-empty 'commands' list is required."}, 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return {"status": "error", "message": f"At most {BATCH_MAX_ITEMS} commands per batch."}, 400
+
+    start = time.perf_counter()
+    deadline = start + BATCH_DEADLINE_SECONDS
+    results = [None] * len(items)
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get("command"), str) or not item["command"]:
+            results[index] = batch_item_error(item, 400, "Every item needs a 'command' string.")
+    futures = {
+        index: batch_pool.submit(run_timed_command, item["command"], item.get("value"), deadline)
+        for index, item in enumerate(items)
+        if results[index] is None and not runs_serially_in_batch(item["command"])
+    }
+    for index, future in futures.items():
+        try:
+            results[index] = future.result(timeout=max(deadline - time.perf_counter(), 0))
+        except FutureTimeout:
+            future.cancel() # Only stops items still queued; running ones are killed by the capped timeout
+            results[index] = batch_item_error(items[index], 504, f"Did not finish within the {BATCH_DEADLINE_SECONDS} s batch deadline.")
+    for index, item in enumerate(items):
+        if results[index] is None:
+            if time.perf_counter() >= deadline:
+                results[index] = batch_item_error(item, 504, f"Not started: the {BATCH_DEADLINE_SECONDS} s batch deadline had passed.")
             else:
-                return jsonify({"status": "error", "message": "No command string provided to execute."}), 400
-        else:
-            return jsonify({"status": "error", "message": f"Unknown command: {command}"}), 400
+                results[index] = run_timed_command(item["command"], item.get("value"), deadline)
+
+    failed = sum(1 for result in results if result["status_code"] >= 400)
+    return {
+        "status": "success" if failed == 0 else "partial" if failed < len(results) else "error",
+        "results": results,
+        "failed": failed,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 2)
+    }, 200
 
+@route("/execute_batch", methods=["POST"])
+def execute_batch_flask_route():
+    # Runs several commands in one round trip. Body: {"commands": [{"command": ..., "value": ...}, ...]}
+    try:
+        data = request.get_json()
+        response_body, status_code = run_batch(data.get("commands") if isinstance(data, dict) else None)
+        return jsonify(response_body), status_code
     except Exception as e:
-        print(f"Error on Laptop Slave API: {e}")
-        return jsonify({"status": "error", "message": f"Internal Laptop error: {str(e)}"}), 500 # Ensure e is converted to string
+        log.error("Error on Laptop Slave API batch: %s", e)
+        return jsonify({"status": "error", "message": f"Internal Laptop error: {str(e)}"}), 500
 
-if __name__ == "__main__":
-    # Initialize the scheduler
+job_manager = JobManager(
+    run_command,
+    max_workers=JOB_MAX_WORKERS,
+    max_pending=JOB_MAX_PENDING,
+    max_finished_jobs=JOB_MAX_FINISHED,
+    retention_seconds=JOB_RETENTION_SECONDS,
+    max_output_chars=JOB_MAX_OUTPUT_CHARS
+)
+
+def submit_job(command, value):
+    """
+    Starts `command` as a background job and returns (response_dict, http_status)
+    with its job ID. Shared by the async /execute_command path and the command channel.
+    """
+    if not isinstance(command, str) or command_registry.get(command) is None:
+        return {"status": "error", "message": f"Unknown command: {command}"}, 400
+    try:
+        job = job_manager.submit(command, value)
+    except JobQueueFull as e:
+        return {"status": "error", "message": str(e)}, 503
+    return {"status": "accepted", "job_id": job.id, "job_url": f"/jobs/{job.id}"}, 202
+
+def get_job_status(job_id, offset=0):
+    """
+    Returns (response_dict, http_status) for one job, with only the output
+    written after `offset` (the previous poll's output_offset).
+    """
+    job = job_manager.get(job_id) if isinstance(job_id, str) else None
+    if job is None:
+        return {"status": "error", "message": f"Unknown or expired job: {job_id}"}, 404
+    if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+        return {"status": "error", "message": "'offset' must be a non-negative integer."}, 400
+    return {"status": "success", "job": job.to_dict(output_offset=offset)}, 200
+
+# Commands, batches and job requests pushed by the master over the outbound channel run through the same dispatch path
+command_channel = CommandChannel(
+    MASTER_API_BASE_URL,
+    THIS_DEVICE_ID,
+    run_command,
+    max_workers=COMMAND_CHANNEL_WORKERS,
+    poll_wait_seconds=COMMAND_CHANNEL_POLL_WAIT_SECONDS,
+    reconnect_max_seconds=COMMAND_CHANNEL_RECONNECT_MAX_SECONDS,
+    batch_runner=run_batch,
+    job_runner=submit_job,
+    job_status_runner=get_job_status
+)
+
+@route("/jobs", methods=["GET"])
+def list_jobs_flask_route():
+    jobs = [job.to_dict(include_result=False) for job in job_manager.list()]
+    for job in jobs:
+        job.pop("output") # Fetch /jobs/<job_id> for output
+    return jsonify({"status": "success", "jobs": jobs}), 200
+
+@route("/jobs/<job_id>", methods=["GET"])
+def get_job_flask_route(job_id):
+    # ?offset=N returns only output written after the previous poll's output_offset
+    response_body, status_code = get_job_status(job_id, request.args.get("offset", default=0, type=int))
+    return jsonify(response_body), status_code
+
+
+@route("/history", methods=["GET"])
+def get_history_flask_route():
+    # Same as the "history" command: ?minutes=N or ?start=&end=, optionally &fields=a,b and &points=N
+    response_body, status_code = handle_history(request.args.to_dict())
+    return jsonify(response_body), status_code
+
+
+profiler = SamplingProfiler(max_seconds=PROFILE_MAX_SECONDS)
+
+def render_metrics():
+    """
+    Command, subprocess, upload, scheduler and server counters, latency
+    histograms and startup timings in the Prometheus text format.
+    """
+    out = PrometheusWriter(prefix="agent_")
+    for handler in command_registry.handlers():
+        if not handler.calls:
+            continue
+        labels = {"command": handler.name, "cost": handler.cost}
+        out.counter("command_calls_total", "Commands dispatched.", handler.calls, labels)
+        out.counter("command_errors_total", "Commands answered with a 4xx/5xx status.", handler.errors, labels)
+        out.histogram("command_duration_seconds", "Command handler latency.", handler.latency, labels)
+    for command, gate in command_admission.stats().items():
+        labels = {"command": command}
+        for outcome in ("admitted", "queued", "coalesced", "rejected"):
+            out.counter("admission_total", "Admission decisions per command.", gate[outcome], dict(labels, outcome=outcome))
+        out.gauge("admission_running", "Admitted runs in progress.", gate["running"], labels)
+
+    exec_stats = command_executor.stats()
+    for outcome in ("started", "completed", "failed", "timed_out", "rejected"):
+        out.counter("subprocess_total", "Child processes by outcome.", exec_stats[outcome], {"outcome": outcome})
+    out.gauge("subprocess_running", "Child processes running now.", exec_stats["running"])
+    out.histogram("subprocess_duration_seconds", "Child process wall time.", command_executor.duration)
+
+    upload_stats = telemetry_uploader.stats()
+    out.counter("upload_readings_total", "Sensor readings by outcome.", upload_stats["readings_sent"], {"outcome": "sent"})
+    out.counter("upload_readings_total", "Sensor readings by outcome.", upload_stats["readings_dropped"], {"outcome": "dropped"})
+    out.counter("upload_readings_total", "Sensor readings by outcome.", upload_stats["readings_rejected"], {"outcome": "rejected"})
+    out.counter("upload_requests_total", "Upload requests to the master by outcome.", upload_stats["batches_sent"], {"outcome": "success"})
+    out.counter("upload_requests_total", "Upload requests to the master by outcome.", upload_stats["batches_failed"], {"outcome": "failure"})
+    out.counter("upload_bytes_total", "Request bytes sent to the master.", upload_stats["bytes_sent"])
+    out.gauge("upload_buffered_readings", "Readings waiting for the next batch.", upload_stats["buffered"])
+    out.histogram("upload_duration_seconds", "Upload request latency.", telemetry_uploader.latency)
+    if "spool" in upload_stats:
+        out.gauge("spool_depth_readings", "Readings spooled to disk awaiting replay.", upload_stats["spool"]["depth"])
+
+    with scheduler_job_lock:
+        job_lag = dict(scheduler_job_lag)
+        job_runs = dict(scheduler_job_runs)
+    for job_id, lag in job_lag.items():
+        out.histogram("scheduler_job_lag_seconds", "Delay between a job's scheduled and actual start.", lag, {"job": job_id})
+    for (job_id, outcome), count in job_runs.items():
+        out.counter("scheduler_job_runs_total", "Scheduler job runs by outcome.", count, {"job": job_id, "outcome": outcome})
+
+    server = active_server()
+    if server is not None:
+        server_stats = server.stats()
+        out.counter("http_requests_served_total", "HTTP requests served.", server_stats["served"])
+        out.counter("http_requests_rejected_total", "Connections turned away with a 503.", server_stats["rejected"])
+        out.gauge("http_pending_connections", "Connections queued or in service.", server_stats["pending"])
+    startup_stats = startup_timer.stats()
+    phases = dict(startup_stats["phases"], interpreter=startup_stats["interpreter_seconds"])
+    for phase, seconds in phases.items():
+        out.gauge("startup_phase_seconds", "Time spent in each agent startup phase.", seconds, {"phase": phase})
+    for name, seconds in startup_stats["events"].items():
+        out.gauge("startup_event_seconds", "Seconds from process start to a startup milestone.", seconds, {"event": name})
+    out.counter("log_records_dropped_total", "Log records dropped because the console fell behind.", logs.dropped_records())
+    return out.render()
+
+@route("/metrics", methods=["GET"])
+def metrics_flask_route():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+@route("/debug/profile", methods=["POST"])
+def profile_flask_route():
+    # Samples every thread for "seconds" and returns the hottest stacks; needs X-Agent-Token
+    if not AGENT_ADMIN_TOKEN:
+        return jsonify({"status": "error", "message": "Profiling is disabled; set AGENT_ADMIN_TOKEN to enable it."}), 403
+    token = request.headers.get("X-Agent-Token", "")
+    if not hmac.compare_digest(token.encode("utf-8"), AGENT_ADMIN_TOKEN.encode("utf-8")):
+        return jsonify({"status": "error", "message": "Missing or invalid X-Agent-Token."}), 401
+    data = request.get_json(silent=True) or {}
+    try:
+        seconds = float(data.get("seconds", 5))
+        interval_seconds = max(float(data.get("interval_ms", 5)), 1) / 1000
+        top = int(data.get("top", 20))
+    except (TypeError, ValueError) as e:
+        return jsonify({"status": "error", "message": f"Invalid profile parameters: {e}"}), 400
+    try:
+        profile = profiler.profile(seconds, interval_seconds=interval_seconds, top=top,
+                                   include_idle=bool(data.get("include_idle", False)))
+    except ProfilerBusy as e:
+        return jsonify({"status": "error", "message": str(e)}), 409
+    return jsonify({"status": "success", "profile": profile}), 200
+
+
+# Scheduler job lag (scheduled vs. actual start) and run outcomes, for /metrics
+scheduler_job_lag = {}
+scheduler_job_runs = {}
+scheduler_job_lock = threading.Lock()
+
+def record_scheduler_event(event):
+    from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES
+    if event.code == EVENT_JOB_SUBMITTED:
+        scheduled_at = event.scheduled_run_times[-1]
+        lag = max((datetime.now(scheduled_at.tzinfo) - scheduled_at).total_seconds(), 0.0)
+        outcome = "submitted"
+    else:
+        lag = None
+        outcome = {EVENT_JOB_ERROR: "error", EVENT_JOB_MISSED: "missed", EVENT_JOB_MAX_INSTANCES: "skipped"}[event.code]
+    with scheduler_job_lock:
+        if lag is not None:
+            if event.job_id not in scheduler_job_lag:
+                scheduler_job_lag[event.job_id] = Histogram()
+            histogram = scheduler_job_lag[event.job_id]
+        key = (event.job_id, outcome)
+        scheduler_job_runs[key] = scheduler_job_runs.get(key, 0) + 1
+    if lag is not None:
+        histogram.observe(lag)
+
+
+def start_scheduler():
+    """
+    Creates and starts the background scheduler with the agent's periodic jobs.
+    """
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES
     scheduler = BackgroundScheduler()
-    # Add the scheduled job
+    scheduler.add_listener(
+        record_scheduler_event,
+        EVENT_JOB_SUBMITTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES
+    )
+    if SAMPLING_ENABLED:
+        scheduler.add_job(
+            func=sensor_sampler.sample,
+            trigger="interval",
+            seconds=SAMPLE_INTERVAL_SECONDS,
+            id="sensor_sampler",
+            name="Sample sensors into the current report window",
+            max_instances=1,
+            coalesce=True
+        )
     scheduler.add_job(
         func=collect_and_send_sensor_data,
         trigger="interval",
         seconds=SENSOR_DATA_SEND_INTERVAL_SECONDS,
+        next_run_time=datetime.now() + timedelta(seconds=FIRST_SENSOR_REPORT_DELAY_SECONDS),
         id="sensor_data_collector",
         name="Collect and send sensor data to master"
     )
-    # Start the scheduler
+    if HISTORY_ENABLED:
+        scheduler.add_job(
+            func=record_history_point,
+            trigger="interval",
+            seconds=HISTORY_RECORD_INTERVAL_SECONDS,
+            id="history_recorder",
+            name="Record device metrics into local history",
+            max_instances=1,
+            coalesce=True
+        )
+    if UPLOAD_BATCHING_ENABLED:
+        scheduler.add_job(
+            func=flush_telemetry_uploads,
+            trigger="interval",
+            seconds=UPLOAD_FLUSH_CHECK_INTERVAL_SECONDS,
+            id="telemetry_flush",
+            name="Upload batched sensor data to master"
+        )
+    if SPOOL_ENABLED:
+        scheduler.add_job(
+            func=replay_spooled_readings,
+            trigger="interval",
+            seconds=SPOOL_REPLAY_CHECK_INTERVAL_SECONDS,
+            id="spool_replay",
+            name="Replay spooled sensor data to master"
+        )
     scheduler.start()
-    print(f"Scheduled sensor data collection to run every {SENSOR_DATA_SEND_INTERVAL_SECONDS} seconds.")
+    log.info("Scheduled sensor data collection to run every %s seconds.", SENSOR_DATA_SEND_INTERVAL_SECONDS)
+    return scheduler
 
-    # Run the Flask app
-    app.run(host="0.0.0.0", port=SLAVE_API_PORT, debug=True, use_reloader=False)
+def shutdown_agent(scheduler):
+    """
+    Stops background work after the HTTP server has drained: waits for running
+    jobs, closes the command channel, stops the scheduler and uploads whatever
+    readings are still buffered (they are spooled to disk if the master is
+    unreachable).
+    """
+    unfinished = job_manager.drain(SERVER_DRAIN_TIMEOUT_SECONDS)
+    if unfinished:
+        log.warning("%s background jobs still running at shutdown; abandoning them.", unfinished)
+    job_manager.shutdown(wait=False)
+    command_channel.stop()
+    scheduler.shutdown(wait=True)
+    if telemetry_uploader.pending():
+        telemetry_uploader.flush()
+    if telemetry_uploader.spool is not None:
+        telemetry_uploader.spool.close()
+    log.info("Agent stopped.")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Device agent: executes commands from the master and reports sensor data.")
+    parser.add_argument("--server", choices=["threaded", "dev"], default=SERVER_MODE,
+                        help="'threaded' is a pooled production server; 'dev' is Flask's development server")
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="HTTP worker threads")
+    parser.add_argument("--max-pending", type=int, default=SERVER_MAX_PENDING_CONNECTIONS,
+                        help="Connections queued or in service before new ones get a 503")
+    parser.add_argument("--backlog", type=int, default=SERVER_LISTEN_BACKLOG, help="listen() backlog")
+    parser.add_argument("--port", type=int, default=SLAVE_API_PORT)
+    parser.add_argument("--debug", action="store_true", help="Enable the Flask debugger (dev server only)")
+    parser.add_argument("--channel", action="store_true", default=COMMAND_CHANNEL_ENABLED,
+                        help="Also take commands over an outbound long-poll channel to the master")
+    parser.add_argument("--log-level", default=LOG_LEVEL, choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    parser.add_argument("--spool-path", default=SPOOL_PATH,
+                        help="SQLite file for readings awaiting upload (also AGENT_SPOOL_PATH)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    startup_timer.mark("import")
+    args = parse_args()
+    logs.setup_logging(args.log_level, LOG_QUEUE_SIZE)
+    logging.getLogger("apscheduler").setLevel(logging.WARNING) # It logs every job run at INFO
+    if SPOOL_ENABLED:
+        open_spool(args.spool_path)
+    # Both run while the scheduler and HTTP server come up
+    if STARTUP_ONLINE_REPORT_ENABLED:
+        threading.Thread(target=send_online_report, name="online-report", daemon=True).start()
+    threading.Thread(target=warm_host_facts, name="host-facts", daemon=True).start()
+
+    scheduler = start_scheduler()
+    if args.channel:
+        command_channel.start()
+    startup_timer.mark("scheduler")
+    create_app()
+    startup_timer.mark("app")
+
+    if args.server == "dev":
+        # Flask's development server, for local debugging only; it binds inside app.run()
+        log.info("Startup: %s", startup_timer.summary())
+        app.run(host="0.0.0.0", port=args.port, debug=args.debug, use_reloader=False)
+        shutdown_agent(scheduler)
+    else:
+        import serving
+        server = serving.PooledWSGIServer(
+            "0.0.0.0", args.port, app,
+            workers=args.workers,
+            max_pending=max(args.max_pending, args.workers),
+            backlog=args.backlog,
+            keepalive_timeout=SERVER_KEEPALIVE_TIMEOUT_SECONDS
+        )
+        startup_timer.mark("bind")
+        log.info("Serving on port %s with %s workers (max %s pending connections).", args.port, args.workers, server.max_pending)
+        log.info("Startup: %s", startup_timer.summary())
+        serving.serve(server, drain_timeout_seconds=SERVER_DRAIN_TIMEOUT_SECONDS, on_shutdown=lambda: shutdown_agent(scheduler))
+    logs.stop_logging()
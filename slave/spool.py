@@ -0,0 +1,78 @@
+# spool.py
+# On-disk store-and-forward queue for sensor readings the master could not accept.
+import json
+import sqlite3
+import threading
+
+
+class ReadingSpool:
+    """
+    Append-only SQLite queue of readings, replayed oldest first. Holds at
+    most `max_readings`; appending beyond that evicts the oldest rows so the
+    SD card can't fill up.
+    """
+
+    def __init__(self, path, max_readings=100000):
+        self.path = path
+        self.max_readings = max_readings
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL + NORMAL: one fsync per checkpoint rather than per insert, easier on SD cards
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS readings (id INTEGER PRIMARY KEY, body TEXT NOT NULL)")
+        self._depth = self._conn.execute("SELECT COUNT(*) FROM readings").fetchone()[0]
+        self._stats = {"spooled": 0, "replayed": 0, "evicted": 0}
+
+    def append(self, readings):
+        if not readings:
+            return
+        rows = [(json.dumps(reading, separators=(",", ":")),) for reading in readings]
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.executemany("INSERT INTO readings (body) VALUES (?)", rows)
+                self._depth += len(rows)
+                self._stats["spooled"] += len(rows)
+                overflow = self._depth - self.max_readings
+                if overflow > 0:
+                    self._conn.execute(
+                        "DELETE FROM readings WHERE id IN (SELECT id FROM readings ORDER BY id LIMIT ?)", (overflow,)
+                    )
+                    self._depth -= overflow
+                    self._stats["evicted"] += overflow
+
+    def peek(self, limit):
+        """
+        The oldest `limit` readings as [(spool_id, reading), ...]; pass the
+        last delivered spool_id to ack().
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT id, body FROM readings ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [(spool_id, json.loads(body)) for spool_id, body in rows]
+
+    def ack(self, last_id):
+        """
+        Removes every reading up to and including `last_id` once the master has it.
+        """
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                deleted = self._conn.execute("DELETE FROM readings WHERE id <= ?", (last_id,)).rowcount
+                self._depth -= deleted
+                self._stats["replayed"] += deleted
+
+    def depth(self):
+        with self._lock:
+            return self._depth
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["depth"] = self._depth
+        stats["max_readings"] = self.max_readings
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,62 @@
+# startup.py
+# Cold-start helpers: per-phase startup timings, including interpreter startup from /proc.
+import os
+import time
+
+
+def process_age_seconds():
+    """
+    Seconds since this process started, from /proc (None where it isn't available).
+    """
+    try:
+        with open("/proc/self/stat", "r") as f:
+            fields = f.read().rsplit(")", 1)[1].split() # The command name may contain spaces
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK") # Field 22, starttime
+    except (OSError, ValueError, IndexError):
+        return None
+    return max(uptime - started, 0.0)
+
+
+class StartupTimer:
+    """
+    Splits agent startup into consecutive phases (mark) plus one-off events
+    such as the first report going out (event), all measured from
+    `started_at`, a time.perf_counter() taken before the agent's imports.
+    Interpreter startup before that point is read from /proc when possible.
+    """
+
+    def __init__(self, started_at):
+        self.started_at = started_at
+        age = process_age_seconds()
+        self.interpreter_seconds = None if age is None else max(age - (time.perf_counter() - started_at), 0.0)
+        self.phases = []
+        self.events = {}
+        self._last = started_at
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def event(self, name):
+        self.events[name] = time.perf_counter() - self.started_at
+
+    def since_process_start(self, seconds):
+        return seconds + (self.interpreter_seconds or 0.0)
+
+    def summary(self):
+        parts = []
+        if self.interpreter_seconds is not None:
+            parts.append(f"interpreter {self.interpreter_seconds * 1000:.0f} ms")
+        parts += [f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in self.phases]
+        total = self.since_process_start(self._last - self.started_at)
+        return f"{', '.join(parts)}; ready {total * 1000:.0f} ms after process start"
+
+    def stats(self):
+        return {
+            "interpreter_seconds": self.interpreter_seconds,
+            "phases": dict(self.phases),
+            "events": {name: self.since_process_start(seconds) for name, seconds in self.events.items()},
+        }
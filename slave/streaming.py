@@ -0,0 +1,118 @@
+# streaming.py
+# Runs a shell command and yields its output incrementally, in constant memory.
+import codecs
+import json
+import os
+import selectors
+import subprocess
+import time
+
+
+def stream_command(cmd, max_output_bytes=1024 * 1024, chunk_size=4096, popen=subprocess.Popen,
+                   timeout=None, kill=None, drain_seconds=2.0):
+    """
+    Generator that runs `cmd` through the shell and yields event dicts as
+    output arrives:
+
+        {"type": "stdout" | "stderr", "data": "..."}
+        {"type": "truncated", "limit_bytes": N}   (once, when the cap is hit)
+        {"type": "timeout", "timeout_seconds": N}  (once, if `timeout` expires)
+        {"type": "exit", "return_code": ..., "wall_seconds": ..., "cpu_seconds": ...,
+         "output_bytes": ..., "discarded_bytes": ..., "truncated": bool, "timed_out": bool}
+
+    At most `max_output_bytes` of output are forwarded; anything after that
+    is read and discarded so the child never blocks on a full pipe. Only one
+    `chunk_size` read is held in memory at a time. When `timeout` expires,
+    or the consumer stops iterating (e.g. the HTTP client disconnects), the
+    process is killed with `kill(process)` (default: process.kill()). After
+    a timeout the pipes are read for at most `drain_seconds` more, in case
+    something that escaped the kill (e.g. via setsid) still holds them open.
+    """
+    kill = kill or (lambda p: p.kill())
+    start = time.monotonic()
+    deadline = start + timeout if timeout is not None else None
+    process = popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    selector = selectors.DefaultSelector()
+    decoders = {}
+    for name, stream in (("stdout", process.stdout), ("stderr", process.stderr)):
+        selector.register(stream, selectors.EVENT_READ, name)
+        decoders[name] = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    forwarded = 0
+    discarded = 0
+    truncated = False
+    timed_out = False
+    reaped = False
+    try:
+        while selector.get_map():
+            wait = None
+            if deadline is not None:
+                wait = deadline - time.monotonic()
+                if wait <= 0:
+                    if timed_out:
+                        break # Drain period over; the pipes are closed below
+                    kill(process)
+                    timed_out = True
+                    deadline = time.monotonic() + drain_seconds
+                    wait = drain_seconds
+                    yield {"type": "timeout", "timeout_seconds": timeout}
+            for key, _ in selector.select(wait):
+                chunk = os.read(key.fileobj.fileno(), chunk_size)
+                if not chunk:
+                    selector.unregister(key.fileobj)
+                    continue
+                if truncated:
+                    discarded += len(chunk)
+                    continue
+                room = max_output_bytes - forwarded
+                if len(chunk) > room:
+                    discarded += len(chunk) - room
+                    chunk = chunk[:room]
+                    truncated = True
+                forwarded += len(chunk)
+                text = decoders[key.data].decode(chunk, final=truncated)
+                if text:
+                    yield {"type": key.data, "data": text}
+                if truncated:
+                    yield {"type": "truncated", "limit_bytes": max_output_bytes}
+
+        try:
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            cpu_seconds = round(usage.ru_utime + usage.ru_stime, 3)
+        except ChildProcessError:
+            # Already reaped elsewhere; the exit code is known but the rusage is gone
+            process.wait()
+            cpu_seconds = None
+        reaped = True
+        yield {
+            "type": "exit",
+            "return_code": process.returncode,
+            "wall_seconds": round(time.monotonic() - start, 3),
+            "cpu_seconds": cpu_seconds,
+            "output_bytes": forwarded,
+            "discarded_bytes": discarded,
+            "truncated": truncated,
+            "timed_out": timed_out
+        }
+    finally:
+        selector.close()
+        process.stdout.close()
+        process.stderr.close()
+        if not reaped:
+            kill(process)
+            process.wait()
+
+
+def format_sse(event):
+    """
+    Encodes an event as a server-sent events frame.
+    """
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+def format_ndjson(event):
+    """
+    Encodes an event as one line of newline-delimited JSON.
+    """
+    return json.dumps(event) + "\n"
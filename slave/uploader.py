@@ -0,0 +1,399 @@
+# uploader.py
+# Buffers sensor readings and ships them to the master in batches.
+import gzip
+import json
+import logging
+import random
+import threading
+import time
+
+from metrics import Histogram
+
+log = logging.getLogger(__name__)
+
+
+# Answers that mean the readings themselves are at fault; resending the same reading won't help
+REJECTION_STATUS_CODES = (400, 413, 422)
+
+
+class TelemetryUploader:
+    """
+    Buffers sensor readings in memory and flushes them to the master as a
+    single gzip-compressed batch, either when the buffer reaches
+    `max_batch_size` readings or when the oldest reading is older than
+    `max_batch_age_seconds`.
+
+    All requests go through one pooled keep-alive `requests.Session`,
+    created (and `requests` imported) on the first upload so it doesn't
+    slow down agent startup. Each batch POST carries at most
+    `max_batch_bytes` of (uncompressed) JSON, since the master's body limit
+    applies after gunzip. With `batching=False` every reading is posted straight away to the
+    original `/sensor_data/<device_id>/report` route.
+
+    With a `spool` (spool.ReadingSpool), readings the master does not
+    accept are written to disk instead of being retried from memory, and
+    replay() sends them back in order with exponential backoff. While the
+    spool holds a backlog new readings queue behind it, so the master
+    always receives them oldest first.
+
+    A 400, 413 or 422 for a batch splits it in halves until the offending
+    reading is on its own; only then is that reading dropped and counted as
+    rejected, so one bad reading can't block the spool forever. Any other
+    4xx (such as a JSON 404 before the device is registered) keeps the
+    readings for a retry. Whenever readings are dropped the call returns
+    success False, with the count under "rejected".
+    """
+
+    def __init__(self, base_url, device_id, batching=True, max_batch_size=50,
+                 max_batch_age_seconds=60, max_buffered_readings=1000,
+                 compress=True, timeout_seconds=10, spool=None, replay_batch_size=500,
+                 replay_backoff_initial_seconds=5, replay_backoff_max_seconds=600,
+                 batch_route_recheck_seconds=3600, max_batch_bytes=64 * 1024):
+        self.base_url = base_url
+        self.device_id = device_id
+        self.batching = batching
+        self.max_batch_size = max_batch_size
+        self.max_batch_age_seconds = max_batch_age_seconds
+        self.max_buffered_readings = max_buffered_readings
+        self.compress = compress
+        self.timeout_seconds = timeout_seconds
+        self.spool = spool
+        self.replay_batch_size = replay_batch_size
+        self.replay_backoff_initial_seconds = replay_backoff_initial_seconds
+        self.replay_backoff_max_seconds = replay_backoff_max_seconds
+        self.batch_route_recheck_seconds = batch_route_recheck_seconds
+        self.max_batch_bytes = max_batch_bytes
+
+        self.session = None
+
+        self._buffer = []
+        self._oldest_buffered_at = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._batch_route_missing_since = None # Set while the master has no batch route
+        self._replay_backoff_seconds = 0
+        self._next_replay_at = 0.0
+        self.latency = Histogram()
+
+        self._stats = {
+            "readings_sent": 0,
+            "readings_dropped": 0,
+            "readings_rejected": 0,
+            "batches_sent": 0,
+            "batches_failed": 0,
+            "bytes_sent": 0,
+            "last_flush_latency_ms": None,
+            "total_flush_latency_ms": 0.0,
+            "replay_runs": 0,
+            "replayed_readings": 0,
+            "total_replay_seconds": 0.0,
+            "last_replay_readings_per_second": None,
+        }
+
+    @property
+    def report_url(self):
+        return f"{self.base_url}/sensor_data/{self.device_id}/report"
+
+    @property
+    def batch_report_url(self):
+        return f"{self.base_url}/sensor_data/{self.device_id}/report_batch"
+
+    def submit(self, reading, flush=False):
+        """
+        Queues a reading for upload. Returns (success, response) like
+        `send_sensor_data_to_master` always has. When batching is disabled,
+        or `flush` is True, the upload happens before returning.
+        """
+        if not self.batching:
+            with self._flush_lock:
+                return self._deliver([reading])
+
+        with self._lock:
+            if not self._buffer:
+                self._oldest_buffered_at = time.monotonic()
+            self._buffer.append(reading)
+            self._trim_buffer_locked()
+            buffered = len(self._buffer)
+
+        if flush or buffered >= self.max_batch_size:
+            return self.flush()
+        return True, {"message": "Reading queued for batch upload.", "buffered": buffered}
+
+    def flush_if_due(self):
+        """
+        Flushes the buffer if its oldest reading has waited longer than
+        `max_batch_age_seconds`. Meant to be called from the scheduler.
+        """
+        with self._lock:
+            due = (self._oldest_buffered_at is not None and
+                   time.monotonic() - self._oldest_buffered_at >= self.max_batch_age_seconds)
+        if due:
+            return self.flush()
+        return True, {"message": "Nothing due for upload."}
+
+    def flush(self):
+        """
+        Sends everything currently buffered as one batch. On failure the
+        readings go to the spool, or without one are put back at the front
+        of the buffer for the next flush.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = self._buffer[:self.max_batch_size]
+                del self._buffer[:len(batch)]
+                if not self._buffer:
+                    self._oldest_buffered_at = None
+            if not batch:
+                return True, {"message": "Nothing to upload."}
+
+            if self.spool is not None:
+                return self._deliver(batch)
+
+            success, response, unsent = self._send(batch)
+            if unsent:
+                with self._lock:
+                    self._buffer[:0] = unsent
+                    if self._oldest_buffered_at is None:
+                        self._oldest_buffered_at = time.monotonic()
+                    self._trim_buffer_locked()
+            return success, response
+
+    def replay(self, max_batches=20):
+        """
+        Sends spooled readings to the master, oldest first, in batches of
+        `replay_batch_size`, until the spool is empty, a send fails or
+        `max_batches` batches have gone out. After a failure nothing is
+        attempted until the backoff delay has passed. Meant to be called
+        from the scheduler.
+        """
+        if self.spool is None:
+            return True, {"message": "No spool configured."}
+        with self._flush_lock:
+            return self._replay_locked(max_batches)
+
+    def _deliver(self, batch):
+        # Caller holds _flush_lock. Without a spool this is a plain send.
+        if self.spool is None:
+            success, response, _ = self._send(batch)
+            return success, response
+        if self.spool.depth():
+            # Older readings are waiting: queue behind them to keep the order
+            self.spool.append(batch)
+            return self._replay_locked(max_batches=1)
+        success, response, unsent = self._send(batch)
+        if unsent:
+            self.spool.append(unsent)
+            self._schedule_replay_retry()
+            response = dict(response, spooled=len(unsent))
+        return success, response
+
+    def _replay_locked(self, max_batches):
+        retry_in = self._next_replay_at - time.monotonic()
+        if retry_in > 0:
+            return False, {"message": "Master unreachable, readings spooled for replay.",
+                           "spooled": self.spool.depth(), "retry_in_seconds": round(retry_in, 1)}
+
+        replayed = rejected = 0
+        success, response = True, {"message": "Spool is empty."}
+        start = time.perf_counter()
+        for _ in range(max_batches):
+            rows = self.spool.peek(self.replay_batch_size)
+            if not rows:
+                break
+            _, response, unsent = self._send([reading for _, reading in rows])
+            delivered = len(rows) - len(unsent)
+            if delivered:
+                self.spool.ack(rows[delivered - 1][0])
+                replayed += delivered - response.get("rejected", 0)
+                rejected += response.get("rejected", 0)
+            if unsent:
+                success = False
+                self._schedule_replay_retry()
+                break
+            self._replay_backoff_seconds = 0
+        elapsed = time.perf_counter() - start
+
+        if replayed:
+            with self._lock:
+                self._stats["replay_runs"] += 1
+                self._stats["replayed_readings"] += replayed
+                self._stats["total_replay_seconds"] += elapsed
+                self._stats["last_replay_readings_per_second"] = round(replayed / elapsed, 1) if elapsed else None
+            log.info("Replayed %d spooled readings to master (%d still spooled).", replayed, self.spool.depth())
+        if rejected:
+            success = False
+            response = dict(response, rejected=rejected)
+        return success, dict(response, replayed=replayed, spooled=self.spool.depth())
+
+    def _schedule_replay_retry(self):
+        self._replay_backoff_seconds = min(
+            max(self._replay_backoff_seconds * 2, self.replay_backoff_initial_seconds),
+            self.replay_backoff_max_seconds
+        )
+        # Jitter so a fleet coming back online doesn't replay in lockstep
+        delay = self._replay_backoff_seconds * random.uniform(0.75, 1.0)
+        self._next_replay_at = time.monotonic() + delay
+
+    def _send(self, batch):
+        """
+        Posts `batch` to the batch route in chunks of at most
+        `max_batch_bytes`, or one reading at a time to the single route on
+        masters without it. Returns (success, response, unsent) where
+        `unsent` is the tail of the batch that didn't go out. Rejected
+        readings are not in `unsent`, but make success False and are
+        counted in response["rejected"].
+        """
+        remaining = list(batch)
+        rejected = 0
+        success, response = True, {"message": "Nothing to upload."}
+        max_readings = len(remaining)
+        while remaining and self._batch_route_usable():
+            chunk = remaining[:min(self._readings_within_limit(remaining), max_readings)]
+            success, response = self._post(self.batch_report_url, {"readings": chunk}, len(chunk))
+            status_code = response.get("status_code")
+            if success:
+                self._batch_route_missing_since = None
+                max_readings = min(max_readings * 2, len(batch))
+            elif status_code == 404 and "detail" not in response:
+                # Express answers unknown routes with an HTML 404; a JSON 404 comes from the
+                # route itself (e.g. "Device not found") and says nothing about batching.
+                # Older master without the batch route: fall back to one POST per reading.
+                log.warning("Master has no batch report route, falling back to single reports.")
+                self._batch_route_missing_since = time.monotonic()
+                break
+            elif status_code in REJECTION_STATUS_CODES and len(chunk) > 1:
+                # Body too large, or a bad reading somewhere in it: retry in halves, which
+                # narrows a bad reading down to itself before it is dropped
+                max_readings = len(chunk) // 2
+                continue
+            elif status_code in REJECTION_STATUS_CODES:
+                rejected += self._reject(chunk, response)
+            else:
+                return False, _with_rejected(response, rejected), remaining
+            del remaining[:len(chunk)]
+
+        for index, reading in enumerate(remaining):
+            success, response = self._post(self.report_url, reading, 1)
+            if not success:
+                if response.get("status_code") not in REJECTION_STATUS_CODES:
+                    return False, _with_rejected(response, rejected), remaining[index:]
+                rejected += self._reject([reading], response)
+        if rejected:
+            success = False
+        return success, _with_rejected(response, rejected), []
+
+    def _readings_within_limit(self, readings):
+        # How many leading readings fit in one batch body (always at least one)
+        size = len('{"readings":[]}')
+        for count, reading in enumerate(readings):
+            size += len(json.dumps(reading, separators=(",", ":"))) + 1
+            if size > self.max_batch_bytes:
+                return max(count, 1)
+        return len(readings)
+
+    def _reject(self, readings, response):
+        log.warning("Master rejected %d readings (status %s), dropping them: %s",
+                    len(readings), response.get("status_code"), response.get("detail") or response.get("error"))
+        with self._lock:
+            self._stats["readings_rejected"] += len(readings)
+        return len(readings)
+
+    def _batch_route_usable(self):
+        # After a fallback the batch route is tried again now and then, in case the master was upgraded
+        missing_since = self._batch_route_missing_since
+        return missing_since is None or time.monotonic() - missing_since >= self.batch_route_recheck_seconds
+
+    def pending(self):
+        with self._lock:
+            return len(self._buffer)
+
+    def stats(self):
+        """
+        Upload counters, including average bytes per reading and flush latency.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["buffered"] = len(self._buffer)
+        sent = stats["readings_sent"]
+        batches = stats["batches_sent"] + stats["batches_failed"]
+        stats["bytes_per_reading"] = round(stats["bytes_sent"] / sent, 1) if sent else None
+        stats["avg_flush_latency_ms"] = round(stats.pop("total_flush_latency_ms") / batches, 2) if batches else None
+        replay_seconds = stats.pop("total_replay_seconds")
+        stats["replay_readings_per_second"] = (
+            round(stats["replayed_readings"] / replay_seconds, 1) if replay_seconds else None
+        )
+        stats["batching"] = self.batching
+        stats["batch_route_available"] = self._batch_route_missing_since is None
+        stats["compress"] = self.compress
+        if self.spool is not None:
+            stats["spool"] = self.spool.stats()
+            stats["spool"]["replay_backoff_seconds"] = self._replay_backoff_seconds
+        return stats
+
+    def _trim_buffer_locked(self):
+        overflow = len(self._buffer) - self.max_buffered_readings
+        if overflow > 0:
+            del self._buffer[:overflow]
+            self._stats["readings_dropped"] += overflow
+
+    def _get_session(self):
+        with self._lock:
+            if self.session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update({'Content-Type': 'application/json'})
+                # In a real scenario, you'd add authentication headers here (e.g., a signed JWT from this device)
+                # session.headers['Authorization'] = 'Bearer YOUR_DEVICE_JWT'
+                self.session = session
+            return self.session
+
+    def _post(self, url, payload, reading_count):
+        import requests
+        session = self._get_session()
+        body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        headers = {}
+        if self.compress:
+            body = gzip.compress(body)
+            headers['Content-Encoding'] = 'gzip'
+
+        start = time.perf_counter()
+        try:
+            response = session.post(url, data=body, headers=headers, timeout=self.timeout_seconds)
+            response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
+            result = response.json()
+            success = True
+        except requests.exceptions.RequestException as e:
+            status_code = e.response.status_code if e.response is not None else None
+            log.warning("Error sending sensor data to master: %s", e)
+            result = {"error": str(e), "status_code": status_code}
+            if e.response is not None and "json" in e.response.headers.get("Content-Type", ""):
+                try:
+                    result["detail"] = e.response.json()
+                except ValueError:
+                    pass
+            success = False
+        except ValueError as e:
+            log.warning("Master returned a non-JSON response: %s", e)
+            result = {"error": f"Invalid JSON response from master: {e}"}
+            success = False
+        latency_ms = (time.perf_counter() - start) * 1000
+        self.latency.observe(latency_ms / 1000)
+
+        with self._lock:
+            self._stats["last_flush_latency_ms"] = round(latency_ms, 2)
+            self._stats["total_flush_latency_ms"] += latency_ms
+            if success:
+                self._stats["batches_sent"] += 1
+                self._stats["readings_sent"] += reading_count
+                self._stats["bytes_sent"] += len(body)
+            else:
+                self._stats["batches_failed"] += 1
+        return success, result
+
+
+def _with_rejected(response, rejected):
+    return dict(response, rejected=rejected) if rejected else response